@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -31,6 +32,7 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
+    'daphne',  # ASGI runserver, needed for WebSockets in development
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -38,13 +40,17 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
+    'rest_framework.authtoken',
     'corsheaders',
     'users',  
     'topics',  
     'conversations',  
+    'search',
+    'perf',
 ]
 
 #AUTHENTICATION_BACKENDS = ['users.backends.ApprovedUserBackend']
+AUTHENTICATION_BACKENDS = ['users.backends.CachedModelBackend']  # session users from users.user_cache
 AUTH_USER_MODEL = 'users.CustomUser'
 
 
@@ -53,10 +59,13 @@ AUTH_USER_MODEL = 'users.CustomUser'
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'perf.middleware.MetricsMiddleware',  # request metrics for /metrics
+    'perf.middleware.SQLInstrumentationMiddleware',  # off unless PERF_SQL_INSTRUMENTATION
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'perf.middleware.ProfilerMiddleware',  # admins only, with X-Profile or ?_profile
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -64,11 +73,16 @@ MIDDLEWARE = [
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # Message posting limits (conversations.throttling), unless set on the Category
+    'DEFAULT_THROTTLE_RATES': {
+        'message_user': '30/min',
+        'message_topic': '120/min',
+    },
 }
 
 # CORS settings for frontend
@@ -101,6 +115,28 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'comm_app.wsgi.application'
+ASGI_APPLICATION = 'comm_app.asgi.application'
+
+
+# Channels (WebSocket push of new messages)
+# The in-memory layer only reaches sockets in the same process; set REDIS_URL
+# to fan out across several ASGI workers.
+
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [REDIS_URL]},
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        }
+    }
 
 
 # Database
@@ -114,6 +150,43 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Holds per-user permission snapshots (see topics/permission_cache.py).
+# Use a shared backend (e.g. Redis) when running more than one process.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pixelflow-comms',
+    }
+}
+
+PERMISSION_SNAPSHOT_TIMEOUT = 60 * 60  # seconds
+USER_RECORD_CACHE_TIMEOUT = 15 * 60  # seconds; cached user records for authentication
+MESSAGE_RATE_CACHE_TIMEOUT = 5 * 60  # seconds; cached per-topic posting limits
+
+# Login and code verification: token buckets of (burst, seconds to refill it)
+AUTH_THROTTLE_RATES = {
+    'ip': (30, 60),
+    'username': (5, 60),
+}
+AUTH_HASH_WORKERS = 2  # password hashing threads per process
+AUTH_HASH_QUEUE = 16  # hashes waiting beyond that are refused with a 503
+RECENT_ACTIVITY_CACHE_TIMEOUT = 15  # seconds; 0 disables the per-user feed cache
+TOPIC_COUNTER_FOLD_INTERVAL = 5  # seconds between background folds of topic counter deltas; 0 leaves them to cron
+UNREAD_HISTORY_SECONDS = 24 * 60 * 60  # older messages of a topic never read count as read
+
+
+# Full-text search (see search/backends.py)
+# The backend follows the database vendor: FTS5 on SQLite, tsvector on
+# PostgreSQL, substring matching elsewhere.  Set SEARCH_BACKEND to a dotted
+# class path to override it.  Run `manage.py rebuild_search_index` after
+# changing SEARCH_CONFIG.
+
+SEARCH_CONFIG = 'english'  # PostgreSQL text search configuration
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -154,3 +227,47 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Performance instrumentation (see perf/)
+# PERF_SQL_INSTRUMENTATION=1 adds per-request SQL counts and timings as
+# Server-Timing / X-DB-* response headers, and appends queries slower than
+# PERF_SLOW_QUERY_MS, with the code that ran them, to slow_queries.log.
+
+PERF_SQL_INSTRUMENTATION = os.environ.get('PERF_SQL_INSTRUMENTATION') == '1'
+PERF_SLOW_QUERY_MS = 100
+PERF_PROFILE_SAMPLE_INTERVAL = 0.001  # seconds between stack samples of a profiled request
+
+# Request metrics served at /metrics in Prometheus format.  Every worker
+# process writes its own file in PERF_METRICS_DIR; workers of one deployment
+# must share it, and nothing else should write there.
+PERF_METRICS = True
+PERF_METRICS_DIR = os.environ.get('PERF_METRICS_DIR') or BASE_DIR / 'var' / 'metrics'
+PERF_METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']  # plus admins, from anywhere
+
+TEST_RUNNER = 'perf.testing.TestRunner'  # keeps test metrics out of PERF_METRICS_DIR
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'timestamped': {'format': '%(asctime)s %(message)s'},
+    },
+    'handlers': {
+        'slow_queries': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': BASE_DIR / 'slow_queries.log',
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'delay': True,  # no file until something is logged
+            'formatter': 'timestamped',
+        },
+    },
+    'loggers': {
+        'perf.slow_queries': {
+            'handlers': ['slow_queries'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
@@ -27,4 +27,6 @@ urlpatterns = [
     path('', login_required(RedirectView.as_view(pattern_name='dashboard'))),  # Will redirect to login if not authenticated
     path('api/topics/', include('topics.urls')),
     path('api/conversations/', include('conversations.urls')),
+    path('api/search/', include('search.urls')),
+    path('', include('perf.urls')),
 ]
\ No newline at end of file
@@ -0,0 +1,278 @@
+"""
+Cold storage for the messages of archived topics.
+
+archive_topic_messages() moves a topic's messages, oldest first and one
+transaction per batch, out of the message table into ArchivedMessageSegment
+rows: one zlib-compressed JSON blob per batch, holding each message with
+its tagged users and their mention read state.  The messages also leave the
+search index, so the hot table and its indexes only hold live topics.
+restore_topic_messages() puts them back, with their original ids.  Both
+stop as soon as the topic's is_archived flag no longer asks for them.
+
+Archiving or unarchiving a topic only sets the flag; schedule_archive_sync()
+moves the messages in a background thread once that commits, and
+`manage.py sync_message_archive` catches up on any move that did not finish.
+
+Reads fall back to the segments: merge_archived() completes a keyset page
+of a topic with its archived messages, decompressing only the segments the
+page overlaps.  The topic counters are left alone; archived messages still
+count (see topics.counters.reconcile_topics).
+"""
+import heapq
+import json
+import logging
+import threading
+import zlib
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from search.backends import get_search_backend
+from topics.models import Topic
+from users.models import CustomUser
+from .feed import bump_feed_generations
+from .models import ArchivedMessageSegment, Mention, Message
+
+
+ARCHIVE_BATCH_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def _pack(rows):
+    return zlib.compress(json.dumps(rows, separators=(',', ':')).encode(), 6)
+
+
+def _unpack(data):
+    return json.loads(zlib.decompress(bytes(data)))
+
+
+def _tagged_through():
+    field = Message._meta.get_field('tagged_users')
+    return field.remote_field.through, field.m2m_column_name(), field.m2m_reverse_name()
+
+
+def archive_topic_messages(topic_id, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move every message of `topic_id` into archive segments; returns how many moved"""
+    Tagged, message_column, user_column = _tagged_through()
+    moved = 0
+    while True:
+        with transaction.atomic():
+            # Locking the topic keeps concurrent moves of it from taking the same batch
+            if not Topic.objects.select_for_update().filter(pk=topic_id, is_archived=True).exists():
+                break
+            batch = list(
+                Message.objects.filter(topic_id=topic_id).order_by('created_at', 'id')
+                .values_list('id', 'sender_id', 'created_at', 'content')[:batch_size]
+            )
+            if not batch:
+                break
+            pks = [row[0] for row in batch]
+
+            read_at = {
+                (message_id, user_id): when
+                for message_id, user_id, when in Mention.objects.filter(
+                    message_id__in=pks
+                ).values_list('message_id', 'user_id', 'read_at')
+            }
+            tags = {}
+            for message_id, user_id in Tagged.objects.filter(
+                **{f'{message_column}__in': pks}
+            ).values_list(message_column, user_column):
+                when = read_at.get((message_id, user_id))
+                tags.setdefault(message_id, []).append([user_id, when and when.isoformat()])
+
+            first, last = batch[0], batch[-1]
+            ArchivedMessageSegment.objects.create(
+                topic_id=topic_id,
+                first_created_at=first[2], first_message_id=first[0],
+                last_created_at=last[2], last_message_id=last[0],
+                message_count=len(batch),
+                data=_pack([
+                    [pk, sender_id, created_at.isoformat(), content, tags.get(pk, [])]
+                    for pk, sender_id, created_at, content in batch
+                ]),
+            )
+
+            # Cascades to the mentions and tags; the post_delete receivers
+            # take the messages out of the search index and the feeds
+            Message.objects.filter(pk__in=pks).delete()
+
+        moved += len(batch)
+    if moved:
+        bump_feed_generations([topic_id])
+    return moved
+
+
+def restore_topic_messages(topic_id):
+    """Move the archived messages of `topic_id` back, one segment per transaction"""
+    Tagged, message_column, user_column = _tagged_through()
+    restored = 0
+    while True:
+        with transaction.atomic():
+            if not Topic.objects.select_for_update().filter(pk=topic_id, is_archived=False).exists():
+                break
+            segment = ArchivedMessageSegment.objects.select_for_update().filter(
+                topic_id=topic_id
+            ).order_by('first_created_at', 'first_message_id').first()
+            if segment is None:
+                break
+            rows = _unpack(segment.data)
+            # Users deleted since archiving take their messages and tags
+            # with them, as the foreign keys would have
+            users = set(CustomUser.objects.filter(pk__in={row[1] for row in rows} | {
+                user_id for row in rows for user_id, _ in row[4]
+            }).values_list('pk', flat=True))
+            rows = [
+                row[:4] + [[tag for tag in row[4] if tag[0] in users]]
+                for row in rows if row[1] in users
+            ]
+
+            messages = Message.objects.bulk_create([
+                Message(id=pk, topic_id=topic_id, sender_id=sender_id,
+                        created_at=parse_datetime(created_at), content=content)
+                for pk, sender_id, created_at, content, _ in rows
+            ])
+            Tagged.objects.bulk_create([
+                Tagged(**{message_column: pk, user_column: user_id})
+                for pk, _, _, _, tagged in rows for user_id, _ in tagged
+            ])
+            Mention.objects.bulk_create([
+                Mention(user_id=user_id, message=message, topic_id=topic_id,
+                        created_at=message.created_at,
+                        read_at=parse_datetime(read_at) if read_at else None)
+                for message, (*_, tagged) in zip(messages, rows) for user_id, read_at in tagged
+            ])
+            get_search_backend().index_messages(messages, new=True)
+            segment.delete()
+
+        restored += len(rows)
+    if restored:
+        bump_feed_generations([topic_id])
+    return restored
+
+
+def sync_topic_archive(topic_id, batch_size=ARCHIVE_BATCH_SIZE):
+    """Archive or restore the messages of `topic_id` as its is_archived flag says; returns how many moved"""
+    if Topic.objects.filter(pk=topic_id, is_archived=True).exists():
+        return archive_topic_messages(topic_id, batch_size)
+    return restore_topic_messages(topic_id)
+
+
+def schedule_archive_sync(topic_ids):
+    """Sync the archives of `topic_ids` in a background thread once the current transaction commits"""
+    topic_ids = list(topic_ids)
+    transaction.on_commit(lambda: threading.Thread(
+        target=_sync_in_background, args=(topic_ids,), name='message-archive-sync', daemon=True
+    ).start())
+
+
+def _sync_in_background(topic_ids):
+    try:
+        for topic_id in topic_ids:
+            sync_topic_archive(topic_id)
+    except Exception:
+        logger.exception('Syncing the message archive of topics %s failed', topic_ids)
+    finally:
+        connection.close()  # the thread's own connection
+
+
+def read_archived(topic_id, position=None, newer=False, limit=50):
+    """
+    Up to `limit` archived messages of `topic_id` past the (created_at, id)
+    `position`: newer ones in ascending order when `newer`, older ones in
+    descending order otherwise, as the keyset paginators scan.  Messages
+    come with their topic, sender and tagged users loaded.
+    """
+    segments = ArchivedMessageSegment.objects.filter(topic_id=topic_id)
+    if newer:
+        created_at, pk = position
+        segments = segments.filter(
+            Q(last_created_at__gt=created_at) | Q(last_created_at=created_at, last_message_id__gt=pk)
+        ).order_by('first_created_at', 'first_message_id')
+        bounds = segments.values_list('pk', 'first_created_at', 'first_message_id')
+    else:
+        if position:
+            created_at, pk = position
+            segments = segments.filter(
+                Q(first_created_at__lt=created_at) | Q(first_created_at=created_at, first_message_id__lt=pk)
+            )
+        segments = segments.order_by('-last_created_at', '-last_message_id')
+        bounds = segments.values_list('pk', 'last_created_at', 'last_message_id')
+
+    rows = []
+    for segment_pk, *bound in bounds:
+        # Segments are ordered by the bound nearest the cursor: once a page
+        # is full, a segment starting beyond its last row cannot contribute
+        if len(rows) >= limit:
+            edge = (rows[limit - 1][2], rows[limit - 1][0])
+            if (tuple(bound) > edge) if newer else (tuple(bound) < edge):
+                break
+        data = ArchivedMessageSegment.objects.filter(pk=segment_pk).values_list('data', flat=True).get()
+        for row in _unpack(data):
+            row[2] = parse_datetime(row[2])
+            key = (row[2], row[0])
+            if position is None or (key > position if newer else key < position):
+                rows.append(row)
+        rows.sort(key=lambda row: (row[2], row[0]), reverse=not newer)
+        del rows[limit:]
+
+    if not rows:
+        return []
+    return _build_messages(Topic.objects.get(pk=topic_id), rows)
+
+
+def _build_messages(topic, rows):
+    """Unsaved Message instances for archived `rows`, users loaded in one query"""
+    users = CustomUser.objects.only('id', 'username', 'first_name', 'last_name').in_bulk(
+        {row[1] for row in rows} | {user_id for row in rows for user_id, _ in row[4]}
+    )
+    messages = []
+    for pk, sender_id, created_at, content, tagged in rows:
+        if sender_id not in users:
+            continue  # the sender was deleted since
+        message = Message(id=pk, topic=topic, sender=users[sender_id], content=content,
+                          created_at=created_at)
+        message.tagged_user_list = sorted(
+            (users[user_id] for user_id, _ in tagged if user_id in users), key=lambda user: user.pk
+        )
+        messages.append(message)
+    return messages
+
+
+def iter_archived(topic):
+    """
+    Every archived message of `topic` in (created_at, id) order, holding
+    one segment at a time in memory (more only where segments overlap).
+    """
+    bounds = list(
+        ArchivedMessageSegment.objects.filter(topic=topic)
+        .order_by('first_created_at', 'first_message_id')
+        .values_list('pk', 'first_created_at', 'first_message_id')
+    )
+    pending = []
+    while bounds or pending:
+        # Open the next segment before yielding anything it could precede
+        if bounds and (not pending or (bounds[0][1], bounds[0][2]) <= pending[0][0]):
+            segment_pk = bounds.pop(0)[0]
+            data = ArchivedMessageSegment.objects.filter(pk=segment_pk).values_list('data', flat=True).get()
+            rows = _unpack(data)
+            for row in rows:
+                row[2] = parse_datetime(row[2])
+            for message in _build_messages(topic, rows):
+                heapq.heappush(pending, ((message.created_at, message.pk), message))
+            continue
+        yield heapq.heappop(pending)[1]
+
+
+def merge_archived(rows, topic_id, position, newer, limit):
+    """A keyset page of hot `rows` (in scan order) completed with archived messages"""
+    archived = read_archived(topic_id, position, newer, limit)
+    # A move committing between the two reads can show a message in both
+    hot = {message.pk for message in rows}
+    archived = [message for message in archived if message.pk not in hot]
+    if not archived:
+        return rows
+    merged = sorted(rows + archived, key=lambda message: (message.created_at, message.pk), reverse=not newer)
+    return merged[:limit]
@@ -0,0 +1,149 @@
+"""
+ASGI-native versions of the hot message endpoints.
+
+    GET  /api/conversations/async/messages/?topic=<id>[&before=|&after=<cursor>][&page_size=<n>]
+    POST /api/conversations/async/messages/   {"topic", "content", "tagged_users_ids"}
+
+They answer like MessageViewSet list/create (same cursors, same payloads)
+but are plain Django coroutine views, so under an ASGI server a request
+waiting on the database does not hold a worker thread.  Reads go through
+the async ORM interface; the create path runs services.create_message, a
+single transaction, in one sync_to_async hop.
+
+Session authentication only (plus Django's CSRF protection on POST).
+"""
+import json
+import math
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from rest_framework.exceptions import APIException
+
+from topics.models import Topic
+from .archive import merge_archived
+from .models import ArchivedMessageSegment, Message
+from .pagination import KeysetPagination, decode_cursor, encode_cursor, newer_than, older_than
+from .realtime import abroadcast_message
+from .serializers import MessageCreateSerializer, MessageSerializer
+from .services import create_message
+from .throttling import check_posting_limits
+
+
+def _error(message, status):
+    return JsonResponse({'error': message}, status=status)
+
+
+@sync_to_async
+def _get_user(request):
+    # request.user is resolved lazily from the session, which queries
+    user = request.user
+    return user if user.is_authenticated else None
+
+
+def _page_size(request):
+    try:
+        size = int(request.GET['page_size'])
+    except (KeyError, ValueError):
+        return KeysetPagination.page_size
+    return max(1, min(size, KeysetPagination.max_page_size))
+
+
+def _link(request, param, message):
+    query = request.GET.copy()
+    query.pop('before', None)
+    query.pop('after', None)
+    query[param] = encode_cursor(message.created_at, message.pk)
+    return request.build_absolute_uri(f'{request.path}?{query.urlencode()}')
+
+
+async def _list(request, user):
+    try:
+        topic_id = int(request.GET['topic'])
+    except (KeyError, ValueError):
+        return _error('topic is required', 400)
+
+    if not await Topic.objects.accessible_to(user).filter(pk=topic_id).aexists():
+        return _error('Topic not found', 404)
+
+    size = _page_size(request)
+    before, after = request.GET.get('before'), request.GET.get('after')
+    queryset = Message.objects.filter(topic_id=topic_id).select_related(
+        'topic', 'sender'
+    ).prefetch_related('tagged_users')
+    try:
+        position = decode_cursor(after or before) if after or before else None
+    except APIException as exc:
+        return _error(str(exc.detail), exc.status_code)
+    if after:
+        queryset = queryset.filter(newer_than(*position)).order_by('created_at', 'id')
+    else:
+        if before:
+            queryset = queryset.filter(older_than(*position))
+        queryset = queryset.order_by('-created_at', '-id')
+
+    rows = [message async for message in queryset[:size + 1]]
+    if await ArchivedMessageSegment.objects.filter(topic_id=topic_id).aexists():
+        rows = await sync_to_async(merge_archived)(rows, topic_id, position, bool(after), size + 1)
+    has_more = len(rows) > size
+    rows = rows[:size]
+    if after:
+        has_older, has_newer = bool(rows), has_more
+    else:
+        rows.reverse()
+        has_older, has_newer = has_more, bool(before and rows)
+
+    return JsonResponse({
+        'older': _link(request, 'before', rows[0]) if has_older else None,
+        'newer': _link(request, 'after', rows[-1]) if has_newer else None,
+        # Everything is loaded, serializing does not touch the database
+        'results': MessageSerializer(rows, many=True).data,
+    })
+
+
+@sync_to_async
+def _create(user, data):
+    message = create_message(
+        user, data['topic'], data['content'], data['tagged_users_ids']
+    )
+    return MessageSerializer(message).data
+
+
+async def _post(request, user):
+    try:
+        payload = json.loads(request.body or b'{}')
+    except ValueError:
+        return _error('Invalid JSON body', 400)
+
+    serializer = MessageCreateSerializer(data=payload)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+
+    # The same posting limits as MessageViewSet.create
+    wait = await sync_to_async(check_posting_limits)(user, serializer.validated_data['topic'])
+    if wait is not None:
+        wait = math.ceil(wait)
+        response = _error(f'Request was throttled. Expected available in {wait} seconds.', 429)
+        response['Retry-After'] = str(wait)
+        return response
+
+    try:
+        data = await _create(user, serializer.validated_data)
+    except APIException as exc:
+        detail = exc.detail if isinstance(exc.detail, dict) else {'error': str(exc.detail)}
+        return JsonResponse(detail, status=exc.status_code)
+
+    # create_message has committed by now
+    await abroadcast_message(data['topic'], data)
+    return JsonResponse(data, status=201)
+
+
+async def messages(request):
+    user = await _get_user(request)
+    if user is None:
+        return _error('Authentication credentials were not provided.', 403)
+
+    if request.method == 'GET':
+        return await _list(request, user)
+    if request.method == 'POST':
+        return await _post(request, user)
+    return _error(f'Method "{request.method}" not allowed.', 405)
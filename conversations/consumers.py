@@ -0,0 +1,95 @@
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from topics.models import Topic
+from topics.permission_cache import get_permission_snapshot
+from .realtime import topic_group_name
+
+
+class TopicMessagesConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Pushes new messages for the topics a client subscribes to.
+
+    Client frames:
+        {"action": "subscribe", "topic": <id>}
+        {"action": "unsubscribe", "topic": <id>}
+
+    Server frames:
+        {"type": "subscribed", "topic": <id>, "can_reply": <bool>}
+        {"type": "unsubscribed", "topic": <id>}
+        {"type": "message", "topic": <id>, "message": {...}}
+        {"type": "error", "topic": <id>, "error": "..."}
+    """
+
+    async def connect(self):
+        self.user = self.scope.get('user')
+        self.topics = set()
+        if self.user is None or not self.user.is_authenticated:
+            await self.close()
+            return
+        await self.accept()
+
+    async def disconnect(self, code):
+        for topic_id in list(getattr(self, 'topics', ())):
+            await self.channel_layer.group_discard(topic_group_name(topic_id), self.channel_name)
+        self.topics = set()
+
+    async def receive_json(self, content, **kwargs):
+        action = content.get('action')
+        try:
+            topic_id = int(content.get('topic'))
+        except (TypeError, ValueError):
+            await self.send_json({'type': 'error', 'topic': None, 'error': 'A topic id is required'})
+            return
+
+        if action == 'subscribe':
+            await self.subscribe(topic_id)
+        elif action == 'unsubscribe':
+            await self.unsubscribe(topic_id)
+        else:
+            await self.send_json({'type': 'error', 'topic': topic_id, 'error': 'Unknown action'})
+
+    async def subscribe(self, topic_id):
+        permissions = await self.get_topic_permissions(topic_id)
+        if permissions is None:
+            await self.send_json({
+                'type': 'error', 'topic': topic_id,
+                'error': 'You do not have permission to view this topic',
+            })
+            return
+
+        await self.channel_layer.group_add(topic_group_name(topic_id), self.channel_name)
+        self.topics.add(topic_id)
+        await self.send_json({'type': 'subscribed', 'topic': topic_id, 'can_reply': permissions['can_reply']})
+
+    async def unsubscribe(self, topic_id):
+        await self.channel_layer.group_discard(topic_group_name(topic_id), self.channel_name)
+        self.topics.discard(topic_id)
+        await self.send_json({'type': 'unsubscribed', 'topic': topic_id})
+
+    async def message_created(self, event):
+        topic_id = event['topic']
+        if topic_id not in self.topics:
+            return
+
+        # Restrictions may have changed since the subscription; the snapshot
+        # makes this re-check a cache lookup rather than a query
+        if await self.can_still_view(topic_id) is False:
+            await self.unsubscribe(topic_id)
+            return
+
+        await self.send_json({'type': 'message', 'topic': topic_id, 'message': event['message']})
+
+    @database_sync_to_async
+    def get_topic_permissions(self, topic_id):
+        """Apply the same visibility rules as TopicViewSet.get_queryset"""
+        topic = Topic.objects.accessible_to(self.user).filter(pk=topic_id).first()
+        if topic is None:
+            return None
+        return {'can_reply': topic.can_user_reply(self.user)}
+
+    @database_sync_to_async
+    def can_still_view(self, topic_id):
+        if self.user.is_admin():
+            return True
+        return get_permission_snapshot(self.user).can_view_topic(topic_id)
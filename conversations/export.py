@@ -0,0 +1,85 @@
+"""
+Streaming transcript export of a topic, as NDJSON or CSV.
+
+Messages are read with QuerySet.iterator(), so only one chunk of rows (and
+its tagged users, prefetched per chunk) is in memory at a time, and each
+line is written to the response as soon as it is formatted.  Archived
+messages are merged in from their segments (see conversations.archive).
+"""
+import csv
+import heapq
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+
+from users.models import CustomUser
+from .archive import iter_archived
+from .models import ArchivedMessageSegment, Message
+
+
+EXPORT_CHUNK_SIZE = 2000
+CSV_COLUMNS = ['id', 'created_at', 'sender_id', 'sender_username', 'content', 'tagged_usernames']
+
+
+def iter_topic_messages(topic, chunk_size=EXPORT_CHUNK_SIZE):
+    """Every message of `topic`, oldest first, with sender and tagged users loaded"""
+    messages = Message.objects.filter(topic=topic).select_related('sender').prefetch_related(
+        Prefetch('tagged_users', queryset=CustomUser.objects.only('id', 'username').order_by('pk'))
+    ).order_by('created_at', 'id').iterator(chunk_size=chunk_size)
+    if not ArchivedMessageSegment.objects.filter(topic=topic).exists():
+        return messages
+    return _unique(heapq.merge(
+        messages, iter_archived(topic), key=lambda message: (message.created_at, message.pk)
+    ))
+
+
+def _unique(messages):
+    """Drop the second copy of a message read from both the table and the segments while it moved"""
+    last_pk = None
+    for message in messages:
+        if message.pk != last_pk:
+            yield message
+        last_pk = message.pk
+
+
+def _record(message):
+    tagged = message.tagged_user_list
+    return {
+        'id': message.pk,
+        'created_at': message.created_at,
+        'sender_id': message.sender_id,
+        'sender_username': message.sender.username,
+        'content': message.content,
+        'tagged_users': [{'id': user.pk, 'username': user.username} for user in tagged],
+    }
+
+
+def ndjson_lines(messages):
+    for message in messages:
+        yield json.dumps(_record(message), cls=DjangoJSONEncoder) + '\n'
+
+
+class _Echo:
+    """File-like object whose write() hands the line back, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(messages):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for message in messages:
+        record = _record(message)
+        yield writer.writerow([
+            record['id'], record['created_at'].isoformat(), record['sender_id'],
+            record['sender_username'], record['content'],
+            ' '.join(user['username'] for user in record['tagged_users']),
+        ])
+
+
+EXPORT_FORMATS = {
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+    'csv': (csv_lines, 'text/csv; charset=utf-8'),
+}
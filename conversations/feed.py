@@ -0,0 +1,72 @@
+"""
+Recent-activity feed.
+
+The latest messages a user can see, read with one bounded query that walks
+the Message(created_at, id) index newest first and applies the visibility
+rules per row (see MessageQuerySet.visible_to), so its cost does not grow
+with the number of topics.
+
+Serialized feeds are cached per user for RECENT_ACTIVITY_CACHE_TIMEOUT
+seconds, keyed on the user's permission versions.  New messages only show
+up once the entry expires: with one cache entry per user, invalidating on
+every post would empty every user's cache at once.  Editing or deleting a
+message bumps its topic's feed generation, and a cached feed is only
+served while the generations of the topics it shows are unchanged, so a
+feed never shows a stale or removed message.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from topics.permission_cache import get_permission_version
+
+
+RECENT_ACTIVITY_TIMEOUT = getattr(settings, 'RECENT_ACTIVITY_CACHE_TIMEOUT', 15)
+
+
+def _generation_key(topic_id):
+    return f'feed:generation:topic:{topic_id}'
+
+
+def bump_feed_generations(topic_ids):
+    """Invalidate the cached feeds showing messages of `topic_ids`"""
+    for topic_id in set(topic_ids):
+        try:
+            cache.incr(_generation_key(topic_id))
+        except ValueError:
+            cache.set(_generation_key(topic_id), int(time.time() * 1000), None)
+
+
+def _feed_generations(topic_ids):
+    """{topic id: generation}; topics never bumped are at generation 0"""
+    keys = {_generation_key(topic_id): topic_id for topic_id in topic_ids}
+    found = cache.get_many(keys)
+    return {topic_id: found.get(key, 0) for key, topic_id in keys.items()}
+
+
+def recent_messages(user, limit=5):
+    """The `limit` newest messages from topics listed to the user"""
+    from .models import Message
+
+    return Message.objects.visible_to(user).select_related('topic', 'sender').prefetch_related(
+        'tagged_users'
+    ).order_by('-created_at', '-id')[:limit]
+
+
+def recent_activity(user, limit=5):
+    """Serialized recent_messages(user, limit), served from the cache when fresh"""
+    from .serializers import MessageSerializer
+
+    if not RECENT_ACTIVITY_TIMEOUT:
+        return MessageSerializer(recent_messages(user, limit), many=True).data
+
+    key = 'feed:recent:{}:{}:{}:{}'.format(user.pk, limit, *get_permission_version(user))
+    entry = cache.get(key)
+    if entry is not None and _feed_generations(entry['generations']) == entry['generations']:
+        return entry['data']
+
+    data = MessageSerializer(recent_messages(user, limit), many=True).data
+    generations = _feed_generations({message['topic'] for message in data})
+    cache.set(key, {'data': data, 'generations': generations}, RECENT_ACTIVITY_TIMEOUT)
+    return data
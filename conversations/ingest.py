@@ -0,0 +1,176 @@
+"""
+Bulk message ingestion, for replaying history from other chat systems.
+
+Input is NDJSON, one message per line:
+
+    {"topic": 3, "sender": 7, "content": "Hi", "created_at": "2023-05-01T09:30:00Z",
+     "tagged_users_ids": [4, 9]}
+
+`created_at` and `tagged_users_ids` are optional.  Lines are consumed in
+chunks, each written with one bulk INSERT for the messages, one for the
+tagged-user rows and one for the mentions, inside its own transaction.  The
+counters of every touched topic are recomputed once at the end.  Memory use
+is bounded by the chunk size, not the input size.
+
+This is an admin path: restrictions and closed/locked topics are not
+checked, and messages are not pushed to WebSocket subscribers.
+"""
+import json
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from search.backends import get_search_backend
+from topics.counters import reconcile_topics
+from topics.models import Topic
+from users.models import CustomUser
+from .models import Mention, Message
+
+
+DEFAULT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+RECOUNT_BATCH_SIZE = 500
+
+
+class IngestResult:
+    """Running totals of an ingest; only the first errors are kept"""
+
+    def __init__(self):
+        self.imported = 0
+        self.skipped = 0
+        self.errors = []
+        self.topic_ids = set()
+
+    def error(self, line, message):
+        self.skipped += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def as_dict(self):
+        return {
+            'imported': self.imported,
+            'skipped': self.skipped,
+            'topics': len(self.topic_ids),
+            'errors': self.errors,
+        }
+
+
+def iter_records(lines):
+    """Yield (line number, record, error) for each non-blank NDJSON line"""
+    for number, line in enumerate(lines, 1):
+        try:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+        except ValueError as exc:  # includes UnicodeDecodeError
+            yield number, None, f'Invalid JSON: {exc}'
+            continue
+        if not isinstance(record, dict):
+            yield number, None, 'Expected a JSON object'
+            continue
+        yield number, record, None
+
+
+def _clean(record):
+    """(topic_id, sender_id, content, created_at, tagged ids) of a record"""
+    try:
+        topic_id = int(record['topic'])
+        sender_id = int(record['sender'])
+    except KeyError as exc:
+        raise ValueError(f'Missing field {exc}')
+
+    content = record.get('content')
+    if not isinstance(content, str) or not content.strip():
+        raise ValueError('content must be a non-empty string')
+
+    created_at = record.get('created_at')
+    if created_at is None:
+        created_at = timezone.now()
+    else:
+        created_at = parse_datetime(str(created_at))
+        if created_at is None:
+            raise ValueError('created_at must be an ISO 8601 datetime')
+        if timezone.is_naive(created_at):
+            created_at = timezone.make_aware(created_at)
+
+    tagged = record.get('tagged_users_ids') or []
+    if not isinstance(tagged, list):
+        raise ValueError('tagged_users_ids must be a list')
+    return topic_id, sender_id, content, created_at, {int(pk) for pk in tagged}
+
+
+def _ingest_chunk(chunk, result, known_topics, known_users):
+    rows = []
+    for number, record, error in chunk:
+        if error:
+            result.error(number, error)
+            continue
+        try:
+            rows.append((number, *_clean(record)))
+        except (TypeError, ValueError) as exc:
+            result.error(number, str(exc))
+
+    # Ids not seen in earlier chunks are resolved with one query per model
+    topic_ids = {row[1] for row in rows} - known_topics
+    if topic_ids:
+        known_topics.update(Topic.objects.filter(pk__in=topic_ids).values_list('pk', flat=True))
+    user_ids = {row[2] for row in rows}.union(*(row[5] for row in rows)) - known_users
+    if user_ids:
+        known_users.update(CustomUser.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+
+    messages, tags = [], []
+    for number, topic_id, sender_id, content, created_at, tagged in rows:
+        if topic_id not in known_topics:
+            result.error(number, f'Unknown topic {topic_id}')
+        elif sender_id not in known_users:
+            result.error(number, f'Unknown sender {sender_id}')
+        elif not tagged <= known_users:
+            result.error(number, f'Unknown tagged users {sorted(tagged - known_users)}')
+        else:
+            messages.append(Message(
+                topic_id=topic_id, sender_id=sender_id, content=content, created_at=created_at
+            ))
+            tags.append(tagged)
+    if not messages:
+        return
+
+    field = Message._meta.get_field('tagged_users')
+    Tagged = field.remote_field.through
+    with transaction.atomic():
+        Message.objects.bulk_create(messages)
+        Tagged.objects.bulk_create([
+            Tagged(**{field.m2m_column_name(): message.pk, field.m2m_reverse_name(): user_id})
+            for message, tagged in zip(messages, tags) for user_id in tagged
+        ])
+        Mention.objects.bulk_create([
+            Mention(user_id=user_id, message_id=message.pk, topic_id=message.topic_id,
+                    created_at=message.created_at)
+            for message, tagged in zip(messages, tags) for user_id in tagged
+        ])
+        get_search_backend().index_messages(messages, new=True)
+
+    result.imported += len(messages)
+    result.topic_ids.update(message.topic_id for message in messages)
+
+
+def ingest_messages(lines, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Import NDJSON `lines` (str or bytes); returns an IngestResult"""
+    result = IngestResult()
+    known_topics, known_users = set(), set()
+    records = iter_records(lines)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            break
+        _ingest_chunk(chunk, result, known_topics, known_users)
+
+    # Counters are recounted from the messages, once per touched topic
+    topic_ids = sorted(result.topic_ids)
+    for start in range(0, len(topic_ids), RECOUNT_BATCH_SIZE):
+        reconcile_topics(topic_ids[start:start + RECOUNT_BATCH_SIZE])
+    return result
@@ -0,0 +1,175 @@
+import http.client
+import math
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from topics.models import Topic
+from users.models import CustomUser
+
+# Django's threaded WSGI server, without the autoreloader and static files
+# handling of runserver (which daphne replaces with its ASGI one anyway)
+WSGI_SERVER = (
+    'import django; django.setup(); '
+    'from django.core.servers.basehttp import get_internal_wsgi_application, run; '
+    'run({host!r}, {port}, get_internal_wsgi_application(), threading=True)'
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare latency and throughput of the async message list view with '
+        'the DRF one under concurrent pollers, over HTTP against a threaded '
+        'WSGI server and daphne, both started on the configured database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--topic', type=int, help='Topic to list (default: the busiest one)')
+        parser.add_argument('--username', help='User to poll as (default: the first admin)')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per path')
+        parser.add_argument('--concurrency', type=int, default=20, help='Concurrent pollers')
+        parser.add_argument('--wsgi-url', help='Base URL of a running WSGI server to use instead')
+        parser.add_argument('--asgi-url', help='Base URL of a running ASGI server to use instead')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be positive')
+
+        topic = self.get_topic(options['topic'])
+        user = self.get_user(options['username'])
+        headers = {'Cookie': self.login(user)}
+        query = f'?topic={topic.pk}'
+        self.stdout.write(
+            f"Topic {topic.pk} ({topic.total_messages} messages) as {user.username}: "
+            f"{options['requests']} requests, {options['concurrency']} concurrent"
+        )
+
+        servers = []
+        try:
+            urls = {
+                'wsgi': options['wsgi_url'] or self.start_server(servers, self.wsgi_command),
+                'asgi': options['asgi_url'] or self.start_server(servers, self.asgi_command),
+            }
+            paths = {
+                'wsgi': '/api/conversations/messages/',
+                'asgi': '/api/conversations/async/messages/',
+            }
+            results = []
+            for name, base_url in urls.items():
+                url = base_url.rstrip('/') + paths[name] + query
+                self.warm_up(name, url, headers)
+                results.append((name, self.run(url, headers, options)))
+        finally:
+            for server in servers:
+                server.terminate()
+                server.wait()
+
+        for name, (latencies, elapsed, failures) in results:
+            latencies.sort()
+            p95 = latencies[max(0, math.ceil(len(latencies) * 0.95) - 1)]
+            self.stdout.write(
+                f"{name}: {len(latencies) / elapsed:8.1f} req/s  "
+                f"p50 {statistics.median(latencies) * 1000:7.1f} ms  "
+                f"p95 {p95 * 1000:7.1f} ms  "
+                f"failures {failures}"
+            )
+
+    def get_topic(self, topic_id):
+        topics = Topic.objects.filter(is_active=True)
+        topic = topics.filter(pk=topic_id).first() if topic_id else topics.order_by('-total_messages').first()
+        if topic is None:
+            raise CommandError('No such active topic; seed some data first')
+        return topic
+
+    def get_user(self, username):
+        if username:
+            user = CustomUser.objects.filter(username=username).first()
+        else:
+            user = CustomUser.objects.filter(role='admin').order_by('pk').first()
+        if user is None:
+            raise CommandError('No such user')
+        return user
+
+    def login(self, user):
+        """A session both servers accept (the session engine must not be process-local)"""
+        client = Client()
+        client.force_login(user)
+        return '; '.join(f'{name}={morsel.value}' for name, morsel in client.cookies.items())
+
+    def wsgi_command(self, host, port):
+        return [sys.executable, '-c', WSGI_SERVER.format(host=host, port=port)]
+
+    def asgi_command(self, host, port):
+        application = ':'.join(settings.ASGI_APPLICATION.rsplit('.', 1))
+        return [sys.executable, '-m', 'daphne', '-b', host, '-p', str(port), application]
+
+    def start_server(self, servers, command, host='127.0.0.1', timeout=30):
+        with socket.socket() as sock:
+            sock.bind((host, 0))
+            port = sock.getsockname()[1]
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE}
+        server = subprocess.Popen(
+            command(host, port), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        servers.append(server)
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f'{command.__name__[:4]} server exited with status {server.returncode}')
+            try:
+                socket.create_connection((host, port), timeout=1).close()
+                return f'http://{host}:{port}'
+            except OSError:
+                time.sleep(0.1)
+        raise CommandError(f'Server on port {port} did not start within {timeout}s')
+
+    def get(self, connection, url, headers):
+        parts = urlsplit(url)
+        connection.request('GET', f'{parts.path}?{parts.query}', headers=headers)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+
+    def warm_up(self, name, url, headers):
+        connection = http.client.HTTPConnection(urlsplit(url).netloc)
+        try:
+            status = self.get(connection, url, headers)
+        finally:
+            connection.close()
+        if status != 200:
+            raise CommandError(f'{name}: GET {url} answered {status}')
+
+    def run(self, url, headers, options):
+        # A connection is not thread-safe: each polling thread keeps its own alive
+        local = threading.local()
+        connections = []
+
+        def request(_):
+            if not hasattr(local, 'connection'):
+                local.connection = http.client.HTTPConnection(urlsplit(url).netloc)
+                connections.append(local.connection)
+            start = time.perf_counter()
+            try:
+                failed = self.get(local.connection, url, headers) != 200
+            except (OSError, http.client.HTTPException):
+                local.connection.close()  # reconnects on the next request
+                failed = True
+            return time.perf_counter() - start, failed
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            timings = list(pool.map(request, range(options['requests'])))
+        for connection in connections:
+            connection.close()
+        return [t for t, _ in timings], time.perf_counter() - start, sum(f for _, f in timings)
@@ -0,0 +1,38 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from conversations.ingest import DEFAULT_CHUNK_SIZE, ingest_messages
+
+
+class Command(BaseCommand):
+    help = 'Import messages from an NDJSON file (see conversations/ingest.py for the format)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="NDJSON file to read, or '-' for stdin")
+        parser.add_argument(
+            '--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+            help=f'Messages per bulk insert (default {DEFAULT_CHUNK_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        if options['path'] == '-':
+            result = ingest_messages(sys.stdin, options['chunk_size'])
+        else:
+            try:
+                with open(options['path'], encoding='utf-8') as lines:
+                    result = ingest_messages(lines, options['chunk_size'])
+            except OSError as exc:
+                raise CommandError(exc)
+
+        for error in result.errors:
+            self.stderr.write(f"line {error['line']}: {error['error']}")
+        if result.skipped > len(result.errors):
+            self.stderr.write(f'... {result.skipped - len(result.errors)} more skipped lines')
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {result.imported} messages into {len(result.topic_ids)} topics '
+            f'({result.skipped} skipped)'
+        ))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from conversations.archive import ARCHIVE_BATCH_SIZE, archive_topic_messages, restore_topic_messages
+from conversations.models import ArchivedMessageSegment, Message
+from topics.models import Topic
+
+
+class Command(BaseCommand):
+    help = (
+        'Move the messages of archived topics into compressed archive segments, '
+        'and restore the archived messages of topics that were unarchived'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--topic', type=int, action='append', help='Only this topic (repeatable)')
+        parser.add_argument(
+            '--batch-size', type=int, default=ARCHIVE_BATCH_SIZE,
+            help=f'Messages per archive segment (default {ARCHIVE_BATCH_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        topics = Topic.objects.all()
+        if options['topic']:
+            topics = topics.filter(pk__in=options['topic'])
+
+        to_archive = topics.filter(
+            is_archived=True, pk__in=Message.objects.values('topic_id')
+        ).values_list('pk', flat=True)
+        to_restore = topics.filter(
+            is_archived=False, pk__in=ArchivedMessageSegment.objects.values('topic_id')
+        ).values_list('pk', flat=True)
+
+        moved = restored = 0
+        for topic_id in to_archive:
+            moved += archive_topic_messages(topic_id, options['batch_size'])
+        for topic_id in to_restore:
+            restored += restore_topic_messages(topic_id)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {moved} messages, restored {restored} messages'
+        ))
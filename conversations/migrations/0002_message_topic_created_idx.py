@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 00:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['topic', 'created_at', 'id'], name='message_topic_created_idx'),
+        ),
+    ]
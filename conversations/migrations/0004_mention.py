@@ -0,0 +1,59 @@
+# Generated by Django 4.2.7 on 2026-10-18 00:37
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_mentions(apps, schema_editor):
+    Message = apps.get_model('conversations', 'Message')
+    Mention = apps.get_model('conversations', 'Mention')
+    Tagged = Message.tagged_users.through
+    db = schema_editor.connection.alias
+
+    rows = (
+        Tagged.objects.using(db)
+        .order_by('pk')
+        .values_list('customuser_id', 'message_id', 'message__topic_id', 'message__created_at')
+        .iterator(chunk_size=2000)
+    )
+    batch = []
+    for user_id, message_id, topic_id, created_at in rows:
+        batch.append(Mention(
+            user_id=user_id, message_id=message_id, topic_id=topic_id, created_at=created_at
+        ))
+        if len(batch) >= 2000:
+            Mention.objects.using(db).bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    Mention.objects.using(db).bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('topics', '0002_topic_archived_at_topic_archived_by_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('conversations', '0003_message_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Mention',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('read_at', models.DateTimeField(blank=True, null=True)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mentions', to='conversations.message')),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mentions', to='topics.topic')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mentions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'created_at', 'id'], name='mention_user_created_idx'), models.Index(condition=models.Q(('read_at__isnull', True)), fields=['user'], name='mention_user_unread_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='mention',
+            constraint=models.UniqueConstraint(fields=('user', 'message'), name='unique_mention'),
+        ),
+        migrations.RunPython(backfill_mentions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-18 00:39
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('topics', '0002_topic_archived_at_topic_archived_by_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('conversations', '0004_mention'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReadMarker',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_message_id', models.BigIntegerField()),
+                ('last_read_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_markers', to='topics.topic')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_markers', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='readmarker',
+            constraint=models.UniqueConstraint(fields=('user', 'topic'), name='unique_read_marker'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-18 00:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('topics', '0003_topiccounterdelta'),
+        ('conversations', '0005_readmarker'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMessageSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_created_at', models.DateTimeField()),
+                ('first_message_id', models.BigIntegerField()),
+                ('last_created_at', models.DateTimeField()),
+                ('last_message_id', models.BigIntegerField()),
+                ('message_count', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archive_segments', to='topics.topic')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['topic', 'last_created_at', 'last_message_id'], name='segment_topic_last_idx')],
+            },
+        ),
+    ]
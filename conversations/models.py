@@ -1,7 +1,72 @@
 from django.db import models
 from django.utils import timezone
+from django.utils.functional import cached_property
 from users.models import CustomUser
-from topics.models import Topic
+from topics.models import CategoryRestriction, Topic, TopicRestriction, _denied
+
+
+class TopicVisibilityQuerySet(models.QuerySet):
+    """Rows of a model with a `topic` foreign key, filtered by topic visibility"""
+
+    def visible_to(self, user):
+        """
+        Rows in topics listed to the user (see TopicQuerySet.accessible_to),
+        with the topic checks applied as joins and anti-joins on each row
+        rather than as an IN list of topic ids.
+        """
+        queryset = self.filter(topic__is_active=True)
+        if user.is_admin():
+            return queryset
+        return queryset.filter(
+            ~_denied(CategoryRestriction, 'category', 'topic__category_id', user, 'view'),
+            ~_denied(TopicRestriction, 'topic', 'topic_id', user, 'view'),
+            topic__is_archived=False,
+        )
+
+
+class MessageQuerySet(TopicVisibilityQuerySet):
+
+    def after(self, message_id):
+        """
+        Messages newer than `message_id` in (created_at, id) order.  The id is
+        resolved to its position first so the filter is a range scan on the
+        (topic, created_at, id) index; if it was deleted, fall back to the id.
+        """
+        anchor = Message.objects.filter(pk=message_id).values_list('created_at', 'id').first()
+        if anchor is None:
+            return self.filter(id__gt=message_id)
+        created_at, pk = anchor
+        return self.filter(
+            models.Q(created_at__gt=created_at) | models.Q(created_at=created_at, id__gt=pk)
+        )
+
+    def unread_by(self, user):
+        """
+        Messages from other users past the user's ReadMarker of their topic;
+        every message counts in a topic the user has no marker for (see
+        ReadMarker.seed, which keeps those few).
+        """
+        return self.exclude(sender=user).alias(
+            marker=models.FilteredRelation(
+                'topic__read_markers', condition=models.Q(topic__read_markers__user=user)
+            )
+        ).filter(
+            models.Q(marker__isnull=True)
+            | models.Q(created_at__gt=models.F('marker__last_read_at'))
+            | models.Q(
+                created_at=models.F('marker__last_read_at'),
+                id__gt=models.F('marker__last_read_message_id'),
+            )
+        )
+
+    def unread_counts(self, user):
+        """{topic_id: unread message count} in one grouped query; topics with none are left out"""
+        return dict(
+            self.unread_by(user).order_by().values('topic_id').annotate(
+                unread=models.Count('id')
+            ).values_list('topic_id', 'unread')
+        )
+
 
 class Message(models.Model):
     topic = models.ForeignKey(Topic, on_delete=models.CASCADE, related_name='messages')
@@ -10,5 +75,146 @@ class Message(models.Model):
     tagged_users = models.ManyToManyField(CustomUser, blank=True, related_name='tagged_in_messages')
     created_at = models.DateTimeField(default=timezone.now)
 
+    objects = MessageQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination within a topic (see pagination.KeysetPagination)
+            models.Index(fields=['topic', 'created_at', 'id'], name='message_topic_created_idx'),
+            # Recent activity across topics (see feed.recent_messages)
+            models.Index(fields=['created_at', 'id'], name='message_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.sender.username} @ {self.topic.title} - {self.content[:30]}"
+
+    @cached_property
+    def tagged_user_list(self):
+        """
+        The tagged users, as serialized.  Code that already holds them (e.g.
+        services.create_message, archive.read_archived) assigns the list
+        here instead of having tagged_users queried again.
+        """
+        return list(self.tagged_users.all())
+
+
+class ArchivedMessageSegment(models.Model):
+    """
+    A batch of messages of an archived topic, moved out of the message table
+    as one zlib-compressed JSON blob (see conversations.archive).  The
+    bounds are the (created_at, id) positions of its first and last message,
+    so a page of history only decompresses the segments it overlaps.
+    """
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE, related_name='archive_segments')
+    first_created_at = models.DateTimeField()
+    first_message_id = models.BigIntegerField()
+    last_created_at = models.DateTimeField()
+    last_message_id = models.BigIntegerField()
+    message_count = models.PositiveIntegerField()
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['topic', 'last_created_at', 'last_message_id'],
+                name='segment_topic_last_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.message_count} archived messages of topic {self.topic_id}"
+
+
+class MentionQuerySet(TopicVisibilityQuerySet):
+
+    def unread(self):
+        return self.filter(read_at__isnull=True)
+
+
+class Mention(models.Model):
+    """
+    One user tagged in one message, denormalized from Message.tagged_users so
+    the mentions inbox is a range scan on (user, created_at).  Rows are kept
+    in step with the M2M by conversations.signals, inside the transaction
+    that tags the users.
+    """
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='mentions')
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='mentions')
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE, related_name='mentions')
+    created_at = models.DateTimeField()  # the message's created_at
+    read_at = models.DateTimeField(null=True, blank=True)
+
+    objects = MentionQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'message'], name='unique_mention'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='mention_user_created_idx'),
+            models.Index(
+                fields=['user'], condition=models.Q(read_at__isnull=True),
+                name='mention_user_unread_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"@{self.user.username} in message {self.message_id}"
+
+
+class ReadMarker(models.Model):
+    """
+    How far a user has read a topic: the position, in (created_at, id)
+    order, of the newest message they have seen.  Markers only move forward.
+    """
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='read_markers')
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE, related_name='read_markers')
+    last_read_message_id = models.BigIntegerField()
+    last_read_at = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'topic'], name='unique_read_marker'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} read {self.topic.title} up to {self.last_read_message_id}"
+
+    @classmethod
+    def advance(cls, user, message):
+        """Move the user's marker of the message's topic up to `message`, never back"""
+        marker, created = cls.objects.get_or_create(
+            user=user, topic_id=message.topic_id,
+            defaults={'last_read_message_id': message.pk, 'last_read_at': message.created_at},
+        )
+        if not created:
+            cls.objects.filter(pk=marker.pk).filter(
+                models.Q(last_read_at__lt=message.created_at)
+                | models.Q(last_read_at=message.created_at, last_read_message_id__lt=message.pk)
+            ).update(
+                last_read_message_id=message.pk, last_read_at=message.created_at,
+                updated_at=timezone.now(),
+            )
+            marker.refresh_from_db()
+        return marker
+
+    @classmethod
+    def seed(cls, user, topics, before):
+        """
+        Give the user a marker, at their newest message older than `before`,
+        in each of `topics` they have none in yet.  Older history then counts
+        as read, so unread counts never walk a topic's whole history.
+        """
+        newest = Message.objects.filter(
+            topic=models.OuterRef('pk'), created_at__lt=before
+        ).order_by('-created_at', '-id')
+        seeds = topics.exclude(read_markers__user=user).annotate(
+            seed_id=models.Subquery(newest.values('id')[:1]),
+            seed_at=models.Subquery(newest.values('created_at')[:1]),
+        ).filter(seed_id__isnull=False).values_list('pk', 'seed_id', 'seed_at')
+        cls.objects.bulk_create([
+            cls(user=user, topic_id=topic_id, last_read_message_id=seed_id, last_read_at=seed_at)
+            for topic_id, seed_id, seed_at in seeds
+        ], ignore_conflicts=True)
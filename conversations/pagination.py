@@ -0,0 +1,128 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def encode_cursor(created_at, pk):
+    """Opaque cursor for the (created_at, id) position of a row"""
+    raw = f"{created_at.isoformat()}|{pk}".encode()
+    return urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, pk = raw.rsplit('|', 1)
+        created_at = parse_datetime(created_at)
+        if created_at is None:
+            raise ValueError(cursor)
+        return created_at, int(pk)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise NotFound('Invalid cursor')
+
+
+def older_than(created_at, pk):
+    return Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+
+
+def newer_than(created_at, pk):
+    return Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on (created_at, id).
+
+    Without a cursor the most recent page is returned.  `?before=<cursor>`
+    walks towards older rows and `?after=<cursor>` towards newer ones; both
+    are plain range scans on the (topic, created_at, id) index, so a page
+    costs the same however deep into the history it is.
+
+    Pages are returned oldest first (chat order) unless `newest_first` is set.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    before_query_param = 'before'
+    after_query_param = 'after'
+    newest_first = False
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def fetch_rows(self, queryset, position, newer, limit):
+        """
+        Up to `limit` rows past `position` (None: from the newest), in scan
+        order: ascending when `newer`, descending otherwise.
+        """
+        if newer:
+            return list(queryset.filter(newer_than(*position)).order_by('created_at', 'id')[:limit])
+        if position:
+            queryset = queryset.filter(older_than(*position))
+        return list(queryset.order_by('-created_at', '-id')[:limit])
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+
+        before = request.query_params.get(self.before_query_param)
+        after = request.query_params.get(self.after_query_param)
+
+        if after:
+            rows = self.fetch_rows(queryset, decode_cursor(after), True, page_size + 1)
+            self.has_newer = len(rows) > page_size
+            rows = rows[:page_size]
+            # The cursor row itself is older than this page
+            self.has_older = bool(rows)
+        else:
+            position = decode_cursor(before) if before else None
+            rows = self.fetch_rows(queryset, position, False, page_size + 1)
+            self.has_older = len(rows) > page_size
+            rows = rows[:page_size]
+            rows.reverse()
+            self.has_newer = bool(before and rows)
+
+        self.page = rows
+        return list(reversed(rows)) if self.newest_first else rows
+
+    def _link(self, param, row):
+        url = remove_query_param(self.base_url, self.before_query_param)
+        url = remove_query_param(url, self.after_query_param)
+        return replace_query_param(url, param, encode_cursor(row.created_at, row.pk))
+
+    def get_older_link(self):
+        if not self.has_older:
+            return None
+        return self._link(self.before_query_param, self.page[0])
+
+    def get_newer_link(self):
+        if not self.has_newer:
+            return None
+        return self._link(self.after_query_param, self.page[-1])
+
+    def get_paginated_response(self, data):
+        return Response({
+            'older': self.get_older_link(),
+            'newer': self.get_newer_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'older': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'newer': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
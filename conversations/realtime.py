@@ -0,0 +1,26 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+
+def topic_group_name(topic_id):
+    """Channel layer group that receives new messages of one topic"""
+    return f'topic_{topic_id}'
+
+
+async def abroadcast_message(topic_id, message_data):
+    """
+    Fan a serialized message out to every socket subscribed to its topic.
+    Call it after the message is committed (see transaction.on_commit).
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    await channel_layer.group_send(
+        topic_group_name(topic_id),
+        {'type': 'message.created', 'topic': topic_id, 'message': message_data},
+    )
+
+
+def broadcast_message(topic_id, message_data):
+    """Synchronous abroadcast_message, for WSGI views"""
+    async_to_sync(abroadcast_message)(topic_id, message_data)
@@ -0,0 +1,7 @@
+from django.urls import path
+
+from .consumers import TopicMessagesConsumer
+
+websocket_urlpatterns = [
+    path('ws/conversations/', TopicMessagesConsumer.as_asgi()),
+]
@@ -1,11 +1,11 @@
 from rest_framework import serializers
-from .models import Message
+from .models import Mention, Message, ReadMarker
 from users.models import CustomUser
 from users.serializers import UserSummarySerializer  # Create this if needed
 
 class MessageSerializer(serializers.ModelSerializer):
     sender = UserSummarySerializer(read_only=True)
-    tagged_users = UserSummarySerializer(many=True, read_only=True)
+    tagged_users = UserSummarySerializer(source='tagged_user_list', many=True, read_only=True)
     tagged_users_ids = serializers.PrimaryKeyRelatedField(
         many=True, queryset=CustomUser.objects.all(),
         write_only=True, required=False
@@ -27,3 +27,50 @@ class MessageSerializer(serializers.ModelSerializer):
             'created_at'
         ]
         read_only_fields = ['sender', 'tagged_users', 'created_at']
+
+    def create(self, validated_data):
+        # tagged_users_ids is not a model field; tagging goes through the M2M
+        # so the mention rows are written alongside (see signals.sync_mentions)
+        tagged_users = validated_data.pop('tagged_users_ids', [])
+        message = super().create(validated_data)
+        if tagged_users:
+            message.tagged_users.add(*tagged_users)
+        return message
+
+
+class MessageCreateSerializer(serializers.Serializer):
+    """
+    Shape of a new message.  Validation here never touches the database;
+    the topic and tagged users are checked by services.create_message.
+    """
+    topic = serializers.IntegerField(min_value=1)
+    content = serializers.CharField()
+    tagged_users_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False, default=list
+    )
+
+
+class MentionSerializer(serializers.ModelSerializer):
+    message = MessageSerializer(read_only=True)
+    topic_title = serializers.CharField(source='topic.title', read_only=True)
+    is_read = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Mention
+        fields = ['id', 'message', 'topic', 'topic_title', 'created_at', 'read_at', 'is_read']
+        read_only_fields = fields
+
+    def get_is_read(self, obj):
+        return obj.read_at is not None
+
+
+
+class ReadMarkerSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ReadMarker
+        fields = ['topic', 'last_read_message_id', 'last_read_at', 'updated_at']
+        read_only_fields = fields
+
+
+class ReadMarkerAdvanceSerializer(serializers.Serializer):
+    message = serializers.PrimaryKeyRelatedField(queryset=Message.objects.select_related('topic'))
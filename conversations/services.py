@@ -0,0 +1,68 @@
+"""
+Write paths for conversations.
+
+create_message() posts a message with a fixed number of queries, whatever
+the number of tagged users:
+
+1. the topic, with the user's reply permission annotated;
+2. the tagged users (only when there are any);
+3. the message INSERT (plus its search index row, see search.signals);
+4. a topic counter delta INSERT (see topics.counters);
+5. one bulk INSERT of the tagged-user rows and one of their mentions.
+
+Everything runs in one transaction.  Errors are raised as DRF exceptions
+so API views can let them propagate.
+"""
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
+
+from topics.counters import record_message
+from topics.models import Topic
+from users.models import CustomUser
+from .models import Mention, Message
+
+
+@transaction.atomic
+def create_message(user, topic_id, content, tagged_user_ids=()):
+    """Authorize, validate and save a new message by `user`; returns the Message"""
+    topic = Topic.objects.filter(pk=topic_id, is_active=True).with_user_flags(user).first()
+    if topic is None:
+        raise NotFound('Topic not found')
+    # Same rules as Topic.can_user_reply, answered by the annotations
+    if topic.is_closed or topic.is_locked or topic.is_archived or not topic.user_can_reply:
+        raise PermissionDenied('You do not have permission to reply in this topic')
+
+    tagged_user_ids = set(tagged_user_ids)
+    tagged_users = []
+    if tagged_user_ids:
+        tagged_users = list(
+            CustomUser.objects.filter(pk__in=tagged_user_ids).only(
+                'id', 'username', 'first_name', 'last_name'
+            ).order_by('pk')
+        )
+        missing = tagged_user_ids - {tagged.pk for tagged in tagged_users}
+        if missing:
+            raise ValidationError({
+                'tagged_users_ids': [f'Invalid pk "{pk}" - object does not exist.' for pk in sorted(missing)]
+            })
+
+    now = timezone.now()
+    message = Message.objects.create(topic=topic, sender=user, content=content, created_at=now)
+    # An appended delta rather than an UPDATE of the shared topic row
+    record_message(topic.pk, now)
+
+    if tagged_users:
+        # Bulk inserts skip m2m_changed, so the mentions are written here
+        field = Message._meta.get_field('tagged_users')
+        Tagged = field.remote_field.through
+        Tagged.objects.bulk_create([
+            Tagged(**{field.m2m_column_name(): message.pk, field.m2m_reverse_name(): tagged.pk})
+            for tagged in tagged_users
+        ])
+        Mention.objects.bulk_create([
+            Mention(user=tagged, message=message, topic=topic, created_at=now)
+            for tagged in tagged_users
+        ])
+    message.tagged_user_list = tagged_users  # serialized without another query
+    return message
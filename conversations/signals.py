@@ -0,0 +1,77 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from topics.models import Category, Topic
+from .feed import bump_feed_generations
+from .models import Mention, Message
+from .throttling import forget_topic_rates
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def invalidate_recent_activity(sender, instance, created=False, **kwargs):
+    """New messages reach cached feeds when they expire; edits and deletions at once"""
+    if not created:
+        bump_feed_generations([instance.topic_id])
+
+
+@receiver(post_save, sender=Message)
+def move_mentions(sender, instance, created, **kwargs):
+    """Keep the denormalized topic of the mentions right if a message is moved"""
+    if not created:
+        Mention.objects.filter(message=instance).exclude(
+            topic_id=instance.topic_id
+        ).update(topic_id=instance.topic_id)
+
+
+@receiver(m2m_changed, sender=Message.tagged_users.through)
+def sync_mentions(sender, instance, action, reverse, pk_set, **kwargs):
+    """Mirror Message.tagged_users into Mention rows, in the same transaction"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if reverse:
+        # user.tagged_in_messages.add/remove/clear(...)
+        mentions = Mention.objects.filter(user=instance)
+        if action == 'post_add':
+            messages = Message.objects.filter(pk__in=pk_set).values_list('pk', 'topic_id', 'created_at')
+            rows = [
+                Mention(user=instance, message_id=pk, topic_id=topic_id, created_at=created_at)
+                for pk, topic_id, created_at in messages
+            ]
+            Mention.objects.bulk_create(rows, ignore_conflicts=True)
+        elif action == 'post_remove':
+            mentions.filter(message_id__in=pk_set).delete()
+        else:
+            mentions.delete()
+        return
+
+    mentions = Mention.objects.filter(message=instance)
+    if action == 'post_add':
+        rows = [
+            Mention(user_id=user_id, message=instance, topic_id=instance.topic_id,
+                    created_at=instance.created_at)
+            for user_id in pk_set
+        ]
+        Mention.objects.bulk_create(rows, ignore_conflicts=True)
+    elif action == 'post_remove':
+        mentions.filter(user_id__in=pk_set).delete()
+    else:
+        mentions.delete()
+
+
+@receiver(post_save, sender=Category)
+def forget_category_rates(sender, instance, created, update_fields=None, **kwargs):
+    """Posting limits are cached per topic"""
+    if created:
+        return
+    if update_fields is not None and not {'user_message_rate', 'topic_message_rate'} & set(update_fields):
+        return
+    forget_topic_rates(instance.topics.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Topic)
+def forget_topic_category_rates(sender, instance, created, update_fields=None, **kwargs):
+    # The topic may have moved to another category
+    if not created and (update_fields is None or 'category' in update_fields):
+        forget_topic_rates([instance.pk])
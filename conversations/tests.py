@@ -1,3 +1,732 @@
+import csv
+import io
+import json
+import tempfile
+import threading
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import DatabaseError
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from search.backends import get_search_backend
+from topics.counters import (
+    FOLD_LEASE_KEY, _fold_in_background, fold_topic_counters, reconcile_topics, schedule_fold,
+)
+from topics.models import Category, Topic, TopicCounterDelta, TopicRestriction
+from users.models import CustomUser
+from .archive import archive_topic_messages, restore_topic_messages
+from .feed import recent_activity
+from .ingest import ingest_messages
+from .models import ArchivedMessageSegment, Mention, Message, ReadMarker
+from .throttling import topic_rates
+
+
+class MessageCreateTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create(username='admin', role='admin')
+        cls.user = CustomUser.objects.create(username='member')
+        cls.tagged = [CustomUser.objects.create(username=f'tagged{i}') for i in range(5)]
+        category = Category.objects.create(name='General', created_by=cls.admin)
+        cls.topic = Topic.objects.create(title='Hello', category=category, created_by=cls.admin)
+
+    def setUp(self):
+        cache.clear()
+        topic_rates(self.topic.pk)  # posting limits are cached after the first post
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, **data):
+        return self.client.post('/api/conversations/messages/', data, format='json')
+
+    def test_query_count_is_independent_of_tagged_users(self):
+        # savepoint, topic + permission, tagged users, message insert,
+        # search index insert, counter delta, tagged-user rows, mentions,
+        # savepoint release
+        for tagged in (self.tagged[:1], self.tagged):
+            with self.assertNumQueries(9):
+                response = self.post(
+                    topic=self.topic.pk, content='hi', tagged_users_ids=[u.pk for u in tagged]
+                )
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(response.data['tagged_users']), len(tagged))
+
+        message = Message.objects.get(pk=response.data['id'])
+        self.assertEqual(message.tagged_users.count(), 5)
+        self.assertEqual(Mention.objects.filter(message=message).count(), 5)
+        topic = Topic.objects.with_live_counters().get(pk=self.topic.pk)
+        self.assertEqual(topic.live_total_messages, 2)
+        self.assertEqual(topic.live_last_activity, message.created_at)
+
+        # Folding moves the deltas into the stored counters
+        self.assertEqual(fold_topic_counters(), 2)
+        self.topic.refresh_from_db()
+        self.assertEqual(self.topic.total_messages, 2)
+        self.assertEqual(self.topic.last_activity, message.created_at)
+        self.assertEqual(reconcile_topics([self.topic.pk]), 0)
+
+    def test_failed_background_fold_is_logged(self):
+        failure = DatabaseError('database is locked')
+        with mock.patch('topics.counters.fold_topic_counters', side_effect=failure), \
+                self.assertLogs('topics.counters', 'ERROR'):
+            # In a thread of its own, as after commit
+            fold = threading.Thread(target=_fold_in_background)
+            fold.start()
+            fold.join()
+
+    def test_trailing_fold(self):
+        cache.add(FOLD_LEASE_KEY, True)
+        with mock.patch('topics.counters.threading.Thread') as thread:
+            schedule_fold()  # the lease is held: nothing starts
+        thread.assert_not_called()
+
+        folds = []
+
+        def fold():
+            folds.append(1)
+            if len(folds) == 1:
+                schedule_fold()  # a post committing during the first fold
+
+        # The lease expires while the fold thread waits
+        with mock.patch('topics.counters.fold_topic_counters', side_effect=fold), \
+                mock.patch('topics.counters.time.sleep', side_effect=lambda _: cache.delete(FOLD_LEASE_KEY)), \
+                mock.patch('topics.counters.connection'):
+            _fold_in_background()
+        self.assertEqual(len(folds), 2)
+
+    def test_topics_are_listed_by_live_activity(self):
+        older = Topic.objects.create(
+            title='Older', category=self.topic.category, created_by=self.admin,
+            last_activity=self.topic.last_activity - timezone.timedelta(days=1),
+        )
+        self.assertEqual(self.post(topic=older.pk, content='hi').status_code, 201)
+        response = self.client.get('/api/topics/topics/')
+        self.assertEqual([t['title'] for t in response.data], ['Older', 'Hello'])
+
+    def test_query_count_without_tags(self):
+        with self.assertNumQueries(6):
+            response = self.post(topic=self.topic.pk, content='hi')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['sender']['id'], self.user.pk)
+
+    def test_restricted_user_cannot_post(self):
+        TopicRestriction.objects.create(
+            topic=self.topic, user=self.user, can_view=True, can_reply=False, created_by=self.admin
+        )
+        response = self.post(topic=self.topic.pk, content='hi')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Message.objects.exists())
+
+    def test_closed_topic_rejects_messages(self):
+        self.topic.is_closed = True
+        self.topic.save()
+        self.assertEqual(self.post(topic=self.topic.pk, content='hi').status_code, 403)
+
+    def test_unknown_tagged_user_rolls_back(self):
+        response = self.post(topic=self.topic.pk, content='hi', tagged_users_ids=[self.tagged[0].pk, 9999])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Message.objects.exists())
+        self.assertFalse(TopicCounterDelta.objects.exists())
+
+    def test_unknown_topic(self):
+        self.assertEqual(self.post(topic=9999, content='hi').status_code, 404)
+
+    def test_posting_limits(self):
+        category = self.topic.category
+        category.user_message_rate = '2/min'
+        category.topic_message_rate = '3/min'
+        with self.captureOnCommitCallbacks(execute=True):
+            category.save()
+
+        for _ in range(2):
+            self.assertEqual(self.post(topic=self.topic.pk, content='hi').status_code, 201)
+        response = self.post(topic=self.topic.pk, content='hi')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+
+        # Others may still post, until the topic's own limit is reached
+        self.client.force_authenticate(self.tagged[0])
+        self.assertEqual(self.post(topic=self.topic.pk, content='hi').status_code, 201)
+        self.client.force_authenticate(self.tagged[1])
+        self.assertEqual(self.post(topic=self.topic.pk, content='hi').status_code, 429)
+        self.assertEqual(Message.objects.count(), 3)
+
+    def test_zero_rate(self):
+        category = self.topic.category
+        category.user_message_rate = '0/min'
+        with self.assertRaisesMessage(ValidationError, 'allows no messages'):
+            category.full_clean()
+
+        # Saved anyway, or set in DEFAULT_THROTTLE_RATES: refused, not a crash
+        with self.captureOnCommitCallbacks(execute=True):
+            category.save()
+        response = self.post(topic=self.topic.pk, content='hi')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '60')
+
+    def test_async_posting_limits(self):
+        category = self.topic.category
+        category.user_message_rate = '1/min'
+        with self.captureOnCommitCallbacks(execute=True):
+            category.save()
+
+        self.client.force_login(self.user)
+        for status in (201, 429):
+            response = self.client.post(
+                '/api/conversations/async/messages/', {'topic': self.topic.pk, 'content': 'hi'},
+                format='json',
+            )
+            self.assertEqual(response.status_code, status)
+        self.assertGreater(int(response['Retry-After']), 0)
+        # The limit is shared with MessageViewSet.create
+        self.assertEqual(self.post(topic=self.topic.pk, content='hi').status_code, 429)
+
+
+class MessageSyncTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create(username='admin', role='admin')
+        cls.user = CustomUser.objects.create(username='member')
+        category = Category.objects.create(name='General', created_by=cls.admin)
+        cls.topic = Topic.objects.create(title='Hello', category=category, created_by=cls.admin)
+        cls.message = Message.objects.create(topic=cls.topic, sender=cls.admin, content='hi')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def sync(self, topic):
+        return self.client.get('/api/conversations/messages/sync/', {'topic': topic, 'after_id': 0})
+
+    def test_new_messages(self):
+        response = self.sync(self.topic.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m['id'] for m in response.data['results']], [self.message.pk])
+        self.assertEqual(response.data['after_id'], self.message.pk)
+
+    def test_hidden_topics(self):
+        TopicRestriction.objects.create(
+            topic=self.topic, user=self.user, can_view=False, can_reply=False, created_by=self.admin
+        )
+        self.assertEqual(self.sync(self.topic.pk).status_code, 404)
+        response = self.client.get('/api/conversations/messages/', {'topic': self.topic.pk})
+        self.assertEqual(response.data['results'], [])
+
+        for changes in ({'is_archived': True}, {'is_active': False}):
+            TopicRestriction.objects.all().delete()
+            Topic.objects.filter(pk=self.topic.pk).update(**{'is_archived': False, 'is_active': True, **changes})
+            self.assertEqual(self.sync(self.topic.pk).status_code, 404)
+
+    def test_malformed_topic(self):
+        self.assertEqual(self.sync('abc').status_code, 400)
+
+
+class MessagePaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='member')
+        category = Category.objects.create(name='General', created_by=cls.user)
+        cls.topic = Topic.objects.create(title='Hello', category=category, created_by=cls.user)
+        now = timezone.now()
+        # Runs of equal created_at values straddle the page boundaries
+        cls.messages = [
+            Message.objects.create(topic=cls.topic, sender=cls.user, content=f'm{i}',
+                                   created_at=now + timezone.timedelta(seconds=i // 3))
+            for i in range(7)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def walk(self, url, link):
+        """Ids of every page reached by following `link` from `url`, and the last page's url"""
+        pages = []
+        while True:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([m['id'] for m in response.data['results']])
+            if not response.data[link]:
+                return pages, url
+            url = response.data[link]
+
+    def test_cursors_with_equal_created_at(self):
+        ids = [m.pk for m in self.messages]
+        pages, oldest = self.walk(f'/api/conversations/messages/?topic={self.topic.pk}&page_size=2', 'older')
+        self.assertEqual(pages, [ids[5:7], ids[3:5], ids[1:3], ids[0:1]])
+
+        pages, _ = self.walk(oldest, 'newer')
+        self.assertEqual(pages, [ids[0:1], ids[1:3], ids[3:5], ids[5:7]])
+
+
+class AsyncMessageViewTests(TestCase):
+    url = '/api/conversations/async/messages/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='member')
+        category = Category.objects.create(name='General', created_by=cls.user)
+        cls.topic = Topic.objects.create(title='Hello', category=category, created_by=cls.user)
+        cls.hidden = Topic.objects.create(title='Hidden', category=category, created_by=cls.user)
+        TopicRestriction.objects.create(
+            topic=cls.hidden, user=cls.user, can_view=False, can_reply=False, created_by=cls.user
+        )
+        for i in range(3):
+            Message.objects.create(topic=cls.topic, sender=cls.user, content=f'm{i}')
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_list_matches_the_viewset(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        await sync_to_async(self.client.force_login)(self.user)
+        query = {'topic': self.topic.pk, 'page_size': 2}
+        response = await self.async_client.get(self.url, query)
+        self.assertEqual(response.status_code, 200)
+        expected = await sync_to_async(self.client.get)('/api/conversations/messages/', query)
+        self.assertEqual(response.json()['results'], expected.json()['results'])
+
+        # Same cursors too
+        cursor = parse_qs(urlsplit(response.json()['older']).query)['before'][0]
+        older = await self.async_client.get(self.url, {**query, 'before': cursor})
+        expected = await sync_to_async(self.client.get)('/api/conversations/messages/', {**query, 'before': cursor})
+        self.assertEqual(older.json()['results'], expected.json()['results'])
+        self.assertIsNone(older.json()['older'])
+
+    async def test_list_checks_visibility(self):
+        self.assertEqual((await self.async_client.get(self.url, {'topic': self.topic.pk})).status_code, 403)
+        await sync_to_async(self.async_client.force_login)(self.user)
+        self.assertEqual((await self.async_client.get(self.url, {'topic': self.hidden.pk})).status_code, 404)
+        self.assertEqual((await self.async_client.get(self.url, {'topic': 'abc'})).status_code, 400)
+
+    async def test_create(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.post(
+            self.url, {'topic': self.topic.pk, 'content': 'new'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['content'], 'new')
+        self.assertTrue(await Message.objects.filter(pk=response.json()['id']).aexists())
+
+        response = await self.async_client.post(
+            self.url, {'topic': self.hidden.pk, 'content': 'new'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 403)
+        response = await self.async_client.post(self.url, 'not json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class RecentActivityTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='member')
+        category = Category.objects.create(name='General', created_by=cls.user)
+        cls.topic = Topic.objects.create(title='Hello', category=category, created_by=cls.user)
+        cls.message = Message.objects.create(topic=cls.topic, sender=cls.user, content='hi')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_feed(self):
+        self.assertEqual([m['content'] for m in recent_activity(self.user)], ['hi'])
+
+        # Posting elsewhere leaves cached feeds alone until they expire
+        other = Topic.objects.create(title='Other', category=self.topic.category, created_by=self.user)
+        Message.objects.create(topic=other, sender=self.user, content='new')
+        with self.assertNumQueries(0):
+            self.assertEqual([m['content'] for m in recent_activity(self.user)], ['hi'])
+
+        # Edits of a message on show are picked up at once
+        self.message.content = 'edited'
+        self.message.save()
+        self.assertEqual([m['content'] for m in recent_activity(self.user)], ['new', 'edited'])
+
+
+class MessageArchiveTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_superuser(username='admin', password='secret', role='admin')
+        cls.user = CustomUser.objects.create(username='member')
+        category = Category.objects.create(name='General', created_by=cls.admin)
+        cls.topic = Topic.objects.create(title='Hello', category=category, created_by=cls.admin)
+        now = timezone.now()
+        # Some messages share a created_at, so the id breaks the tie
+        cls.messages = [
+            Message.objects.create(topic=cls.topic, sender=cls.user, content=f'm{i}', created_at=now)
+            for i in range(3)
+        ] + [
+            Message.objects.create(topic=cls.topic, sender=cls.user, content=f'm{i}',
+                                   created_at=now + timezone.timedelta(seconds=i))
+            for i in range(3, 5)
+        ]
+        cls.messages[1].tagged_users.add(cls.admin)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def listed(self):
+        response = self.client.get('/api/conversations/messages/', {'topic': self.topic.pk, 'page_size': 10})
+        return [(m['id'], m['content'], [u['id'] for u in m['tagged_users']]) for m in response.data['results']]
+
+    def set_archived(self, archived):
+        Topic.objects.filter(pk=self.topic.pk).update(is_archived=archived)
+
+    def test_archive_and_restore_keep_order(self):
+        listed = self.listed()
+        self.assertEqual(listed, [(m.pk, m.content, [u.pk for u in m.tagged_users.all()]) for m in self.messages])
+
+        self.set_archived(True)
+        self.assertEqual(archive_topic_messages(self.topic.pk, batch_size=2), 5)
+        self.assertFalse(Message.objects.filter(topic=self.topic).exists())
+        self.assertFalse(Mention.objects.filter(topic=self.topic).exists())
+        self.assertEqual(ArchivedMessageSegment.objects.filter(topic=self.topic).count(), 3)
+        self.assertEqual(self.listed(), listed)
+
+        self.set_archived(False)
+        self.assertEqual(restore_topic_messages(self.topic.pk), 5)
+        self.assertFalse(ArchivedMessageSegment.objects.exists())
+        self.assertEqual(self.listed(), listed)
+        self.assertEqual(list(self.messages[1].tagged_users.all()), [self.admin])
+        self.assertEqual(Mention.objects.get().message_id, self.messages[1].pk)
+
+    def test_archived_messages_are_listed_by_visibility(self):
+        self.set_archived(True)
+        archive_topic_messages(self.topic.pk)
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.listed(), [])
+
+        # Unarchived, before the messages are restored: listed to whoever may view the topic
+        self.set_archived(False)
+        self.assertEqual(len(self.listed()), 5)
+        TopicRestriction.objects.create(topic=self.topic, user=self.user, can_view=False, created_by=self.admin)
+        self.assertEqual(self.listed(), [])
+
+    def test_messages_caught_mid_move_are_listed_once(self):
+        listed = self.listed()
+        self.set_archived(True)
+        archive_topic_messages(self.topic.pk)
+        # As if the hot table was read before the move committed
+        Message.objects.bulk_create([
+            Message(id=m.pk, topic=self.topic, sender=self.user, content=m.content, created_at=m.created_at)
+            for m in self.messages[3:]
+        ])
+        self.assertEqual([row[:2] for row in self.listed()], [row[:2] for row in listed])
+
+        response = self.client.get(f'/api/conversations/topics/{self.topic.pk}/export/')
+        records = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([r['id'] for r in records], [m.pk for m in self.messages])
+
+    def test_moves_stop_once_the_flag_changes(self):
+        self.assertEqual(archive_topic_messages(self.topic.pk), 0)
+        self.set_archived(True)
+        archive_topic_messages(self.topic.pk)
+        self.assertEqual(restore_topic_messages(self.topic.pk), 0)
+
+    def test_admin_actions_move_messages_after_the_request(self):
+        self.client.force_login(self.admin)
+        with mock.patch('conversations.archive.threading.Thread') as thread, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/admin/topics/topic/', {
+                'action': 'archive_topics', '_selected_action': [self.topic.pk],
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Message.objects.filter(topic=self.topic).count(), 5)
+        self.assertEqual(thread.call_args.kwargs['args'], ([self.topic.pk],))
+        thread.return_value.start.assert_called_once_with()
+
+
+class TopicExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create(username='admin', role='admin')
+        cls.user = CustomUser.objects.create(username='member')
+        category = Category.objects.create(name='General', created_by=cls.admin)
+        cls.topic = Topic.objects.create(title='Hello', category=category, created_by=cls.admin)
+        cls.messages = [
+            Message.objects.create(topic=cls.topic, sender=cls.user, content=f'line {i}\nwith, comma')
+            for i in range(5)
+        ]
+        cls.messages[2].tagged_users.add(cls.admin, cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def export(self, fmt=None):
+        url = f'/api/conversations/topics/{self.topic.pk}/export/'
+        # Small chunks, so the tagged users are prefetched more than once
+        with mock.patch('conversations.views.EXPORT_CHUNK_SIZE', 2):
+            return self.client.get(url, {'fmt': fmt} if fmt else {})
+
+    def test_ndjson(self):
+        response = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([r['id'] for r in records], [m.pk for m in self.messages])
+        self.assertEqual(records[0]['content'], 'line 0\nwith, comma')
+        self.assertEqual([u['username'] for u in records[2]['tagged_users']], ['admin', 'member'])
+
+    def test_csv(self):
+        response = self.export('csv')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0][:2], ['id', 'created_at'])
+        self.assertEqual([int(row[0]) for row in rows[1:]], [m.pk for m in self.messages])
+        self.assertEqual(rows[3][4:], ['line 2\nwith, comma', 'admin member'])
+
+    def test_archived_messages_are_merged(self):
+        self.client.force_authenticate(self.admin)
+        Topic.objects.filter(pk=self.topic.pk).update(is_archived=True)
+        archive_topic_messages(self.topic.pk, batch_size=2)
+        Message.objects.create(topic=self.topic, sender=self.user, content='late')
+        records = [json.loads(line) for line in b''.join(self.export().streaming_content).splitlines()]
+        self.assertEqual([r['content'] for r in records][-2:], ['line 4\nwith, comma', 'late'])
+        self.assertEqual(len(records), 6)
+        self.assertEqual(len(records[2]['tagged_users']), 2)
+
+    def test_permissions(self):
+        self.assertEqual(self.export('xml').status_code, 400)
+        TopicRestriction.objects.create(topic=self.topic, user=self.user, can_view=False, created_by=self.admin)
+        self.assertEqual(self.export().status_code, 403)
+        TopicRestriction.objects.all().delete()
+        Topic.objects.filter(pk=self.topic.pk).update(is_archived=True)
+        self.assertEqual(self.export().status_code, 403)
+        Topic.objects.filter(pk=self.topic.pk).update(is_active=False)
+        self.assertEqual(self.export().status_code, 404)
+
+
+class ReadMarkerTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create(username='admin', role='admin')
+        cls.user = CustomUser.objects.create(username='member')
+        cls.category = Category.objects.create(name='General', created_by=cls.admin)
+        cls.other_category = Category.objects.create(name='Other', created_by=cls.admin)
+        cls.topic = Topic.objects.create(title='Hello', category=cls.category, created_by=cls.admin)
+        cls.other = Topic.objects.create(title='Other', category=cls.other_category, created_by=cls.admin)
+        cls.old = Message.objects.create(
+            topic=cls.topic, sender=cls.admin, content='old', created_at=timezone.now() - timezone.timedelta(days=30)
+        )
+        cls.messages = [Message.objects.create(topic=cls.topic, sender=cls.admin, content=f'm{i}') for i in range(3)]
+        Message.objects.create(topic=cls.topic, sender=cls.user, content='own')
+        Message.objects.create(topic=cls.other, sender=cls.admin, content='elsewhere')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def advance(self, message):
+        return self.client.post('/api/conversations/read-markers/', {'message': message.pk}, format='json')
+
+    def unread(self, **params):
+        response = self.client.get('/api/conversations/read-markers/unread/', params)
+        self.assertEqual(response.status_code, 200)
+        return {int(topic_id): count for topic_id, count in response.data.items()}
+
+    def test_markers_only_move_forward(self):
+        response = self.advance(self.messages[1])
+        self.assertEqual(response.data['last_read_message_id'], self.messages[1].pk)
+        response = self.advance(self.messages[0])
+        self.assertEqual(response.data['last_read_message_id'], self.messages[1].pk)
+        self.assertEqual(self.unread(category=self.category.pk), {self.topic.pk: 1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            TopicRestriction.objects.create(topic=self.topic, user=self.user, can_view=False, created_by=self.admin)
+        self.assertEqual(self.advance(self.messages[2]).status_code, 403)
+
+    def test_grouped_counts(self):
+        # Own messages never count, old history of an unread topic neither
+        with self.assertNumQueries(3):  # seed lookup, seed insert, grouped count
+            self.assertEqual(self.unread(), {self.topic.pk: 3, self.other.pk: 1})
+        self.assertEqual(ReadMarker.objects.get(user=self.user, topic=self.topic).last_read_message_id, self.old.pk)
+        self.assertEqual(self.unread(category=self.other_category.pk), {self.other.pk: 1})
+
+        self.advance(self.messages[2])
+        self.assertEqual(self.unread(), {self.other.pk: 1})
+        self.assertEqual(self.client.get(
+            '/api/conversations/read-markers/unread/', {'category': 'abc'}
+        ).status_code, 400)
+
+    def test_query_count_is_independent_of_topics(self):
+        for n in range(5):
+            topic = Topic.objects.create(title=f'Topic {n}', category=self.category, created_by=self.admin)
+            Message.objects.create(
+                topic=topic, sender=self.admin, content='old', created_at=timezone.now() - timezone.timedelta(days=2)
+            )
+        with self.assertNumQueries(3):
+            self.unread()
+        with self.assertNumQueries(2):  # nothing left to seed
+            counts = self.unread()
+        self.assertEqual(counts, {self.topic.pk: 3, self.other.pk: 1})
+
+
+class MentionInboxTests(TestCase):
+    url = '/api/conversations/mentions/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create(username='admin', role='admin')
+        cls.user = CustomUser.objects.create(username='member')
+        category = Category.objects.create(name='General', created_by=cls.admin)
+        cls.topic = Topic.objects.create(title='Hello', category=category, created_by=cls.admin)
+        cls.hidden = Topic.objects.create(title='Hidden', category=category, created_by=cls.admin)
+
+    def setUp(self):
+        cache.clear()
+        topic_rates(self.topic.pk)
+        topic_rates(self.hidden.pk)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        # Tagging through the API, so the mentions come from create_message
+        self.mentions = [self.post(self.topic, f'm{i}') for i in range(5)]
+        self.post(self.hidden, 'hidden')
+        with self.captureOnCommitCallbacks(execute=True):
+            TopicRestriction.objects.create(
+                topic=self.hidden, user=self.user, can_view=False, created_by=self.admin
+            )
+        self.client.force_authenticate(self.user)
+
+    def post(self, topic, content):
+        response = self.client.post('/api/conversations/messages/', {
+            'topic': topic.pk, 'content': content, 'tagged_users_ids': [self.user.pk],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def test_mentions_are_written_with_the_message(self):
+        self.assertEqual(Mention.objects.filter(user=self.user).count(), 6)
+        with mock.patch('conversations.services.Mention.objects.bulk_create', side_effect=DatabaseError):
+            self.client.force_authenticate(self.admin)
+            with self.assertRaises(DatabaseError):
+                self.post(self.topic, 'lost')
+        self.assertFalse(Message.objects.filter(content='lost').exists())
+
+    def test_cursor_pages_newest_first(self):
+        pages, url = [], f'{self.url}?page_size=2'
+        while url:
+            response = self.client.get(url)
+            pages.append([mention['message']['id'] for mention in response.data['results']])
+            url = response.data['older']
+        self.assertEqual(pages, [self.mentions[:2:-1], self.mentions[2:0:-1], self.mentions[:1]])
+
+    def test_unread(self):
+        self.assertEqual(self.client.get(f'{self.url}unread_count/').data, {'unread': 5})
+        first = self.client.get(self.url, {'unread': 1}).data['results'][-1]
+        response = self.client.post(f'{self.url}mark_read/', {'ids': [first['id']]}, format='json')
+        self.assertEqual(response.data, {'marked': 1, 'unread': 4})
+        self.assertEqual(len(self.client.get(self.url, {'unread': 1}).data['results']), 4)
+
+        # Mentions in the hidden topic stay unread
+        response = self.client.post(f'{self.url}mark_read/', {}, format='json')
+        self.assertEqual(response.data, {'marked': 4, 'unread': 0})
+        self.assertEqual(Mention.objects.filter(user=self.user, read_at__isnull=True).count(), 1)
+
+        response = self.client.post(f'{self.url}mark_read/', {'ids': 'all'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class MessageImportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create(username='admin', role='admin')
+        cls.user = CustomUser.objects.create(username='member')
+        category = Category.objects.create(name='General', created_by=cls.admin)
+        cls.topic = Topic.objects.create(title='Hello', category=category, created_by=cls.admin)
+        cls.other = Topic.objects.create(title='Other', category=category, created_by=cls.admin)
+
+    def setUp(self):
+        cache.clear()
+
+    def line(self, topic=None, sender=None, content='hi', **fields):
+        record = {'topic': (topic or self.topic).pk, 'sender': (sender or self.user).pk, 'content': content}
+        return json.dumps({**record, **fields})
+
+    def lines(self):
+        return [
+            self.line(content='first', created_at='2023-05-01T09:30:00Z', tagged_users_ids=[self.admin.pk]),
+            '{not json',
+            self.line(topic=self.other, content='elsewhere', created_at='2023-05-01T09:31:00Z'),
+            '',
+            json.dumps({'topic': 999999, 'sender': self.user.pk, 'content': 'x'}),
+            json.dumps({'topic': self.topic.pk, 'sender': 999999, 'content': 'x'}),
+            self.line(tagged_users_ids=[999999]),
+            self.line(created_at='yesterday'),
+            '[1, 2]',
+            self.line(content='last', created_at='2023-05-01T10:00:00Z', tagged_users_ids=[self.admin.pk]),
+        ]
+
+    def test_import_across_chunks(self):
+        result = ingest_messages(self.lines(), chunk_size=3)
+        self.assertEqual(result.imported, 3)
+        self.assertEqual(result.errors, [
+            {'line': 2, 'error': mock.ANY},
+            {'line': 5, 'error': 'Unknown topic 999999'},
+            {'line': 6, 'error': 'Unknown sender 999999'},
+            {'line': 7, 'error': 'Unknown tagged users [999999]'},
+            {'line': 8, 'error': 'created_at must be an ISO 8601 datetime'},
+            {'line': 9, 'error': 'Expected a JSON object'},
+        ])
+        self.assertTrue(result.errors[0]['error'].startswith('Invalid JSON'))
+
+        first, last = Message.objects.filter(topic=self.topic).order_by('created_at')
+        self.assertEqual([first.content, last.content], ['first', 'last'])
+        self.assertEqual(list(last.tagged_users.all()), [self.admin])
+        self.assertEqual(
+            set(Mention.objects.values_list('message_id', 'user_id', 'topic_id')),
+            {(first.pk, self.admin.pk, self.topic.pk), (last.pk, self.admin.pk, self.topic.pk)},
+        )
+        found = get_search_backend().search_messages(Message.objects.all(), 'elsewhere')
+        self.assertEqual([m.content for m in found], ['elsewhere'])
+
+        # Counters are recounted once at the end
+        self.topic.refresh_from_db()
+        self.assertEqual(self.topic.total_messages, 2)
+        self.assertEqual(self.topic.last_activity, last.created_at)
+        self.assertEqual(reconcile_topics([self.topic.pk, self.other.pk]), 0)
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson') as source:
+            source.write('\n'.join(self.lines()))
+            source.flush()
+            out, err = io.StringIO(), io.StringIO()
+            call_command('import_messages', source.name, '--chunk-size', '2', stdout=out, stderr=err)
+        self.assertIn('Imported 3 messages into 2 topics (6 skipped)', out.getvalue())
+        self.assertIn('line 5: Unknown topic 999999', err.getvalue())
+
+    def test_endpoint(self):
+        client = APIClient()
+        url = '/api/conversations/messages/import/'
+        body = '\n'.join(self.lines())
+
+        client.force_authenticate(self.user)
+        self.assertEqual(client.post(url, body, content_type='application/x-ndjson').status_code, 403)
+
+        client.force_authenticate(self.admin)
+        for chunk_size in ('0', 'abc'):
+            response = client.post(f'{url}?chunk_size={chunk_size}', body, content_type='application/x-ndjson')
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Message.objects.exists())
 
-# Create your tests here.
+        response = client.post(f'{url}?chunk_size=2', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['imported'], 3)
+        self.assertEqual(response.data['topics'], 2)
+        self.assertEqual(response.data['skipped'], 6)
@@ -0,0 +1,145 @@
+"""
+Posting limits for messages, per user and per topic.
+
+Both throttles count posts in Django's cache with sliding-window counters.
+Each window (the rate's period) has one counter.  A post is allowed while
+
+    previous window's count * share of it still inside the window + current count
+
+stays under the limit.  This approximates a true sliding window with two
+integers per key, and does not reset in a burst at window boundaries.
+
+Limits come from the topic's Category (user_message_rate,
+topic_message_rate), or from REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']
+when blank.  Each topic's category and rates are cached and forgotten
+when they change (see conversations.signals).
+
+* MessageUserThrottle: posts of one user in one category.
+* MessageTopicThrottle: posts of all users in one topic.
+
+MessageViewSet.create applies them as DRF throttles; the async create view
+calls check_posting_limits().  Either way a post only counts once every
+throttle has let it through.  Counters are read and then incremented without
+a lock, so simultaneous posts can overshoot a limit by a few.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.throttling import SimpleRateThrottle
+
+from topics.models import Topic
+
+
+RATES_TIMEOUT = getattr(settings, 'MESSAGE_RATE_CACHE_TIMEOUT', 5 * 60)
+
+
+def _rates_key(topic_id):
+    return f'message-rates:topic:{topic_id}'
+
+
+def topic_rates(topic_id):
+    """(category id, user rate, topic rate) for posts in `topic_id`, or None if there is no such topic"""
+    key = _rates_key(topic_id)
+    rates = cache.get(key)
+    if rates is None:
+        rates = Topic.objects.filter(pk=topic_id).values_list(
+            'category_id', 'category__user_message_rate', 'category__topic_message_rate'
+        ).first()
+        if rates is None:
+            return None
+        cache.set(key, rates, RATES_TIMEOUT)
+    return rates
+
+
+def forget_topic_rates(topic_ids):
+    """Drop the cached rates of `topic_ids` once the current transaction commits"""
+    keys = [_rates_key(topic_id) for topic_id in topic_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+class SlidingWindowThrottle(SimpleRateThrottle):
+    """Sliding-window counter throttle for posts to a topic (see the module docstring)"""
+
+    window_key = None
+
+    def get_target(self, user, topic_id, category_id, user_rate, topic_rate):
+        """(ident, rate) the post counts against; a blank rate means the scope's default"""
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        if view.action != 'create' or not hasattr(request.data, 'get'):
+            return True
+        try:
+            topic_id = int(request.data.get('topic'))
+        except (TypeError, ValueError):
+            return True  # rejected by the serializer
+        return self.allow_post(request.user, topic_id)
+
+    def allow_post(self, user, topic_id):
+        """Whether `user` may post in `topic_id` now; call hit() once the post is accepted"""
+        rates = topic_rates(topic_id)
+        if rates is None:
+            return True  # rejected by create_message
+
+        ident, rate = self.get_target(user, topic_id, *rates)
+        self.num_requests, self.duration = self.parse_rate(rate or self.rate)
+        now = self.timer()
+        window = int(now // self.duration)
+        self.elapsed = now / self.duration - window  # share of the current window gone by
+        # The period is part of the key, so changing a rate's period starts afresh
+        key = f'throttle:{self.scope}:{ident}:{self.duration}:'
+        counts = self.cache.get_many([f'{key}{window - 1}', f'{key}{window}'])
+        self.previous = counts.get(f'{key}{window - 1}', 0)
+        self.current = counts.get(f'{key}{window}', 0)
+        self.window_key = f'{key}{window}'
+        return self.previous * (1 - self.elapsed) + self.current < self.num_requests
+
+    def hit(self):
+        """Count the post in the current window"""
+        if self.window_key is None:
+            return
+        # The counter must outlive its window, which is then the previous one
+        self.cache.add(self.window_key, 0, self.duration * 2)
+        try:
+            self.cache.incr(self.window_key)
+        except ValueError:
+            self.cache.set(self.window_key, 1, self.duration * 2)  # expired in between
+
+    def wait(self):
+        if not self.num_requests:
+            return self.duration  # a 0/<period> rate (e.g. from settings) never lets a post through
+        remaining = self.duration * (1 - self.elapsed)
+        if self.current < self.num_requests:
+            # Until enough of the previous window has slid out
+            return max(remaining - self.duration * (self.num_requests - self.current) / self.previous, 1)
+        # Until the current window has become the previous one and slid out far enough
+        return remaining + self.duration * (1 - self.num_requests / self.current)
+
+
+class MessageUserThrottle(SlidingWindowThrottle):
+    scope = 'message_user'
+
+    def get_target(self, user, topic_id, category_id, user_rate, topic_rate):
+        return f'{user.pk}:{category_id}', user_rate
+
+
+class MessageTopicThrottle(SlidingWindowThrottle):
+    scope = 'message_topic'
+
+    def get_target(self, user, topic_id, category_id, user_rate, topic_rate):
+        return topic_id, topic_rate
+
+
+def check_posting_limits(user, topic_id):
+    """
+    Seconds `user` must wait before posting in `topic_id`, or None if the
+    post may go ahead, in which case it is counted.
+    """
+    throttles = [MessageUserThrottle(), MessageTopicThrottle()]
+    durations = [throttle.wait() for throttle in throttles if not throttle.allow_post(user, topic_id)]
+    if durations:
+        return max(durations)
+    for throttle in throttles:
+        throttle.hit()
+    return None
@@ -1,11 +1,16 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import MessageViewSet
+from . import async_views
+from .views import MentionViewSet, MessageViewSet, ReadMarkerViewSet, export_topic
 
 router = DefaultRouter()
 router.register(r'messages', MessageViewSet)
+router.register(r'mentions', MentionViewSet, basename='mention')
+router.register(r'read-markers', ReadMarkerViewSet, basename='read-marker')
 
 urlpatterns = [
+    path('async/messages/', async_views.messages, name='async-messages'),
+    path('topics/<int:topic_id>/export/', export_topic, name='topic-export'),
     path('', include(router.urls)),
 ]
 # This file defines the URL routing for the conversations app, specifically for the MessageViewSet.
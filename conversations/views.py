@@ -1,11 +1,29 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.utils import timezone
 from django.shortcuts import render
-from django.db.models import F
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
 
-from rest_framework import viewsets, permissions
-from .models import Message
-from .serializers import MessageSerializer
+from rest_framework import mixins, viewsets, permissions, status
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.response import Response
+from .archive import merge_archived
+from .export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, iter_topic_messages
+from .models import ArchivedMessageSegment, Mention, Message, ReadMarker
+from .pagination import KeysetPagination
+from .realtime import broadcast_message
+from .serializers import (
+    MentionSerializer, MessageCreateSerializer, MessageSerializer,
+    ReadMarkerAdvanceSerializer, ReadMarkerSerializer
+)
+from .ingest import DEFAULT_CHUNK_SIZE, ingest_messages
+from .services import create_message
+from .throttling import MessageTopicThrottle, MessageUserThrottle
 from topics.models import Topic
+from topics.views import IsAdminUser
 
 class IsAllowedToReply(permissions.BasePermission):
     def has_permission(self, request, view):
@@ -13,6 +31,11 @@ class IsAllowedToReply(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
 
+        # Posting is authorized inside services.create_message, together
+        # with the rest of the write
+        if view.action == 'create':
+            return True
+
         topic_id = request.data.get("topic")
         if not topic_id:
             return False
@@ -23,32 +46,291 @@ class IsAllowedToReply(permissions.BasePermission):
             return False
 
 
+class MessagePagination(KeysetPagination):
+    """Pages of an archived topic also read its archive segments (see conversations.archive)"""
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.archived_topic_id = view.get_archived_topic_id() if view else None
+        return super().paginate_queryset(queryset, request, view)
+
+    def fetch_rows(self, queryset, position, newer, limit):
+        rows = super().fetch_rows(queryset, position, newer, limit)
+        if self.archived_topic_id:
+            rows = merge_archived(rows, self.archived_topic_id, position, newer, limit)
+        return rows
+
+
 class MessageViewSet(viewsets.ModelViewSet):
     queryset = Message.objects.all()
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated, IsAllowedToReply]
+    pagination_class = MessagePagination
+    throttle_classes = [MessageUserThrottle, MessageTopicThrottle]  # posting only
 
-    base_queryset = Message.objects.select_related('topic', 'sender').order_by('created_at')
+    base_queryset = Message.objects.select_related('topic', 'sender').prefetch_related(
+        'tagged_users'
+    ).order_by('created_at', 'id')
 
     def get_queryset(self):
         """
         If the client passed ?topic=<id>, filter down to just that topic’s messages;
-        otherwise return the full list.
+        otherwise return the full list.  Only messages in topics listed to the
+        user are included.  Lists are paginated by KeysetPagination
+        (?before=<cursor> / ?after=<cursor>).
         """
-        qs = self.base_queryset
+        qs = self.base_queryset.visible_to(self.request.user)
         topic_id = self.request.query_params.get('topic')
         if topic_id is not None:
             qs = qs.filter(topic_id=topic_id)
         return qs
+
+    def get_archived_topic_id(self):
+        """The ?topic=<id> being listed, if it is listed to the user and some of its messages are archived"""
+        try:
+            topic_id = int(self.request.query_params['topic'])
+        except (KeyError, ValueError):
+            return None
+        # The segments bypass get_queryset(), so they get the same visibility check
+        if Topic.objects.accessible_to(self.request.user).filter(
+            pk=topic_id, pk__in=ArchivedMessageSegment.objects.values('topic_id')
+        ).exists():
+            return topic_id
+        return None
     
-    def perform_create(self, serializer):
-        # bump topic counters
-        topic = serializer.validated_data['topic']
-        topic.total_messages = F('total_messages') + 1
-        topic.last_activity = timezone.now()
-        topic.save(update_fields=['total_messages', 'last_activity'])
-        
-        # save message with the current user as sender
-        serializer.save(sender=self.request.user)
+    @action(detail=False, methods=['get'])
+    def sync(self, request):
+        """
+        Return only the messages of ?topic=<id> newer than a watermark.
+
+        The watermark is either ?after_id=<message id> or ?since=<ISO datetime>;
+        the response carries the new watermark to send on the next poll.  With
+        nothing new this is a single empty range scan on the topic index.
+        """
+        after_id = request.query_params.get('after_id')
+        since = request.query_params.get('since')
+
+        try:
+            topic_id = int(request.query_params['topic'])
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'topic is required and must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not Topic.objects.accessible_to(request.user).filter(pk=topic_id).exists():
+            return Response({'error': 'Topic not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        queryset = self.get_queryset()
+        try:
+            if after_id:
+                after_id = int(after_id)
+                queryset = queryset.after(after_id)
+            elif since:
+                since = parse_datetime(since)
+                if since is None:
+                    raise ValueError(since)
+                queryset = queryset.filter(created_at__gt=since)
+            else:
+                raise ValueError('watermark')
+        except ValueError:
+            return Response(
+                {'error': 'A valid after_id or since watermark is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        limit = self.paginator.get_page_size(request)
+        messages = list(queryset.order_by('created_at', 'id')[:limit + 1])
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+
+        if messages:
+            after_id, since = messages[-1].id, messages[-1].created_at
+        return Response({
+            'results': self.get_serializer(messages, many=True).data,
+            'after_id': after_id or None,
+            'since': since.isoformat() if since else None,
+            'has_more': has_more,
+        })
+
+    @action(detail=False, methods=['post'], url_path='import', permission_classes=[IsAdminUser])
+    def import_messages(self, request):
+        """
+        Bulk import an NDJSON request body (see conversations.ingest).
+        The body is streamed line by line rather than parsed up front, so
+        ?chunk_size=<n> bounds memory however large the upload is.
+        """
+        try:
+            chunk_size = int(request.query_params.get('chunk_size', DEFAULT_CHUNK_SIZE))
+        except ValueError:
+            chunk_size = 0
+        if chunk_size < 1:
+            return Response(
+                {'error': 'chunk_size must be a positive integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Iterating the Django request reads the body stream lazily; going
+        # through request.data would buffer and parse it whole
+        result = ingest_messages(request._request, chunk_size)
+        return Response(result.as_dict())
+
+    def check_throttles(self, request):
+        """As APIView.check_throttles, but a post only counts once every throttle allows it"""
+        throttles = self.get_throttles()
+        durations = [throttle.wait() for throttle in throttles if not throttle.allow_request(request, self)]
+        if durations:
+            self.throttled(request, max(durations))
+        for throttle in throttles:
+            throttle.hit()
+
+    def create(self, request, *args, **kwargs):
+        serializer = MessageCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        message = create_message(
+            request.user,
+            serializer.validated_data['topic'],
+            serializer.validated_data['content'],
+            serializer.validated_data['tagged_users_ids'],
+        )
+        data = MessageSerializer(message, context=self.get_serializer_context()).data
+
+        # push it to WebSocket subscribers once the row is committed
+        transaction.on_commit(lambda: broadcast_message(message.topic_id, data))
+        return Response(data, status=status.HTTP_201_CREATED)
+
+
+
+class MentionPagination(KeysetPagination):
+    newest_first = True
+
+
+class MentionViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    The requesting user's mentions inbox, newest first.
+
+    ?unread=1 limits it to unread mentions.  Mentions in topics the user can
+    no longer view are hidden, and not counted as unread.
+    """
+    serializer_class = MentionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = MentionPagination
+
+    def get_visible_mentions(self):
+        return Mention.objects.filter(user=self.request.user).visible_to(self.request.user)
+
+    def get_queryset(self):
+        queryset = self.get_visible_mentions().select_related(
+            'topic', 'message__topic', 'message__sender'
+        ).prefetch_related('message__tagged_users')
+        if self.request.query_params.get('unread') in ('1', 'true'):
+            queryset = queryset.unread()
+        return queryset
+
+    @action(detail=False, methods=['get'])
+    def unread_count(self, request):
+        return Response({'unread': self.get_visible_mentions().unread().count()})
+
+    @action(detail=False, methods=['post'])
+    def mark_read(self, request):
+        """
+        Mark mentions read: the ones listed in `ids`, or all of them when no
+        ids are given.  Returns the remaining unread count.  Mentions hidden
+        from the inbox are left alone, as they are not counted either.
+        """
+        ids = request.data.get('ids')
+        mentions = self.get_visible_mentions().unread()
+        if ids is not None:
+            if not isinstance(ids, list) or not all(isinstance(pk, int) for pk in ids):
+                return Response(
+                    {'error': 'ids must be a list of mention ids'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            mentions = mentions.filter(pk__in=ids)
+        marked = mentions.update(read_at=timezone.now())
+        return Response({
+            'marked': marked,
+            'unread': self.get_visible_mentions().unread().count(),
+        })
+
+
+# Messages older than this in a topic the user never read count as read
+UNREAD_HISTORY = timedelta(seconds=getattr(settings, 'UNREAD_HISTORY_SECONDS', 24 * 60 * 60))
+
+
+class ReadMarkerViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    Read state of the requesting user.
+
+    POST read-markers/ {"message": <id>} advances the marker of the message's
+    topic; GET read-markers/unread/?category=<id> returns {topic_id: count}
+    for the user's visible topics (of one category, or all of them).  Topics
+    without a marker get one first (see ReadMarker.seed), so only their last
+    UNREAD_HISTORY_SECONDS of messages count.
+    """
+    serializer_class = ReadMarkerSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return ReadMarker.objects.filter(user=self.request.user)
+
+    def create(self, request):
+        serializer = ReadMarkerAdvanceSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        message = serializer.validated_data['message']
+        if not message.topic.can_user_view(request.user):
+            return Response(
+                {'error': 'You do not have permission to view this topic'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        marker = ReadMarker.advance(request.user, message)
+        return Response(ReadMarkerSerializer(marker).data)
+
+    @action(detail=False, methods=['get'])
+    def unread(self, request):
+        messages = Message.objects.visible_to(request.user)
+        topics = Topic.objects.accessible_to(request.user)
+        category_id = request.query_params.get('category')
+        if category_id:
+            try:
+                messages = messages.filter(topic__category_id=int(category_id))
+                topics = topics.filter(category_id=int(category_id))
+            except ValueError:
+                return Response(
+                    {'error': 'category must be an integer'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        ReadMarker.seed(request.user, topics, timezone.now() - UNREAD_HISTORY)
+        return Response(messages.unread_counts(request.user))
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def export_topic(request, topic_id):
+    """
+    Stream the whole transcript of a topic, oldest first, as
+    ?fmt=ndjson (default) or ?fmt=csv.  Memory use does not grow with the
+    topic: rows are read in chunks and written out as they are formatted.
+    """
+    fmt = request.query_params.get('fmt', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return Response(
+            {'error': f'fmt must be one of: {", ".join(EXPORT_FORMATS)}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
 
+    topic = Topic.objects.filter(pk=topic_id, is_active=True).first()
+    if topic is None:
+        return Response({'error': 'Topic not found'}, status=status.HTTP_404_NOT_FOUND)
+    # Archived topics are hidden from regular users everywhere else too
+    if not topic.can_user_view(request.user) or (topic.is_archived and not request.user.is_admin()):
+        return Response(
+            {'error': 'You do not have permission to view this topic'},
+            status=status.HTTP_403_FORBIDDEN
+        )
 
+    lines, content_type = EXPORT_FORMATS[fmt]
+    response = StreamingHttpResponse(
+        lines(iter_topic_messages(topic, EXPORT_CHUNK_SIZE)), content_type=content_type
+    )
+    response['Content-Disposition'] = f'attachment; filename="topic-{topic.pk}.{fmt}"'
+    return response
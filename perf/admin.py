@@ -0,0 +1,53 @@
+from django.contrib import admin
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
+
+from .models import RequestProfile
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ['created_at', 'method', 'path', 'mode', 'status_code', 'duration_ms', 'samples', 'user', 'download_link']
+    list_filter = ['mode', 'method', 'status_code']
+    search_fields = ['path', 'user__username']
+    date_hierarchy = 'created_at'
+    fields = [
+        'created_at', 'user', 'mode', 'method', 'path', 'status_code',
+        'duration_ms', 'samples', 'download_link', 'summary', 'collapsed',
+    ]
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False  # profiles are captured, not written
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path(
+                '<int:profile_id>/download/', self.admin_site.admin_view(self.download),
+                name='perf_requestprofile_download',
+            ),
+        ] + super().get_urls()
+
+    def download_link(self, obj):
+        label = 'collapsed stacks' if obj.mode == 'sample' else 'pstats (.prof)'
+        url = reverse('admin:perf_requestprofile_download', args=[obj.pk])
+        return format_html('<a href="{}">{}</a>', url, label)
+    download_link.short_description = 'Download'
+
+    def download(self, request, profile_id):
+        if not self.has_view_permission(request):
+            return HttpResponse(status=403)
+        profile = get_object_or_404(RequestProfile, pk=profile_id)
+        if profile.mode == 'sample':
+            response = HttpResponse(profile.collapsed, content_type='text/plain; charset=utf-8')
+            filename = f'profile-{profile.pk}.collapsed'
+        else:
+            response = HttpResponse(bytes(profile.stats or b''), content_type='application/octet-stream')
+            filename = f'profile-{profile.pk}.prof'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
@@ -0,0 +1,95 @@
+"""
+Per-request SQL accounting through connection.execute_wrapper().
+
+A QueryRecorder is installed as an execute wrapper on every database
+connection for the duration of a request (see perf.middleware) or of a
+test block (see perf.testing).  It counts queries, sums their time, and
+groups them by fingerprint -- the SQL with literals and IN lists
+collapsed -- so the same query run in a loop (an N+1) shows up as one
+fingerprint with a high count.  Queries slower than
+PERF_SLOW_QUERY_MS are logged to the `perf.slow_queries` logger with the
+line of project code that issued them.
+"""
+import logging
+import re
+import time
+import traceback
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+
+import django
+import rest_framework
+from django.conf import settings
+from django.db import connections
+
+
+slow_query_logger = logging.getLogger('perf.slow_queries')
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)')
+# Frames from these directories are skipped when locating a query's origin
+_LIBRARY_DIRS = tuple(
+    str(Path(module.__file__).resolve().parent) for module in (django, rest_framework)
+) + (str(Path(__file__).resolve().parent),)
+
+
+def fingerprint(sql):
+    """`sql` with literals and placeholder lists collapsed"""
+    sql = _LITERALS.sub('?', sql)
+    return _IN_LISTS.sub('(...)', sql)
+
+
+def query_origin():
+    """'path:line in function' of the innermost project frame running a query"""
+    for frame in reversed(traceback.extract_stack()[:-1]):
+        filename = str(Path(frame.filename).resolve())
+        if not filename.startswith(_LIBRARY_DIRS) and 'site-packages' not in filename:
+            return f'{frame.filename}:{frame.lineno} in {frame.name}'
+    return 'unknown'
+
+
+class QueryRecorder:
+    """Execute wrapper recording every query run while it is installed"""
+
+    def __init__(self, slow_query_ms=None):
+        if slow_query_ms is None:
+            slow_query_ms = getattr(settings, 'PERF_SLOW_QUERY_MS', 100)
+        self.slow_query_seconds = slow_query_ms / 1000
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.duration += elapsed
+            self.fingerprints[fingerprint(sql)] += 1
+            self.queries.append((sql, elapsed))
+            if elapsed >= self.slow_query_seconds:
+                slow_query_logger.warning(
+                    '%.1f ms %s [%s] %s', elapsed * 1000,
+                    context['connection'].alias, query_origin(), sql,
+                )
+
+    @property
+    def duplicates(self):
+        """{fingerprint: count} of the queries run more than once"""
+        return {sql: count for sql, count in self.fingerprints.items() if count > 1}
+
+    @property
+    def duplicate_count(self):
+        """Executions beyond the first of each duplicated query"""
+        return sum(count - 1 for count in self.duplicates.values())
+
+    @contextmanager
+    def installed(self):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
@@ -0,0 +1,130 @@
+import json
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from topics.models import Category, Topic
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the main API endpoints with the DRF test client against the '
+        'configured database, as an admin and as a regular user.  Reports p50/p95 '
+        'latency and SQL query counts as JSON, and with --baseline flags endpoints '
+        'that got slower or issue more queries than a stored run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help='Timed requests per endpoint')
+        parser.add_argument('--prefix', default='perf', help='Users seeded by seed_perf_data')
+        parser.add_argument('--output', help='Write the JSON report to this file (default: stdout)')
+        parser.add_argument('--baseline', help='Earlier report to compare against')
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='Allowed p95 slowdown against the baseline, as a fraction (default 0.2)',
+        )
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be positive')
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline'], encoding='utf-8') as baseline_file:
+                    baseline = json.load(baseline_file)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f'Cannot read baseline: {exc}')
+
+        results = {}
+        # The test client sends Host: testserver
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for role, user in self.get_users(options['prefix']):
+                client = APIClient()
+                client.force_authenticate(user)
+                for name, url in self.get_endpoints(user):
+                    results[f'{name}[{role}]'] = self.measure(client, url, options['iterations'])
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'iterations': options['iterations'],
+            'results': results,
+        }
+        if baseline is not None:
+            report['regressions'] = self.compare(results, baseline.get('results', {}), options['threshold'])
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output_file:
+                output_file.write(output + '\n')
+            self.stdout.write(f"Report written to {options['output']}")
+        else:
+            self.stdout.write(output)
+
+        if report.get('regressions'):
+            for regression in report['regressions']:
+                self.stderr.write(f'REGRESSION {regression}')
+            raise CommandError(f"{len(report['regressions'])} endpoints regressed against the baseline")
+
+    def get_users(self, prefix):
+        admin = CustomUser.objects.filter(username=f'{prefix}_admin').first()
+        user = CustomUser.objects.filter(
+            username__startswith=f'{prefix}_user_'
+        ).order_by('pk').first()
+        if admin is None or user is None:
+            raise CommandError(f'No "{prefix}" users; run seed_perf_data first')
+        return [('admin', admin), ('user', user)]
+
+    def get_endpoints(self, user):
+        category = Category.objects.filter(is_active=True).visible_to(user).order_by('pk').first()
+        topic = Topic.objects.accessible_to(user).order_by('-total_messages', 'pk').first()
+        if category is None or topic is None:
+            raise CommandError(f'{user.username} can see no category or topic')
+        return [
+            ('categories.list', '/api/topics/categories/'),
+            ('categories.topics', f'/api/topics/categories/{category.pk}/topics/'),
+            ('topics.list', '/api/topics/topics/'),
+            ('topics.list_by_category', f'/api/topics/topics/?category={category.pk}'),
+            ('topics.detail', f'/api/topics/topics/{topic.pk}/'),
+            ('messages.list', f'/api/conversations/messages/?topic={topic.pk}'),
+            ('dashboard.data', '/users/api/dashboard-data/'),
+        ]
+
+    def measure(self, client, url, iterations):
+        client.get(url)  # warm up caches and connections
+        latencies, queries, statuses = [], [], set()
+        for _ in range(iterations):
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = client.get(url)
+                latencies.append(time.perf_counter() - start)
+            queries.append(len(captured))
+            statuses.add(response.status_code)
+        latencies.sort()
+        return {
+            'url': url,
+            'status': sorted(statuses),
+            'p50_ms': round(statistics.median(latencies) * 1000, 2),
+            'p95_ms': round(latencies[max(0, int(len(latencies) * 0.95) - 1)] * 1000, 2),
+            'queries': max(queries),
+        }
+
+    def compare(self, results, baseline, threshold):
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+            if result['queries'] > before['queries']:
+                regressions.append(f"{name}: {before['queries']} -> {result['queries']} queries")
+            if result['p95_ms'] > before['p95_ms'] * (1 + threshold):
+                regressions.append(f"{name}: p95 {before['p95_ms']} -> {result['p95_ms']} ms")
+        return regressions
@@ -0,0 +1,175 @@
+import json
+import random
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from conversations.ingest import ingest_messages
+from search.backends import get_search_backend
+from topics.models import Category, CategoryRestriction, Topic, TopicRestriction
+from topics.permission_cache import bump_global_permission_version
+from users.models import CustomUser, Department
+
+
+WORDS = (
+    'deploy review release budget design sprint client invoice campaign server '
+    'backlog meeting report roadmap latency database hiring onboarding metrics '
+    'incident contract launch feedback estimate migration schedule'
+).split()
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate synthetic departments, users, categories, topics, restrictions '
+        'and messages with bulk inserts, for benchmarking (see run_benchmarks). '
+        'Every generated name starts with --prefix, so --flush can remove them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--departments', type=int, default=10)
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--topics', type=int, default=500, help='Topics in total')
+        parser.add_argument('--messages', type=int, default=100000, help='Messages in total')
+        parser.add_argument(
+            '--restriction-rate', type=float, default=0.05,
+            help='Share of (user, category) and (user, topic) pairs given a restriction',
+        )
+        parser.add_argument('--tag-rate', type=float, default=0.1, help='Share of messages tagging users')
+        parser.add_argument('--days', type=int, default=90, help='Spread messages over this many days')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk insert')
+        parser.add_argument('--prefix', default='perf', help='Prefix of every generated name')
+        parser.add_argument('--password', default='perf-password', help='Password of every generated user')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed, for repeatable data')
+        parser.add_argument('--flush', action='store_true', help='Delete earlier data with this prefix first')
+
+    def handle(self, *args, **options):
+        for name in ('departments', 'users', 'categories', 'topics', 'batch_size'):
+            if options[name] < 1:
+                raise CommandError(f"--{name.replace('_', '-')} must be positive")
+        self.random = random.Random(options['seed'])
+        self.options = options
+        self.prefix = options['prefix']
+        self.batch_size = options['batch_size']
+
+        if options['flush']:
+            self.flush()
+        if CustomUser.objects.filter(username__startswith=f'{self.prefix}_').exists():
+            raise CommandError(f'Data with prefix "{self.prefix}" exists; use --flush or another --prefix')
+
+        with transaction.atomic():
+            departments = self.create_departments()
+            admin, users = self.create_users(departments)
+            categories = self.create_categories(admin)
+            topics = self.create_topics(categories, [admin] + users)
+            restrictions = self.create_restrictions(admin, users, categories, topics)
+        bump_global_permission_version()  # bulk inserts send no signals
+
+        # Messages go through the bulk ingest path, which also writes the
+        # mentions and search index and recounts the topics
+        result = ingest_messages(self.message_lines(topics, [admin] + users), self.batch_size)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(departments)} departments, {len(users) + 1} users '
+            f'(admin: {admin.username}), {len(categories)} categories, {len(topics)} topics, '
+            f'{restrictions} restrictions, {result.imported} messages'
+        ))
+
+    def flush(self):
+        prefix = f'{self.prefix}_'
+        # Categories take their topics, messages and restrictions with them
+        Category.objects.filter(name__startswith=prefix).delete()
+        CustomUser.objects.filter(username__startswith=prefix).delete()
+        Department.objects.filter(name__startswith=prefix).delete()
+        get_search_backend().rebuild()
+        bump_global_permission_version()
+
+    def bulk(self, model, rows):
+        return model.objects.bulk_create(rows, batch_size=self.batch_size)
+
+    def sentence(self, low, high):
+        return ' '.join(self.random.choices(WORDS, k=self.random.randint(low, high)))
+
+    def create_departments(self):
+        return self.bulk(Department, [
+            Department(name=f'{self.prefix}_department_{n}') for n in range(self.options['departments'])
+        ])
+
+    def create_users(self, departments):
+        # One hash for everyone: hashing per user would dominate the run
+        password = make_password(self.options['password'])
+        admin = CustomUser.objects.create(
+            username=f'{self.prefix}_admin', password=password, role='admin',
+            is_staff=True, is_approved=True,
+        )
+        users = self.bulk(CustomUser, [
+            CustomUser(
+                username=f'{self.prefix}_user_{n}', password=password, is_approved=True,
+                first_name='Perf', last_name=f'User {n}', department=self.random.choice(departments),
+            )
+            for n in range(self.options['users'])
+        ])
+        return admin, users
+
+    def create_categories(self, admin):
+        return self.bulk(Category, [
+            Category(name=f'{self.prefix}_category_{n}', description=self.sentence(3, 8), created_by=admin)
+            for n in range(self.options['categories'])
+        ])
+
+    def create_topics(self, categories, authors):
+        topics = self.bulk(Topic, [
+            Topic(
+                title=f'{self.prefix} {self.sentence(2, 5)} {n}', description=self.sentence(5, 15),
+                category=self.random.choice(categories), created_by=self.random.choice(authors),
+            )
+            for n in range(self.options['topics'])
+        ])
+        get_search_backend().index_topics(topics, new=True)
+        return topics
+
+    def create_restrictions(self, admin, users, categories, topics):
+        rate = self.options['restriction_rate']
+        if rate <= 0:
+            return 0
+        created = 0
+        for model, field, targets in (
+            (CategoryRestriction, 'category', categories),
+            (TopicRestriction, 'topic', topics),
+        ):
+            pairs = {
+                (self.random.choice(users).pk, self.random.choice(targets).pk)
+                for _ in range(int(len(users) * len(targets) * rate))
+            }
+            created += len(self.bulk(model, [
+                model(
+                    user_id=user_id, created_by=admin,
+                    can_view=self.random.random() > 0.3, can_reply=self.random.random() > 0.5,
+                    **{f'{field}_id': target_id},
+                )
+                for user_id, target_id in pairs
+            ]))
+        return created
+
+    def message_lines(self, topics, users):
+        """NDJSON records for conversations.ingest, oldest first"""
+        count = self.options['messages']
+        start = timezone.now() - timedelta(days=self.options['days'])
+        step = timedelta(days=self.options['days']) / max(count, 1)
+        # A few topics get most of the traffic, as in real chats
+        cum_weights = list(accumulate(1 / (rank + 1) for rank in range(len(topics))))
+        for n in range(count):
+            tagged = []
+            if self.random.random() < self.options['tag_rate']:
+                tagged = [user.pk for user in self.random.sample(users, min(3, len(users)))]
+            yield json.dumps({
+                'topic': self.random.choices(topics, cum_weights=cum_weights)[0].pk,
+                'sender': self.random.choice(users).pk,
+                'content': self.sentence(4, 30),
+                'created_at': (start + step * n).isoformat(),
+                'tagged_users_ids': tagged,
+            })
@@ -0,0 +1,236 @@
+"""
+Request metrics shared by every worker process, in Prometheus text format.
+
+Each process appends its samples to its own memory-mapped file in
+PERF_METRICS_DIR (metrics-<pid>.db), so recording is a dict lookup and an
+8-byte write under a process-local lock: no IPC, no cross-process locking.
+The /metrics view (perf.views.metrics) reads every file in the directory
+and sums them.  Files of exited workers stay and keep contributing their
+counts, which is what cumulative counters need; empty the directory when
+deploying if a fresh start is preferred.
+
+File layout: an 8-byte header holding the number of bytes in use, then
+entries of [4-byte key length][JSON key, padded to 8 bytes][8-byte double].
+The used size is only advanced after an entry is complete, so readers in
+other processes never see a partial entry.
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+INITIAL_FILE_SIZE = 64 * 1024
+_HEADER = struct.Struct('Q')
+_KEY_LENGTH = struct.Struct('I')
+_VALUE = struct.Struct('d')
+
+
+def metrics_dir():
+    path = getattr(settings, 'PERF_METRICS_DIR', None)
+    return Path(path or Path(settings.BASE_DIR) / 'var' / 'metrics')
+
+
+def _entries(data, used):
+    """(key, value offset) of every entry in a file's bytes"""
+    offset = _HEADER.size
+    while offset < used:
+        length, = _KEY_LENGTH.unpack_from(data, offset)
+        key = bytes(data[offset + _KEY_LENGTH.size:offset + _KEY_LENGTH.size + length]).decode()
+        offset += _KEY_LENGTH.size + length
+        offset += -offset % 8
+        yield key, offset
+        offset += _VALUE.size
+
+
+class MmapStore:
+    """The current process's metrics file"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def _open(self):
+        self.directory = metrics_dir()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.pid = os.getpid()
+        path = self.directory / f'metrics-{self.pid}.db'
+        self.file = open(path, 'a+b')
+        if os.fstat(self.file.fileno()).st_size < INITIAL_FILE_SIZE:
+            self.file.truncate(INITIAL_FILE_SIZE)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.used, = _HEADER.unpack_from(self.map, 0)
+        if self.used == 0:
+            self.used = _HEADER.size
+            _HEADER.pack_into(self.map, 0, self.used)
+        # A recycled pid picks up where the previous process stopped
+        self.offsets = dict(_entries(self.map, self.used))
+
+    def _append(self, key):
+        encoded = key.encode()
+        value_offset = self.used + _KEY_LENGTH.size + len(encoded)
+        value_offset += -value_offset % 8
+        end = value_offset + _VALUE.size
+        if end > len(self.map):
+            size = max(len(self.map) * 2, end)
+            self.map.close()
+            self.file.truncate(size)
+            self.map = mmap.mmap(self.file.fileno(), 0)
+        _KEY_LENGTH.pack_into(self.map, self.used, len(encoded))
+        self.map[self.used + _KEY_LENGTH.size:self.used + _KEY_LENGTH.size + len(encoded)] = encoded
+        _VALUE.pack_into(self.map, value_offset, 0.0)
+        self.used = end
+        _HEADER.pack_into(self.map, 0, self.used)
+        self.offsets[key] = value_offset
+        return value_offset
+
+    def close(self):
+        with self.lock:
+            if self.pid is not None:
+                self.map.close()
+                self.file.close()
+                self.pid = None
+
+    def add(self, key, amount):
+        with self.lock:
+            # A forked worker must not write into its parent's file
+            if self.pid != os.getpid():
+                self._open()
+            offset = self.offsets.get(key)
+            if offset is None:
+                offset = self._append(key)
+            value, = _VALUE.unpack_from(self.map, offset)
+            _VALUE.pack_into(self.map, offset, value + amount)
+
+
+def read_all(directory):
+    """{key: value} summed over the metrics files of every process"""
+    totals = defaultdict(float)
+    for path in Path(directory).glob('metrics-*.db'):
+        try:
+            data = path.read_bytes()
+        except OSError:
+            continue  # removed meanwhile
+        if len(data) < _HEADER.size:
+            continue
+        used, = _HEADER.unpack_from(data, 0)
+        for key, offset in _entries(data, min(used, len(data))):
+            totals[key] += _VALUE.unpack_from(data, offset)[0]
+    return totals
+
+
+_store = MmapStore()  # opened on first write, in each process
+REGISTRY = {}
+
+
+@receiver(setting_changed)
+def reopen_store(setting, **kwargs):
+    # Tests point PERF_METRICS_DIR at a temporary directory
+    if setting == 'PERF_METRICS_DIR':
+        _store.close()
+
+
+def _key(sample, labels):
+    return json.dumps([sample, labels], separators=(',', ':'))
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY[name] = self
+
+    def _labels(self, labels):
+        return [[name, str(labels[name])] for name in self.labelnames]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        _store.add(_key(self.name, self._labels(labels)), amount)
+
+
+class Histogram(Metric):
+    """Fixed buckets; each observation touches one bucket, the sum and the count"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames, buckets):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        labels = self._labels(labels)
+        bucket = next((bound for bound in self.buckets if value <= bound), '+Inf')
+        _store.add(_key(f'{self.name}_bucket', labels + [['le', str(bucket)]]), 1)
+        _store.add(_key(f'{self.name}_sum', labels), value)
+        _store.add(_key(f'{self.name}_count', labels), 1)
+
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format(sample, labels, value):
+    if labels:
+        sample += '{' + ','.join(f'{name}="{_escape(val)}"' for name, val in labels) + '}'
+    return f'{sample} {value:g}' if value != int(value) else f'{sample} {int(value)}'
+
+
+def render(directory=None):
+    """Every registered metric, summed across processes, in Prometheus text format"""
+    samples = defaultdict(list)
+    for key, value in read_all(directory or metrics_dir()).items():
+        sample, labels = json.loads(key)
+        samples[sample].append((labels, value))
+
+    lines = []
+    for name, metric in sorted(REGISTRY.items()):
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        if metric.kind == 'counter':
+            for labels, value in sorted(samples[name]):
+                lines.append(_format(name, labels, value))
+            continue
+
+        # Buckets are stored per bucket; Prometheus wants them cumulative
+        series = defaultdict(dict)
+        for labels, value in samples[f'{name}_bucket']:
+            *labels, (_, bound) = labels
+            series[json.dumps(labels)][bound] = value
+        for labels in sorted(series):
+            counts, running = series[labels], 0
+            labels = json.loads(labels)
+            for bound in [str(bound) for bound in metric.buckets] + ['+Inf']:
+                running += counts.get(bound, 0)
+                lines.append(_format(f'{name}_bucket', labels + [['le', bound]], running))
+        for suffix in ('_sum', '_count'):
+            for labels, value in sorted(samples[name + suffix]):
+                lines.append(_format(name + suffix, labels, value))
+    return '\n'.join(lines) + '\n'
+
+
+REQUESTS = Counter(
+    'http_requests_total', 'HTTP requests by view, action, route, method and status',
+    ['view', 'action', 'route', 'method', 'status'],
+)
+LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time spent answering HTTP requests',
+    ['view', 'action', 'route', 'method'],
+    [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10],
+)
+QUERIES = Histogram(
+    'http_request_db_queries', 'Database queries run per HTTP request',
+    ['view', 'action', 'route', 'method'],
+    [0, 1, 2, 3, 5, 10, 20, 50, 100, 200],
+)
@@ -0,0 +1,229 @@
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.exceptions import AuthenticationFailed
+
+from users.authentication import CachedTokenAuthentication
+
+from .instrumentation import QueryRecorder
+from .metrics import LATENCY, QUERIES, REQUESTS
+from .profiling import Capture, requested_mode, save_profile
+
+
+class SQLInstrumentationMiddleware:
+    """
+    Reports the SQL cost of each request in its response headers:
+
+        Server-Timing: db;dur=12.4;desc="23 queries"
+        X-DB-Queries: 23
+        X-DB-Time-Ms: 12.4
+        X-DB-Duplicate-Queries: 18
+
+    X-DB-Duplicate-Queries counts executions of a query already run in the
+    same request, a sign of an N+1.  Slow queries are also logged (see
+    perf.instrumentation).  Opt-in with PERF_SQL_INSTRUMENTATION = True;
+    otherwise Django drops the middleware at startup.  Queries run while a
+    streaming response is consumed are not counted.  Under ASGI the recorder
+    is installed in the request's sync thread, as in MetricsMiddleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PERF_SQL_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        recorder = QueryRecorder()
+        with recorder.installed():
+            response = self.get_response(request)
+        return self.report(recorder, response)
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        stack = ExitStack()
+        await sync_to_async(stack.enter_context)(recorder.installed())
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.report(recorder, response)
+
+    def report(self, recorder, response):
+        duration_ms = recorder.duration * 1000
+        response['Server-Timing'] = f'db;dur={duration_ms:.1f};desc="{recorder.count} queries"'
+        response['X-DB-Queries'] = str(recorder.count)
+        response['X-DB-Time-Ms'] = f'{duration_ms:.1f}'
+        response['X-DB-Duplicate-Queries'] = str(recorder.duplicate_count)
+        return response
+
+
+class ProfilerMiddleware:
+    """
+    Profiles the requests of admins that ask for it (see perf.profiling).
+    Must come after AuthenticationMiddleware.
+
+    The admin is identified before anything is profiled: the session user,
+    or else the owner of the request's API token.  Requests from anyone else
+    run unprofiled.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        mode = requested_mode(request)
+        user = admin_user(request) if mode else None
+        if user is None:
+            return self.get_response(request)
+
+        capture = Capture(mode)
+        start = time.perf_counter()
+        capture.attach()
+        try:
+            response = self.get_response(request)
+        finally:
+            capture.detach()
+        duration = time.perf_counter() - start
+        response['X-Profile-Id'] = str(save_profile(request, user, response, capture, duration).pk)
+        return response
+
+    async def __acall__(self, request):
+        mode = requested_mode(request)
+        user = await sync_to_async(admin_user)(request) if mode else None
+        if user is None:
+            return await self.get_response(request)
+
+        # The event loop and the request's sync thread
+        capture = Capture(mode)
+        start = time.perf_counter()
+        await sync_to_async(capture.attach)()
+        capture.attach()
+        try:
+            response = await self.get_response(request)
+        finally:
+            capture.detach()
+            await sync_to_async(capture.detach)()
+        duration = time.perf_counter() - start
+        profile = await sync_to_async(save_profile)(request, user, response, capture, duration)
+        response['X-Profile-Id'] = str(profile.pk)
+        return response
+
+
+def admin_user(request):
+    """The admin making `request`, from its session or its API token; None for anyone else"""
+    user = request.user
+    if not user.is_authenticated:
+        try:
+            # DRF authenticates tokens only in the view; check this one now
+            authenticated = CachedTokenAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            authenticated = None
+        if authenticated is None:
+            return None
+        user = authenticated[0]
+    return user if user.is_admin() else None
+
+
+# Anything else is reported as OTHER, so clients cannot add series at will
+HTTP_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'TRACE', 'CONNECT'}
+
+
+def view_labels(request):
+    """(view, action, route) of the resolved request; DRF viewsets report their action"""
+    match = request.resolver_match
+    if match is None:
+        return '', '', '<unmatched>'
+    view = getattr(match.func, 'cls', None) or getattr(match.func, 'view_class', None)
+    actions = getattr(match.func, 'actions', None) or {}
+    return (
+        view.__name__ if view else match.func.__name__,
+        actions.get(request.method.lower(), ''),
+        match.route,
+    )
+
+
+def _wrap_connections(stack, wrapper):
+    """Install an execute wrapper on every database connection of the current thread"""
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(wrapper))
+
+
+class MetricsMiddleware:
+    """
+    Records request counts, latency and query counts for /metrics (see
+    perf.metrics).  On unless PERF_METRICS is False.
+
+    Works under WSGI and ASGI.  Connections are per thread, so under ASGI the
+    query counter is installed in the request's sync thread, where
+    sync_to_async runs its ORM calls.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PERF_METRICS', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        counter = QueryCounter()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            _wrap_connections(stack, counter)
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, counter.count)
+        return response
+
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        start = time.perf_counter()
+        stack = ExitStack()
+        await sync_to_async(_wrap_connections)(stack, counter)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        self.record(request, response, time.perf_counter() - start, counter.count)
+        return response
+
+    def record(self, request, response, duration, queries):
+        view, action, route = view_labels(request)
+        method = request.method if request.method in HTTP_METHODS else 'OTHER'
+        labels = {'view': view, 'action': action, 'route': route, 'method': method}
+        REQUESTS.inc(status=response.status_code, **labels)
+        LATENCY.observe(duration, **labels)
+        QUERIES.observe(queries, **labels)
+
+
+class QueryCounter:
+    """Execute wrapper counting the queries it sees"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
@@ -0,0 +1,33 @@
+from django.db import models
+
+from users.models import CustomUser
+
+
+class RequestProfile(models.Model):
+    """One profiled request, captured on an admin's demand (see perf.profiling)"""
+
+    MODES = [
+        ('sample', 'Sampling'),
+        ('cprofile', 'cProfile'),
+    ]
+
+    user = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, related_name='request_profiles')
+    mode = models.CharField(max_length=10, choices=MODES)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    samples = models.PositiveIntegerField(default=0)
+    # Folded stacks ("outer;inner;leaf count" per line), for flamegraph.pl/speedscope
+    collapsed = models.TextField(blank=True)
+    # Top functions by cumulative time (cProfile only)
+    summary = models.TextField(blank=True)
+    # marshal-ed pstats data (cProfile only), for snakeviz and friends
+    stats = models.BinaryField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.get_mode_display()}, {self.duration_ms:.0f} ms)"
@@ -0,0 +1,142 @@
+"""
+On-demand profiling of single requests, for admins.
+
+A request is profiled when it carries `X-Profile: sample|cprofile` or
+`?_profile=sample|cprofile` (`?_profile=1` means sample), and the user is
+an admin (CustomUser.is_admin()).  The result is saved as a RequestProfile
+and its id returned in the `X-Profile-Id` response header; browse and
+download profiles from the Django admin.
+
+* sample: a background thread records the request thread's stack every
+  PERF_PROFILE_SAMPLE_INTERVAL seconds.  Low overhead; the folded stacks
+  feed flamegraph.pl or speedscope directly.
+* cprofile: deterministic cProfile capture, with exact call counts but
+  more overhead, stored as pstats data and a text summary.
+
+Under ASGI a request runs in two threads, the event loop and its sync
+thread, and both are profiled.  Anything else running on the event loop
+at the same time shows up as well.
+
+Requests without the flag only pay for the flag lookup.
+"""
+import cProfile
+import io
+import marshal
+import pstats
+import sys
+import threading
+from collections import Counter
+
+from django.conf import settings
+
+from .models import RequestProfile
+
+
+MODES = {'sample', 'cprofile'}
+KEEP_PROFILES = 200
+
+
+def requested_mode(request):
+    """The profiling mode asked for by `request`, or None"""
+    mode = request.headers.get('X-Profile') or request.GET.get('_profile')
+    if not mode:
+        return None
+    mode = mode.lower()
+    if mode in ('1', 'true'):
+        return 'sample'
+    return mode if mode in MODES else None
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})'
+
+
+class StackSampler:
+    """Samples the stacks of some threads from a daemon thread"""
+
+    def __init__(self, interval=None):
+        self.thread_ids = []
+        self.interval = interval or getattr(settings, 'PERF_PROFILE_SAMPLE_INTERVAL', 0.001)
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='perf-stack-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in tuple(self.thread_ids):
+                frame = frames.get(thread_id)
+                names = []
+                while frame is not None:
+                    names.append(_frame_name(frame))
+                    frame = frame.f_back
+                if names:
+                    self.stacks[';'.join(reversed(names))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    @property
+    def samples(self):
+        return sum(self.stacks.values())
+
+    def collapsed(self):
+        return '\n'.join(f'{stack} {count}' for stack, count in self.stacks.most_common())
+
+
+class Capture:
+    """
+    Profiles the threads attached to it.  Each thread calls attach() to
+    start being profiled and detach() to stop.
+    """
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.sampler = StackSampler() if mode == 'sample' else None
+        self.profilers = {}
+
+    def attach(self):
+        if self.sampler:
+            self.sampler.thread_ids.append(threading.get_ident())
+            if len(self.sampler.thread_ids) == 1:
+                self.sampler.start()
+        else:
+            profiler = self.profilers[threading.get_ident()] = cProfile.Profile()
+            profiler.enable()
+
+    def detach(self):
+        if self.sampler:
+            self.sampler.thread_ids.remove(threading.get_ident())
+            if not self.sampler.thread_ids:
+                self.sampler.stop()
+        else:
+            self.profilers[threading.get_ident()].disable()
+
+    def results(self):
+        """Field values of the RequestProfile"""
+        if self.sampler:
+            return {'samples': self.sampler.samples, 'collapsed': self.sampler.collapsed()}
+
+        for profiler in self.profilers.values():
+            profiler.create_stats()
+        summary = io.StringIO()
+        stats = pstats.Stats(*self.profilers.values(), stream=summary)
+        stats.sort_stats('cumulative').print_stats(60)
+        return {'summary': summary.getvalue(), 'stats': marshal.dumps(stats.stats)}
+
+
+def save_profile(request, user, response, capture, duration):
+    profile = RequestProfile.objects.create(
+        user=user, mode=capture.mode, method=request.method,
+        path=request.get_full_path()[:500], status_code=response.status_code,
+        duration_ms=duration * 1000, **capture.results()
+    )
+    # Only the most recent profiles are kept
+    stale = RequestProfile.objects.order_by('-created_at', '-id').values_list('id', flat=True)[KEEP_PROFILES:]
+    RequestProfile.objects.filter(id__in=list(stale)).delete()
+    return profile
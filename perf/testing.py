@@ -0,0 +1,69 @@
+"""
+Query budgets for tests, and the project's test runner.
+
+    class TopicApiTests(QueryBudgetMixin, TestCase):
+        def test_list(self):
+            self.assertEndpointBudget('/api/topics/topics/', queries=3, duplicates=0)
+
+Unlike assertNumQueries, a budget is an upper bound, and it can also cap
+the repeated queries that give away an N+1.  On failure the message lists
+the offending queries by fingerprint.
+"""
+import tempfile
+from contextlib import contextmanager
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from .instrumentation import QueryRecorder
+
+
+def _describe(recorder):
+    lines = [f'{count}x {sql}' for sql, count in recorder.fingerprints.most_common()]
+    return '\n'.join(lines)
+
+
+@contextmanager
+def query_budget(queries, duplicates=None):
+    """Fail with AssertionError if the block runs more than `queries` queries or `duplicates` repeats"""
+    recorder = QueryRecorder(slow_query_ms=float('inf'))
+    with recorder.installed():
+        yield recorder
+    if recorder.count > queries:
+        raise AssertionError(
+            f'{recorder.count} queries run, budget is {queries}:\n{_describe(recorder)}'
+        )
+    if duplicates is not None and recorder.duplicate_count > duplicates:
+        raise AssertionError(
+            f'{recorder.duplicate_count} repeated queries, budget is {duplicates}:\n{_describe(recorder)}'
+        )
+
+
+class QueryBudgetMixin:
+    """TestCase helpers around query_budget()"""
+
+    def assertQueryBudget(self, queries, duplicates=None):
+        return query_budget(queries, duplicates)
+
+    def assertEndpointBudget(self, url, queries, duplicates=None, status=200, client=None):
+        """GET `url` within the budget and check the status; returns the response"""
+        client = client or self.client
+        with query_budget(queries, duplicates):
+            response = client.get(url)
+        self.assertEqual(response.status_code, status)
+        return response
+
+
+class TestRunner(DiscoverRunner):
+    """Records the request metrics of test runs in a temporary PERF_METRICS_DIR"""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.metrics_dir = tempfile.TemporaryDirectory(prefix='comm_app_metrics-')
+        self.metrics_override = override_settings(PERF_METRICS_DIR=self.metrics_dir.name)
+        self.metrics_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.metrics_override.disable()
+        self.metrics_dir.cleanup()
+        super().teardown_test_environment(**kwargs)
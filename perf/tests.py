@@ -0,0 +1,172 @@
+import tempfile
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from topics.models import Category, Topic
+from users.models import CustomUser
+from .instrumentation import fingerprint
+from .models import RequestProfile
+from .testing import QueryBudgetMixin
+
+
+class FingerprintTests(TestCase):
+
+    def test_literals_and_in_lists_are_collapsed(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE a = 12 AND b = 'x''y' AND c IN (%s, %s, %s)"),
+            'SELECT * FROM t WHERE a = ? AND b = ? AND c IN (...)',
+        )
+
+
+class SQLInstrumentationTests(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='member')
+        category = Category.objects.create(name='General', created_by=cls.user)
+        for n in range(3):
+            Topic.objects.create(title=f'Topic {n}', category=category, created_by=cls.user)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_topic_list_budget(self):
+        self.assertEndpointBudget('/api/topics/topics/', queries=3, duplicates=0)
+
+    def test_budget_overrun_fails(self):
+        with self.assertRaisesMessage(AssertionError, 'budget is 1'):
+            with self.assertQueryBudget(1):
+                list(Topic.objects.all())
+                list(Topic.objects.all())
+
+    @override_settings(PERF_SQL_INSTRUMENTATION=True)
+    def test_headers(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/topics/topics/')
+        self.assertEqual(response['X-DB-Queries'], str(int(response['X-DB-Queries'])))
+        self.assertGreater(int(response['X-DB-Queries']), 0)
+        self.assertTrue(response['Server-Timing'].startswith('db;dur='))
+        self.assertEqual(response['X-DB-Duplicate-Queries'], '0')
+
+    @override_settings(PERF_SQL_INSTRUMENTATION=True)
+    async def test_async_headers(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.get('/api/conversations/async/messages/', {'topic': 0})
+        self.assertEqual(response.status_code, 404)
+        self.assertGreater(int(response['X-DB-Queries']), 0)
+
+    def test_off_by_default(self):
+        self.assertNotIn('X-DB-Queries', self.client.get('/api/topics/topics/'))
+
+
+class ProfilerTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create(username='admin', role='admin', is_staff=True, is_superuser=True)
+        cls.user = CustomUser.objects.create(username='member')
+
+    def setUp(self):
+        cache.clear()  # user records cached under ids other tests reused
+
+    def test_admin_sampling_profile(self):
+        self.client.force_login(self.admin)
+        response = self.client.get('/api/topics/topics/?_profile=1')
+        self.assertEqual(response.status_code, 200)
+        profile = RequestProfile.objects.get(pk=response['X-Profile-Id'])
+        self.assertEqual((profile.mode, profile.user, profile.status_code), ('sample', self.admin, 200))
+
+        download = self.client.get(f'/admin/perf/requestprofile/{profile.pk}/download/')
+        self.assertEqual(download.status_code, 200)
+        self.assertIn('profile-', download['Content-Disposition'])
+
+    def test_admin_cprofile(self):
+        self.client.force_login(self.admin)
+        response = self.client.get('/api/topics/topics/', HTTP_X_PROFILE='cprofile')
+        profile = RequestProfile.objects.get(pk=response['X-Profile-Id'])
+        self.assertIn('cumulative', profile.summary)
+        self.assertTrue(profile.stats)
+
+    def test_regular_users_are_not_profiled(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/api/topics/topics/?_profile=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+
+    def test_token_admins_are_profiled(self):
+        token = Token.objects.create(user=self.admin)
+        response = self.client.get('/api/topics/topics/?_profile=1', HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(RequestProfile.objects.get(pk=response['X-Profile-Id']).user, self.admin)
+
+    def test_unknown_tokens_are_not_profiled(self):
+        with mock.patch('perf.middleware.Capture') as capture:
+            self.client.get('/api/topics/topics/?_profile=1', HTTP_AUTHORIZATION='Token bogus')
+        capture.assert_not_called()
+        self.assertFalse(RequestProfile.objects.exists())
+
+    async def test_async_requests(self):
+        await sync_to_async(self.async_client.force_login)(self.admin)
+        response = await self.async_client.get('/api/conversations/async/messages/?topic=1&_profile=cprofile')
+        self.assertEqual(response.status_code, 404)
+        profile = await RequestProfile.objects.aget(pk=response['X-Profile-Id'])
+        # The view ran on the event loop, its queries in the sync thread
+        self.assertIn('messages', profile.summary)
+        self.assertIn('execute', profile.summary)
+
+
+class MetricsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create(username='admin', role='admin')
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(PERF_METRICS_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_requests_are_recorded_per_action(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        self.assertEqual(client.get('/api/topics/topics/').status_code, 200)
+
+        response = self.client.get('/metrics', REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertRegex(
+            body, r'http_requests_total\{view="TopicViewSet",action="list",route="[^"]+",method="GET",status="200"\} \d+'
+        )
+        self.assertIn('le="+Inf"', body)
+
+    def test_unknown_methods_share_a_series(self):
+        for method in ('BREW', 'PROPFIND'):
+            self.client.generic(method, '/api/topics/topics/')
+        body = self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').content.decode()
+        self.assertIn('method="OTHER",status="403"} 2', body)
+        self.assertNotIn('BREW', body)
+
+    async def test_async_requests(self):
+        # Through the ASGI handler, so the middleware runs as a coroutine
+        await sync_to_async(self.async_client.force_login)(self.admin)
+        response = await self.async_client.get('/api/conversations/async/messages/', {'topic': 1})
+        self.assertEqual(response.status_code, 404)
+        body = (await self.async_client.get('/metrics', REMOTE_ADDR='127.0.0.1')).content.decode()
+        self.assertRegex(body, r'http_requests_total\{view="messages",action="",route="[^"]+",method="GET",status="404"\} 1')
+        # The topic lookup ran in the request's sync thread and was counted
+        self.assertRegex(body, r'http_request_db_queries_sum\{view="messages",[^}]+\} [1-9]')
+
+    def test_scrapes_are_restricted(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.1.2.3').status_code, 403)
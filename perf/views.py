@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from .metrics import render
+
+
+def metrics(request):
+    """Prometheus scrape endpoint, for PERF_METRICS_ALLOWED_IPS and admins"""
+    user = request.user
+    allowed_ips = getattr(settings, 'PERF_METRICS_ALLOWED_IPS', ['127.0.0.1', '::1'])
+    if request.META.get('REMOTE_ADDR') not in allowed_ips and not (
+        user.is_authenticated and user.is_admin()
+    ):
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
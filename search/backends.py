@@ -0,0 +1,288 @@
+"""
+Full-text search backends.
+
+Topics and messages are mirrored into index tables keyed on their primary
+key (created by search/migrations/0001_initial.py):
+
+* SQLite: FTS5 virtual tables, ranked with bm25;
+* PostgreSQL: tsvector documents with GIN indexes, ranked with ts_rank_cd.
+
+A search takes an already permission-filtered queryset and narrows it with
+`pk IN (<index lookup>)`, so visibility rules, the index lookup and the
+ranking run as one query that paginates like any other queryset.  Only the
+rows matching the terms are ever ranked, which keeps searches independent of
+the number of messages stored.
+
+BasicSearchBackend is the icontains fallback for any other database.
+"""
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+
+# Search input is reduced to word terms, so it can never be read as query syntax
+TERM_RE = re.compile(r'\w+')
+MAX_TERMS = 16
+
+
+def search_terms(query):
+    return TERM_RE.findall(query or '')[:MAX_TERMS]
+
+
+def _models():
+    from conversations.models import Message
+    from topics.models import Topic
+    return Topic, Message
+
+
+class SearchBackend:
+    """
+    Interface shared by the backends.  Searches annotate `search_rank` and
+    order by relevance; the index_*/remove_* hooks keep the index in sync.
+    """
+
+    def search_topics(self, queryset, query):
+        raise NotImplementedError
+
+    def search_messages(self, queryset, query):
+        raise NotImplementedError
+
+    def index_topics(self, topics, new=False):
+        """(Re)index topics; `new` promises they are not in the index yet"""
+        pass
+
+    def index_messages(self, messages, new=False):
+        pass
+
+    def remove_topics(self, pks):
+        pass
+
+    def remove_messages(self, pks):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class BasicSearchBackend(SearchBackend):
+    """Substring matching without an index, newest first"""
+
+    def _search(self, queryset, query, fields):
+        terms = search_terms(query)
+        if not terms:
+            return queryset.none()
+        for term in terms:
+            match = Q()
+            for field in fields:
+                match |= Q(**{f'{field}__icontains': term})
+            queryset = queryset.filter(match)
+        return queryset.annotate(
+            search_rank=Value(0.0, output_field=FloatField())
+        ).order_by('-pk')
+
+    def search_topics(self, queryset, query):
+        return self._search(queryset, query, ['title', 'description'])
+
+    def search_messages(self, queryset, query):
+        return self._search(queryset, query, ['content'])
+
+
+class IndexedSearchBackend(SearchBackend):
+    """Common plumbing of the backends that keep a per-row index table"""
+    topic_table = None
+    message_table = None
+    rank_ordering = None
+
+    def match_sql(self, table):
+        """SQL selecting the matching primary keys; takes the query parameters"""
+        raise NotImplementedError
+
+    def rank_sql(self, table, pk_column):
+        """Correlated SQL returning the rank of the row `pk_column`"""
+        raise NotImplementedError
+
+    def query_params(self, terms):
+        raise NotImplementedError
+
+    def _search(self, queryset, query, table):
+        terms = search_terms(query)
+        if not terms:
+            return queryset.none()
+        params = self.query_params(terms)
+        model = queryset.model
+        pk_column = '{}.{}'.format(
+            connection.ops.quote_name(model._meta.db_table),
+            connection.ops.quote_name(model._meta.pk.column),
+        )
+        return queryset.filter(
+            pk__in=RawSQL(self.match_sql(table), params)
+        ).annotate(
+            search_rank=RawSQL(self.rank_sql(table, pk_column), params, output_field=FloatField())
+        ).order_by(self.rank_ordering, '-pk')
+
+    def search_topics(self, queryset, query):
+        return self._search(queryset, query, self.topic_table)
+
+    def search_messages(self, queryset, query):
+        return self._search(queryset, query, self.message_table)
+
+    def _write(self, sql, rows):
+        if rows:
+            with connection.cursor() as cursor:
+                cursor.executemany(sql, rows)
+
+
+class SQLiteSearchBackend(IndexedSearchBackend):
+    topic_table = 'search_topic_fts'
+    message_table = 'search_message_fts'
+    # bm25() is negative, more relevant rows are smaller
+    rank_ordering = 'search_rank'
+
+    def query_params(self, terms):
+        # Quoted terms, implicitly ANDed; the last one matches as a prefix so
+        # results follow the user's typing
+        return [' '.join(f'"{term}"' for term in terms) + '*']
+
+    def match_sql(self, table):
+        return f'SELECT rowid FROM {table} WHERE {table} MATCH %s'
+
+    def rank_sql(self, table, pk_column):
+        # Titles weigh more than descriptions; messages have one column
+        weights = ', 10.0, 1.0' if table == self.topic_table else ''
+        return (
+            f'SELECT bm25({table}{weights}) FROM {table} '
+            f'WHERE {table} MATCH %s AND rowid = {pk_column}'
+        )
+
+    def index_topics(self, topics, new=False):
+        topics = list(topics)
+        if not new:
+            self.remove_topics([topic.pk for topic in topics])
+        self._write(
+            f'INSERT INTO {self.topic_table} (rowid, title, description) VALUES (%s, %s, %s)',
+            [(topic.pk, topic.title, topic.description or '') for topic in topics],
+        )
+
+    def index_messages(self, messages, new=False):
+        messages = list(messages)
+        if not new:
+            self.remove_messages([message.pk for message in messages])
+        self._write(
+            f'INSERT INTO {self.message_table} (rowid, content) VALUES (%s, %s)',
+            [(message.pk, message.content) for message in messages],
+        )
+
+    def remove_topics(self, pks):
+        self._write(f'DELETE FROM {self.topic_table} WHERE rowid = %s', [(pk,) for pk in pks])
+
+    def remove_messages(self, pks):
+        self._write(f'DELETE FROM {self.message_table} WHERE rowid = %s', [(pk,) for pk in pks])
+
+    def rebuild(self):
+        Topic, Message = _models()
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.topic_table}')
+            cursor.execute(
+                f"INSERT INTO {self.topic_table} (rowid, title, description) "
+                f"SELECT id, title, COALESCE(description, '') FROM {Topic._meta.db_table}"
+            )
+            cursor.execute(f'DELETE FROM {self.message_table}')
+            cursor.execute(
+                f'INSERT INTO {self.message_table} (rowid, content) '
+                f'SELECT id, content FROM {Message._meta.db_table}'
+            )
+            cursor.execute(f"INSERT INTO {self.topic_table} ({self.topic_table}) VALUES ('optimize')")
+            cursor.execute(f"INSERT INTO {self.message_table} ({self.message_table}) VALUES ('optimize')")
+
+
+class PostgresSearchBackend(IndexedSearchBackend):
+    topic_table = 'search_topic_document'
+    message_table = 'search_message_document'
+    rank_ordering = '-search_rank'
+
+    @property
+    def config(self):
+        return getattr(settings, 'SEARCH_CONFIG', 'english')
+
+    def query_params(self, terms):
+        return [self.config, ' & '.join(terms) + ':*']
+
+    def match_sql(self, table):
+        return f'SELECT object_id FROM {table} WHERE document @@ to_tsquery(%s::regconfig, %s)'
+
+    def rank_sql(self, table, pk_column):
+        return (
+            f'SELECT ts_rank_cd(document, to_tsquery(%s::regconfig, %s)) '
+            f'FROM {table} WHERE object_id = {pk_column}'
+        )
+
+    def _upsert_sql(self, table, document):
+        return (
+            f'INSERT INTO {table} (object_id, document) VALUES (%s, {document}) '
+            f'ON CONFLICT (object_id) DO UPDATE SET document = EXCLUDED.document'
+        )
+
+    def index_topics(self, topics, new=False):
+        self._write(
+            self._upsert_sql(
+                self.topic_table,
+                "setweight(to_tsvector(%s::regconfig, %s), 'A') || "
+                "setweight(to_tsvector(%s::regconfig, %s), 'B')",
+            ),
+            [
+                (topic.pk, self.config, topic.title, self.config, topic.description or '')
+                for topic in topics
+            ],
+        )
+
+    def index_messages(self, messages, new=False):
+        self._write(
+            self._upsert_sql(self.message_table, 'to_tsvector(%s::regconfig, %s)'),
+            [(message.pk, self.config, message.content) for message in messages],
+        )
+
+    def remove_topics(self, pks):
+        self._write(f'DELETE FROM {self.topic_table} WHERE object_id = %s', [(pk,) for pk in pks])
+
+    def remove_messages(self, pks):
+        self._write(f'DELETE FROM {self.message_table} WHERE object_id = %s', [(pk,) for pk in pks])
+
+    def rebuild(self):
+        Topic, Message = _models()
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {self.topic_table}, {self.message_table}')
+            cursor.execute(
+                f"INSERT INTO {self.topic_table} (object_id, document) "
+                f"SELECT id, setweight(to_tsvector(%s::regconfig, title), 'A') || "
+                f"setweight(to_tsvector(%s::regconfig, COALESCE(description, '')), 'B') "
+                f"FROM {Topic._meta.db_table}",
+                [self.config, self.config],
+            )
+            cursor.execute(
+                f'INSERT INTO {self.message_table} (object_id, document) '
+                f'SELECT id, to_tsvector(%s::regconfig, content) FROM {Message._meta.db_table}',
+                [self.config],
+            )
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    """
+    The backend named by settings.SEARCH_BACKEND (a dotted path), or the one
+    matching the default database.
+    """
+    path = getattr(settings, 'SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    return BACKENDS.get(connection.vendor, BasicSearchBackend)()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from search.backends import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of topics and messages'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt the search index ({type(backend).__name__})'
+        ))
@@ -0,0 +1,63 @@
+from django.db import migrations
+
+
+# Index tables per database vendor, see search/backends.py.  Other databases
+# use BasicSearchBackend and get no tables.
+INSTALL_SQL = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE search_topic_fts USING fts5("
+        "title, description, tokenize = 'porter unicode61')",
+        "CREATE VIRTUAL TABLE search_message_fts USING fts5("
+        "content, tokenize = 'porter unicode61')",
+        "INSERT INTO search_topic_fts (rowid, title, description) "
+        "SELECT id, title, COALESCE(description, '') FROM topics_topic",
+        "INSERT INTO search_message_fts (rowid, content) "
+        "SELECT id, content FROM conversations_message",
+    ],
+    'postgresql': [
+        "CREATE TABLE search_topic_document ("
+        "object_id bigint PRIMARY KEY, document tsvector NOT NULL)",
+        "CREATE INDEX search_topic_document_gin ON search_topic_document USING GIN (document)",
+        "CREATE TABLE search_message_document ("
+        "object_id bigint PRIMARY KEY, document tsvector NOT NULL)",
+        "CREATE INDEX search_message_document_gin ON search_message_document USING GIN (document)",
+        "INSERT INTO search_topic_document (object_id, document) "
+        "SELECT id, setweight(to_tsvector('english', title), 'A') || "
+        "setweight(to_tsvector('english', COALESCE(description, '')), 'B') FROM topics_topic",
+        "INSERT INTO search_message_document (object_id, document) "
+        "SELECT id, to_tsvector('english', content) FROM conversations_message",
+    ],
+}
+
+UNINSTALL_SQL = {
+    'sqlite': [
+        "DROP TABLE IF EXISTS search_topic_fts",
+        "DROP TABLE IF EXISTS search_message_fts",
+    ],
+    'postgresql': [
+        "DROP TABLE IF EXISTS search_topic_document",
+        "DROP TABLE IF EXISTS search_message_document",
+    ],
+}
+
+
+def install(apps, schema_editor):
+    for sql in INSTALL_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def uninstall(apps, schema_editor):
+    for sql in UNINSTALL_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0003_message_created_idx'),
+        ('topics', '0002_topic_archived_at_topic_archived_by_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
@@ -0,0 +1,34 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from conversations.models import Message
+from topics.models import Topic
+from .backends import get_search_backend
+
+
+# Topic saves that only touch the counters or status flags leave the index alone
+TOPIC_INDEXED_FIELDS = {'title', 'description'}
+
+
+@receiver(post_save, sender=Topic)
+def index_topic(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not TOPIC_INDEXED_FIELDS & set(update_fields):
+        return
+    get_search_backend().index_topics([instance], new=created)
+
+
+@receiver(post_delete, sender=Topic)
+def remove_topic(sender, instance, **kwargs):
+    get_search_backend().remove_topics([instance.pk])
+
+
+@receiver(post_save, sender=Message)
+def index_message(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and 'content' not in update_fields:
+        return
+    get_search_backend().index_messages([instance], new=created)
+
+
+@receiver(post_delete, sender=Message)
+def remove_message(sender, instance, **kwargs):
+    get_search_backend().remove_messages([instance.pk])
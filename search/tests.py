@@ -0,0 +1,143 @@
+from django.core.cache import cache
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase
+from rest_framework.test import APIClient
+
+from conversations.models import Message
+from topics.models import Category, Topic, TopicRestriction
+from users.models import CustomUser
+from .backends import get_search_backend
+
+
+def topic_titles(query, queryset=None):
+    queryset = Topic.objects.all() if queryset is None else queryset
+    return [topic.title for topic in get_search_backend().search_topics(queryset, query)]
+
+
+def message_contents(query):
+    return [message.content for message in get_search_backend().search_messages(Message.objects.all(), query)]
+
+
+class SearchIndexTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='member')
+        cls.category = Category.objects.create(name='General', created_by=cls.user)
+
+    def topic(self, title, description=''):
+        return Topic.objects.create(
+            title=title, description=description, category=self.category, created_by=self.user
+        )
+
+    def test_sync_on_save_and_delete(self):
+        topic = self.topic('Release planning')
+        message = Message.objects.create(topic=topic, sender=self.user, content='ship it friday')
+        self.assertEqual(topic_titles('release'), ['Release planning'])
+        self.assertEqual(message_contents('friday'), ['ship it friday'])
+
+        topic.title = 'Roadmap'
+        topic.save()
+        message.content = 'ship it monday'
+        message.save()
+        self.assertEqual(topic_titles('release'), [])
+        self.assertEqual(topic_titles('roadmap'), ['Roadmap'])
+        self.assertEqual(message_contents('friday'), [])
+        self.assertEqual(message_contents('monday'), ['ship it monday'])
+
+        # Counter and flag saves leave the index alone
+        with self.assertNumQueries(1):
+            topic.save(update_fields=['total_messages'])
+
+        message.delete()
+        topic.delete()
+        self.assertEqual(topic_titles('roadmap'), [])
+        self.assertEqual(message_contents('monday'), [])
+
+    def test_rebuild(self):
+        topic = self.topic('Release planning')
+        get_search_backend().remove_topics([topic.pk])
+        self.assertEqual(topic_titles('release'), [])
+        get_search_backend().rebuild()
+        self.assertEqual(topic_titles('release'), ['Release planning'])
+
+    def test_prefix_and_stemmed_matches(self):
+        self.topic('Database migrations')
+        self.topic('Deploying the app')
+        self.assertEqual(topic_titles('migr'), ['Database migrations'])  # still typing
+        self.assertEqual(topic_titles('deployed'), ['Deploying the app'])
+        self.assertEqual(topic_titles('database deploying'), [])  # every term must match
+        # Query syntax is reduced to plain terms
+        self.assertEqual(topic_titles('"database" ('), ['Database migrations'])
+        self.assertEqual(topic_titles('*'), [])
+
+    def test_titles_rank_above_descriptions(self):
+        self.topic('Weekly sync', description='Agenda for the outage review')
+        self.topic('Outage review')
+        self.assertEqual(topic_titles('outage'), ['Outage review', 'Weekly sync'])
+
+
+class SearchBackfillTests(TransactionTestCase):
+
+    def test_migration_indexes_existing_rows(self):
+        user = CustomUser.objects.create(username='member')
+        category = Category.objects.create(name='General', created_by=user)
+        # bulk_create sends no signals, so these rows miss the index
+        topic, = Topic.objects.bulk_create([Topic(title='Legacy topic', category=category, created_by=user)])
+        Message.objects.bulk_create([Message(topic=topic, sender=user, content='legacy message')])
+        self.assertEqual(topic_titles('legacy'), [])
+
+        executor = MigrationExecutor(connection)
+        executor.migrate([('search', None)])
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes('search'))
+        self.assertEqual(topic_titles('legacy'), ['Legacy topic'])
+        self.assertEqual(message_contents('legacy'), ['legacy message'])
+
+
+class SearchViewTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create(username='admin', role='admin')
+        cls.user = CustomUser.objects.create(username='member')
+        category = Category.objects.create(name='General', created_by=cls.admin)
+        cls.topics = {}
+        for title, flags in (('Open', {}), ('Restricted', {}), ('Archived', {'is_archived': True})):
+            topic = Topic.objects.create(
+                title=f'{title} incident', category=category, created_by=cls.admin, **flags
+            )
+            Message.objects.create(topic=topic, sender=cls.admin, content=f'{title} incident notes')
+            cls.topics[title] = topic
+        TopicRestriction.objects.create(
+            topic=cls.topics['Restricted'], user=cls.user, can_view=False, created_by=cls.admin
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, **params):
+        return self.client.get('/api/search/', {'q': 'incident', **params})
+
+    def test_hidden_topics_and_messages_are_left_out(self):
+        response = self.search()
+        self.assertEqual([m['content'] for m in response.data['results']], ['Open incident notes'])
+        response = self.search(type='topics')
+        self.assertEqual([t['title'] for t in response.data['results']], ['Open incident'])
+
+        self.client.force_authenticate(self.admin)
+        response = self.search(type='topics')
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_filters(self):
+        response = self.search(topic=self.topics['Open'].pk)
+        self.assertEqual(response.data['count'], 1)
+        response = self.search(topic=self.topics['Restricted'].pk)
+        self.assertEqual(response.data['count'], 0)
+
+    def test_bad_params(self):
+        for params in ({'type': 'users'}, {'topic': 'abc'}, {'category': 'abc'}, {'q': ''}):
+            self.assertEqual(self.search(**params).status_code, 400, params)
@@ -0,0 +1,69 @@
+from rest_framework import generics
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import PageNumberPagination
+
+from conversations.models import Message
+from conversations.serializers import MessageSerializer
+from topics.models import Topic
+from topics.serializers import TopicListSerializer
+from .backends import get_search_backend
+
+
+class SearchPagination(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class SearchView(generics.ListAPIView):
+    """
+    Ranked full-text search.
+
+    GET /api/search/?q=<terms>&type=messages|topics[&topic=<id>][&category=<id>]
+
+    Only topics listed to the user (and messages in them) are searched; the
+    permission filter, the index lookup and the ranking are a single query.
+    """
+    pagination_class = SearchPagination
+    search_types = ('messages', 'topics')
+
+    def get_search_type(self):
+        search_type = self.request.query_params.get('type', 'messages')
+        if search_type not in self.search_types:
+            raise ValidationError({'type': f"Must be one of {', '.join(self.search_types)}"})
+        return search_type
+
+    def get_serializer_class(self):
+        if self.get_search_type() == 'topics':
+            return TopicListSerializer
+        return MessageSerializer
+
+    def get_queryset(self):
+        query = self.request.query_params.get('q', '').strip()
+        if not query:
+            raise ValidationError({'q': 'Search query is required'})
+
+        user = self.request.user
+        backend = get_search_backend()
+        try:
+            topic_id = int(self.request.query_params.get('topic') or 0) or None
+            category_id = int(self.request.query_params.get('category') or 0) or None
+        except ValueError:
+            raise ValidationError({'error': 'topic and category must be integers'})
+
+        if self.get_search_type() == 'topics':
+            queryset = Topic.objects.accessible_to(user).select_related(
+                'category', 'created_by__department'
+            ).with_live_counters()
+            if category_id:
+                queryset = queryset.filter(category_id=category_id)
+            return backend.search_topics(queryset, query)
+
+        queryset = Message.objects.visible_to(user).select_related(
+            'topic', 'sender'
+        ).prefetch_related('tagged_users')
+        if topic_id:
+            queryset = queryset.filter(topic_id=topic_id)
+        if category_id:
+            queryset = queryset.filter(topic__category_id=category_id)
+        return backend.search_messages(queryset, query)
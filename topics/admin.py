@@ -3,7 +3,12 @@ from django.contrib import admin
 from django.utils.html import format_html
 from django.utils import timezone
 from .models import Category, Topic, CategoryRestriction, TopicRestriction
+from .permission_cache import bump_global_permission_version
 from users.models import CustomUser # Import CustomUser for clarity, though it might be implicitly available
+from conversations.archive import schedule_archive_sync
+
+# Bulk actions set updated_at explicitly: update() bypasses auto_now, and the
+# API's ETag/Last-Modified validators are derived from it.
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -24,12 +29,14 @@ class CategoryAdmin(admin.ModelAdmin):
         super().save_model(request, obj, form, change)
 
     def activate_categories(self, request, queryset):
-        updated = queryset.update(is_active=True)
+        updated = queryset.update(updated_at=timezone.now(), is_active=True)
+        bump_global_permission_version() # update() does not send post_save
         self.message_user(request, f'{updated} categories activated.')
     activate_categories.short_description = "Activate selected categories"
 
     def deactivate_categories(self, request, queryset):
-        updated = queryset.update(is_active=False)
+        updated = queryset.update(updated_at=timezone.now(), is_active=False)
+        bump_global_permission_version() # update() does not send post_save
         self.message_user(request, f'{updated} categories deactivated.')
     deactivate_categories.short_description = "Deactivate selected categories"
 
@@ -86,56 +93,65 @@ class TopicAdmin(admin.ModelAdmin):
         if not change:
             obj.created_by = request.user
         super().save_model(request, obj, form, change)
+        if change and 'is_archived' in form.changed_data:
+            schedule_archive_sync([obj.pk])
 
     # Custom actions for topic status
     def activate_topics(self, request, queryset):
-        updated = queryset.update(is_active=True)
+        updated = queryset.update(updated_at=timezone.now(), is_active=True)
+        bump_global_permission_version() # update() does not send post_save
         self.message_user(request, f'{updated} topics activated.')
     activate_topics.short_description = "Activate selected topics"
 
     def deactivate_topics(self, request, queryset):
-        updated = queryset.update(is_active=False)
+        updated = queryset.update(updated_at=timezone.now(), is_active=False)
+        bump_global_permission_version() # update() does not send post_save
         self.message_user(request, f'{updated} topics deactivated.')
     deactivate_topics.short_description = "Deactivate selected topics"
 
     def close_topics(self, request, queryset):
-        queryset.update(is_closed=True, closed_by=request.user, closed_at=timezone.now())
+        queryset.update(updated_at=timezone.now(), is_closed=True, closed_by=request.user, closed_at=timezone.now())
         self.message_user(request, f'{queryset.count()} topics closed.')
     close_topics.short_description = "Close selected topics"
 
     def reopen_topics(self, request, queryset):
-        queryset.update(is_closed=False, closed_by=None, closed_at=None)
+        queryset.update(updated_at=timezone.now(), is_closed=False, closed_by=None, closed_at=None)
         self.message_user(request, f'{queryset.count()} topics reopened.')
     reopen_topics.short_description = "Reopen selected topics"
 
     def pin_topics(self, request, queryset):
-        queryset.update(is_pinned=True, pinned_by=request.user, pinned_at=timezone.now())
+        queryset.update(updated_at=timezone.now(), is_pinned=True, pinned_by=request.user, pinned_at=timezone.now())
         self.message_user(request, f'{queryset.count()} topics pinned.')
     pin_topics.short_description = "Pin selected topics"
 
     def unpin_topics(self, request, queryset):
-        queryset.update(is_pinned=False, pinned_by=None, pinned_at=None)
+        queryset.update(updated_at=timezone.now(), is_pinned=False, pinned_by=None, pinned_at=None)
         self.message_user(request, f'{queryset.count()} topics unpinned.')
     unpin_topics.short_description = "Unpin selected topics"
 
     def lock_topics(self, request, queryset):
-        queryset.update(is_locked=True, locked_by=request.user, locked_at=timezone.now())
+        queryset.update(updated_at=timezone.now(), is_locked=True, locked_by=request.user, locked_at=timezone.now())
         self.message_user(request, f'{queryset.count()} topics locked.')
     lock_topics.short_description = "Lock selected topics"
 
     def unlock_topics(self, request, queryset):
-        queryset.update(is_locked=False, locked_by=None, locked_at=None)
+        queryset.update(updated_at=timezone.now(), is_locked=False, locked_by=None, locked_at=None)
         self.message_user(request, f'{queryset.count()} topics unlocked.')
     unlock_topics.short_description = "Unlock selected topics"
 
     def archive_topics(self, request, queryset):
-        queryset.update(is_archived=True, archived_by=request.user, archived_at=timezone.now())
-        self.message_user(request, f'{queryset.count()} topics archived.')
+        queryset.update(updated_at=timezone.now(), is_archived=True, archived_by=request.user, archived_at=timezone.now())
+        bump_global_permission_version() # update() does not send post_save
+        # Their messages move to cold storage in the background
+        schedule_archive_sync(queryset.values_list('pk', flat=True))
+        self.message_user(request, f'{queryset.count()} topics archived, their messages are being moved to the archive.')
     archive_topics.short_description = "Archive selected topics"
 
     def unarchive_topics(self, request, queryset):
-        queryset.update(is_archived=False, archived_by=None, archived_at=None)
-        self.message_user(request, f'{queryset.count()} topics unarchived.')
+        queryset.update(updated_at=timezone.now(), is_archived=False, archived_by=None, archived_at=None)
+        bump_global_permission_version() # update() does not send post_save
+        schedule_archive_sync(queryset.values_list('pk', flat=True))
+        self.message_user(request, f'{queryset.count()} topics unarchived, their messages are being restored.')
     unarchive_topics.short_description = "Unarchive selected topics"
 
 
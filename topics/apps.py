@@ -5,3 +5,6 @@ class TopicsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'topics'
     verbose_name = 'Topics and Categories'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,104 @@
+"""
+Conditional GET (ETag / Last-Modified) for topic and category endpoints.
+
+Validators are built from row timestamps plus the caller's permission
+version, at the cost of at most one aggregate query, so a client holding
+current validators gets a 304 without any serialization work.
+"""
+import hashlib
+from datetime import datetime, timezone as dt_timezone
+
+from django.db.models import Count, Max, Q
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from .permission_cache import get_permission_changed_at, get_permission_version
+
+
+def make_etag(*parts):
+    """Weak ETag over an arbitrary tuple of reprable validator parts"""
+    digest = hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest()
+    return 'W/' + quote_etag(digest)
+
+
+def latest(*timestamps):
+    """Most recent of the given datetimes, ignoring None"""
+    return max((ts for ts in timestamps if ts is not None), default=None)
+
+
+def conditional_response(request, etag, last_modified=None):
+    """
+    Return a 304 if the request's If-None-Match / If-Modified-Since match
+    the given validators, otherwise None.
+    """
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    # Responses differ per user
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def permission_validators(user):
+    """(etag parts, last change) describing the user's permission state"""
+    changed_at = get_permission_changed_at(user)
+    if changed_at is not None:
+        changed_at = datetime.fromtimestamp(changed_at, tz=dt_timezone.utc)
+    return (user.pk, get_permission_version(user)), changed_at
+
+
+def category_list_state(queryset):
+    """One aggregate over categories and their topics, for list validators"""
+    return queryset.order_by().aggregate(
+        category_count=Count('id', distinct=True),
+        category_updated=Max('updated_at'),
+        topic_count=Count('topics', filter=Q(topics__is_active=True), distinct=True),
+        topic_updated=Max('topics__updated_at'),
+        topic_activity=Max('topics__last_activity'),
+        pending_deltas=Max('topics__counter_deltas__id'),
+        pending_activity=Max('topics__counter_deltas__last_activity'),
+    )
+
+
+class ConditionalGetMixin:
+    """
+    Adds ETag / Last-Modified handling to a viewset's list and retrieve.
+
+    Subclasses implement get_list_validators(queryset) and
+    get_object_validators(obj), each returning (etag parts, last modified).
+    """
+
+    def get_validator_queryset(self):
+        return self.filter_queryset(self.get_queryset())
+
+    def _validators(self, parts, last_modified):
+        user_parts, permissions_changed = permission_validators(self.request.user)
+        etag = make_etag(self.request.get_full_path(), user_parts, parts)
+        return etag, latest(last_modified, permissions_changed)
+
+    def list(self, request, *args, **kwargs):
+        etag, last_modified = self._validators(
+            *self.get_list_validators(self.get_validator_queryset())
+        )
+        response = conditional_response(request, etag, last_modified)
+        if response is None:
+            response = set_validators(super().list(request, *args, **kwargs), etag, last_modified)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag, last_modified = self._validators(*self.get_object_validators(instance))
+        response = conditional_response(request, etag, last_modified)
+        if response is None:
+            serializer = self.get_serializer(instance)
+            response = set_validators(Response(serializer.data), etag, last_modified)
+        return response
@@ -0,0 +1,141 @@
+"""
+Topic message counters.
+
+Posting a message appends a TopicCounterDelta row instead of updating the
+Topic row, so concurrent writers never queue on the same row lock.  Deltas
+are folded into Topic.total_messages/last_activity:
+
+* after commit, in a background thread of whichever process first takes
+  the fold lease (at most once per TOPIC_COUNTER_FOLD_INTERVAL seconds;
+  0 turns this off).  Posts committed while the lease is held leave a
+  flag, and the lease holder folds again once the lease expires.  The
+  posting request never waits for the fold, and a failed fold is only
+  logged: its deltas stay pending for the next one;
+* by `manage.py reconcile_topic_counters`, which also recounts topics from
+  their messages to repair any drift.
+
+Reads that need exact values use TopicQuerySet.with_live_counters(), which
+adds the pending deltas on the fly.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, DateTimeField, F, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import Topic, TopicCounterDelta
+
+
+FOLD_LEASE_KEY = 'topics:counter-fold'
+FOLD_PENDING_KEY = 'topics:counter-fold-pending'
+FOLD_INTERVAL = getattr(settings, 'TOPIC_COUNTER_FOLD_INTERVAL', 5)
+FOLD_BATCH_SIZE = 5000
+
+logger = logging.getLogger(__name__)
+
+
+def record_message(topic_id, created_at):
+    """Count one new message in `topic_id`; call inside the message's transaction"""
+    TopicCounterDelta.objects.create(topic_id=topic_id, last_activity=created_at)
+    transaction.on_commit(schedule_fold)
+
+
+def schedule_fold():
+    """Fold pending deltas in the background now, or after the current fold lease expires"""
+    if not FOLD_INTERVAL:
+        return
+    if cache.add(FOLD_LEASE_KEY, True, FOLD_INTERVAL):
+        threading.Thread(target=_fold_in_background, name='topic-counter-fold', daemon=True).start()
+    else:
+        # Left for the lease holder's trailing fold
+        cache.set(FOLD_PENDING_KEY, True, None)
+
+
+def _fold_in_background():
+    try:
+        while True:
+            # Cleared first: a post landing during the fold asks for another
+            cache.delete(FOLD_PENDING_KEY)
+            fold_topic_counters()
+            time.sleep(FOLD_INTERVAL)
+            # Stop unless a post asked for another fold and the lease is ours
+            # again; if another process took it, its fold covers the request
+            if not cache.get(FOLD_PENDING_KEY) or not cache.add(FOLD_LEASE_KEY, True, FOLD_INTERVAL):
+                break
+    except Exception:
+        logger.exception('Folding topic counter deltas failed')
+    finally:
+        connection.close()  # the thread's own connection
+
+
+def fold_topic_counters(batch_size=FOLD_BATCH_SIZE):
+    """
+    Apply and delete pending deltas, oldest first, in batches.  Each batch
+    is claimed with SKIP LOCKED where the database supports it, so
+    concurrent folds never apply a delta twice.  Returns the number folded.
+    """
+    folded = 0
+    while True:
+        with transaction.atomic():
+            deltas = list(
+                TopicCounterDelta.objects.select_for_update(skip_locked=True).order_by('id')
+                .values_list('id', 'topic_id', 'messages', 'last_activity')[:batch_size]
+            )
+            if not deltas:
+                return folded
+
+            totals = {}
+            for _, topic_id, messages, last_activity in deltas:
+                count, latest = totals.get(topic_id, (0, None))
+                if last_activity is not None and (latest is None or last_activity > latest):
+                    latest = last_activity
+                totals[topic_id] = (count + messages, latest)
+
+            for topic_id, (count, latest) in totals.items():
+                changes = {'total_messages': F('total_messages') + count}
+                if latest is not None:
+                    changes['last_activity'] = Greatest(
+                        'last_activity', Value(latest, output_field=DateTimeField())
+                    )
+                Topic.objects.filter(pk=topic_id).update(**changes)
+            TopicCounterDelta.objects.filter(id__in=[delta[0] for delta in deltas]).delete()
+
+        folded += len(deltas)
+        if len(deltas) < batch_size:
+            return folded
+
+
+def reconcile_topics(topic_ids):
+    """
+    Recompute total_messages and last_activity of `topic_ids` from their
+    messages, archived ones included, dropping their pending deltas.
+    Returns how many topics had drifted.
+    """
+    Message = Topic._meta.get_field('messages').related_model
+    Segment = Topic._meta.get_field('archive_segments').related_model
+    messages = Message.objects.filter(topic=OuterRef('pk')).order_by().values('topic')
+    segments = Segment.objects.filter(topic=OuterRef('pk')).order_by().values('topic')
+    actual_total = (
+        Coalesce(Subquery(messages.annotate(n=Count('id')).values('n')), 0)
+        + Coalesce(Subquery(segments.annotate(n=Sum('message_count')).values('n')), 0)
+    )
+    actual_latest = Coalesce(
+        Subquery(messages.annotate(latest=Max('created_at')).values('latest')),
+        Subquery(segments.annotate(latest=Max('last_created_at')).values('latest')),
+        F('last_activity'),
+    )
+    with transaction.atomic():
+        TopicCounterDelta.objects.filter(topic_id__in=topic_ids).delete()
+        return Topic.objects.filter(pk__in=topic_ids).filter(
+            ~Q(total_messages=actual_total) | ~Q(last_activity=actual_latest)
+        ).update(
+            total_messages=actual_total,
+            last_activity=actual_latest,
+            # update() skips auto_now; list ETags rely on updated_at
+            updated_at=timezone.now(),
+        )
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from topics.counters import fold_topic_counters, reconcile_topics
+from topics.models import Topic
+
+
+class Command(BaseCommand):
+    help = (
+        'Fold pending topic counter deltas, then recount every topic from its '
+        'messages in chunks, repairing total_messages/last_activity drift'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Topics recounted per transaction (default 500)',
+        )
+        parser.add_argument(
+            '--fold-only', action='store_true',
+            help='Only fold pending deltas, skip the recount',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        folded = fold_topic_counters()
+        self.stdout.write(f'Folded {folded} pending counter deltas')
+        if options['fold_only']:
+            return
+
+        drifted = checked = 0
+        last_id = 0
+        while True:
+            ids = list(
+                Topic.objects.filter(pk__gt=last_id).order_by('pk')
+                .values_list('pk', flat=True)[:chunk_size]
+            )
+            if not ids:
+                break
+            drifted += reconcile_topics(ids)
+            checked += len(ids)
+            last_id = ids[-1]
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Checked {checked} topics, repaired {drifted}'
+        ))
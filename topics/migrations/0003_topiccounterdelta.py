@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 00:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('topics', '0002_topic_archived_at_topic_archived_by_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopicCounterDelta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('messages', models.IntegerField(default=1)),
+                ('last_activity', models.DateTimeField(blank=True, null=True)),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counter_deltas', to='topics.topic')),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-18 01:04
+
+from django.db import migrations, models
+import topics.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('topics', '0003_topiccounterdelta'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='topic_message_rate',
+            field=models.CharField(blank=True, help_text='Messages all users together may post in one topic, e.g. 120/min', max_length=20, validators=[topics.models.validate_rate]),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='user_message_rate',
+            field=models.CharField(blank=True, help_text='Messages one user may post in this category, e.g. 30/min', max_length=20, validators=[topics.models.validate_rate]),
+        ),
+    ]
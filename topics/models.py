@@ -1,8 +1,155 @@
 from django.db import models
+from django.db.models import (
+    BooleanField, Count, Exists, ExpressionWrapper, Max, OuterRef, Q, Subquery, Sum, Value
+)
+from django.db.models.functions import Coalesce, Greatest
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.utils import timezone
 from users.models import CustomUser
 
+from .permission_cache import get_permission_snapshot
+
+
+def _denied(restriction_model, target, outer_field, user, permission_field):
+    """Exists() clause matching a restriction row that denies `permission_field`"""
+    return Exists(
+        restriction_model.objects.filter(
+            user=user,
+            **{target: OuterRef(outer_field), f"can_{permission_field}": False}
+        )
+    )
+
+
+class CategoryQuerySet(models.QuerySet):
+    """Set-based counterpart of Category.can_user_view/can_user_reply"""
+
+    def _permitted(self, user, permission_field):
+        if user.is_admin():
+            return self
+        return self.filter(
+            ~_denied(CategoryRestriction, 'category', 'pk', user, permission_field)
+        )
+
+    def visible_to(self, user):
+        return self._permitted(user, 'view')
+
+    def replyable_by(self, user):
+        return self._permitted(user, 'reply')
+
+    def with_user_flags(self, user):
+        """
+        Annotate the active topic count and the user's view/reply flags, so a
+        category list is serialized from a single query.
+        """
+        queryset = self.annotate(
+            active_topics_count=Count('topics', filter=Q(topics__is_active=True))
+        )
+        if user.is_admin():
+            return queryset.annotate(
+                user_can_view=Value(True, output_field=BooleanField()),
+                user_can_reply=Value(True, output_field=BooleanField()),
+            )
+
+        restriction = CategoryRestriction.objects.filter(category=OuterRef('pk'), user=user)
+        return queryset.annotate(
+            user_can_view=Coalesce(
+                Subquery(restriction.values('can_view')[:1]), Value(True),
+                output_field=BooleanField(),
+            ),
+            user_can_reply=Coalesce(
+                Subquery(restriction.values('can_reply')[:1]), Value(True),
+                output_field=BooleanField(),
+            ),
+        )
+
+
+class TopicQuerySet(models.QuerySet):
+    """
+    Set-based counterpart of Topic.can_user_view/can_user_reply.
+
+    Restrictions are applied as anti-joins, so the whole permission check runs
+    inside the one SQL query instead of two lookups per topic.  A missing
+    restriction row means "allowed", exactly like Topic._has_permission.
+    """
+
+    def _permitted(self, user, permission_field):
+        if user.is_admin():
+            return self
+        return self.filter(
+            ~_denied(CategoryRestriction, 'category', 'category_id', user, permission_field),
+            ~_denied(TopicRestriction, 'topic', 'pk', user, permission_field),
+        )
+
+    def visible_to(self, user):
+        return self._permitted(user, 'view')
+
+    def replyable_by(self, user):
+        return self._permitted(user, 'reply').filter(
+            is_closed=False, is_locked=False, is_archived=False
+        )
+
+    def accessible_to(self, user):
+        """Topics listed to the user: active, and for non-admins also unarchived and visible"""
+        queryset = self.filter(is_active=True)
+        if user.is_admin():
+            return queryset
+        return queryset.filter(is_archived=False).visible_to(user)
+
+    def with_user_flags(self, user):
+        """
+        Annotate `user_can_view` and `user_can_reply` from the restrictions
+        alone; the closed/locked/archived checks of can_user_reply are left
+        to the caller, who has those fields on the row.
+        """
+        if user.is_admin():
+            return self.annotate(
+                user_can_view=Value(True, output_field=BooleanField()),
+                user_can_reply=Value(True, output_field=BooleanField()),
+            )
+
+        def allowed(permission_field):
+            return ExpressionWrapper(
+                ~Q(_denied(CategoryRestriction, 'category', 'category_id', user, permission_field))
+                & ~Q(_denied(TopicRestriction, 'topic', 'pk', user, permission_field)),
+                output_field=BooleanField(),
+            )
+
+        return self.annotate(user_can_view=allowed('view'), user_can_reply=allowed('reply'))
+
+    def with_live_counters(self):
+        """
+        Annotate `live_total_messages` and `live_last_activity`: the stored
+        counters plus the TopicCounterDelta rows not folded into them yet.
+        Without an explicit order_by(), rows are sorted on
+        -live_last_activity rather than Meta.ordering's stored column.
+        """
+        pending = TopicCounterDelta.objects.filter(topic=OuterRef('pk')).order_by().values('topic')
+        queryset = self.annotate(
+            live_total_messages=models.F('total_messages') + Coalesce(
+                Subquery(pending.annotate(n=Sum('messages')).values('n')), 0
+            ),
+            live_last_activity=Greatest(
+                'last_activity',
+                Coalesce(
+                    Subquery(pending.annotate(latest=Max('last_activity')).values('latest')),
+                    'last_activity',
+                ),
+            ),
+        )
+        if not self.query.order_by:
+            queryset = queryset.order_by('-live_last_activity')
+        return queryset
+
+
+def validate_rate(value):
+    """A DRF throttle rate: '<count>/<period>', the period being s, m, h or d (e.g. 30/min)"""
+    count, _, period = value.partition('/')
+    if not count.isdigit() or not period or period[0] not in 'smhd':
+        raise ValidationError(f'"{value}" is not a rate like 30/min or 500/hour.')
+    if not int(count):
+        raise ValidationError(f'"{value}" allows no messages at all; close or lock the topics instead.')
+
 
 class Category(models.Model):
     """Department-based categories like Software, Marketing, etc."""
@@ -12,6 +159,17 @@ class Category(models.Model):
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
+
+    # Posting limits (see conversations.throttling); blank uses the defaults
+    # in REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']
+    user_message_rate = models.CharField(
+        max_length=20, blank=True, validators=[validate_rate],
+        help_text='Messages one user may post in this category, e.g. 30/min',
+    )
+    topic_message_rate = models.CharField(
+        max_length=20, blank=True, validators=[validate_rate],
+        help_text='Messages all users together may post in one topic, e.g. 120/min',
+    )
     
     # Permissions
     restricted_users = models.ManyToManyField(
@@ -21,11 +179,20 @@ class Category(models.Model):
         related_name='categories_restricted',
         blank=True
     )
+
+    objects = CategoryQuerySet.as_manager()
     
     class Meta:
         verbose_name_plural = "Categories"
         ordering = ['name']
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Kept so the permission signals can tell which fields a save changed
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+    
     def __str__(self):
         return self.name
     
@@ -33,6 +200,10 @@ class Category(models.Model):
         """Check if user can view this category"""
         if user.is_admin():
             return True
+
+        allowed = get_permission_snapshot(user).can_view_category(self.pk)
+        if allowed is not None:
+            return allowed
         
         restriction = CategoryRestriction.objects.filter(
             category=self, 
@@ -47,6 +218,10 @@ class Category(models.Model):
         """Check if user can reply in this category"""
         if user.is_admin():
             return True
+
+        allowed = get_permission_snapshot(user).can_reply_category(self.pk)
+        if allowed is not None:
+            return allowed
             
         restriction = CategoryRestriction.objects.filter(
             category=self, 
@@ -138,18 +313,44 @@ class Topic(models.Model):
     # Metrics
     total_messages = models.IntegerField(default=0)
     last_activity = models.DateTimeField(default=timezone.now)
+
+    objects = TopicQuerySet.as_manager()
     
     class Meta:
         ordering = ['-last_activity']
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Kept so the permission signals can tell which fields a save changed
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+    
     def __str__(self):
         return f"{self.category.name} - {self.title}"
     
+    @property
+    def current_total_messages(self):
+        """total_messages including unfolded deltas, when annotated (see with_live_counters)"""
+        return getattr(self, 'live_total_messages', self.total_messages)
+
+    @property
+    def current_last_activity(self):
+        return getattr(self, 'live_last_activity', self.last_activity)
     
     def _has_permission(self, user, permission_field):
-        # Superusers always have permission
-        if user.is_superuser == user:
+        # Admins always have permission
+        if user.is_admin():
             return True
+
+        # Answer from the cached permission snapshot when it covers this topic
+        snapshot = get_permission_snapshot(user)
+        allowed = (
+            snapshot.can_view_topic(self.pk) if permission_field == 'view'
+            else snapshot.can_reply_topic(self.pk)
+        )
+        if allowed is not None:
+            return allowed
         
         # Check category permissions
         if permission_field == 'view' and not self.category.can_user_view(user):
@@ -182,6 +383,20 @@ class Topic(models.Model):
         return self._has_permission(user, 'reply')
 
 
+class TopicCounterDelta(models.Model):
+    """
+    Append-only change to a topic's counters.  Posting a message inserts
+    one of these instead of updating the (hot) Topic row; topics.counters
+    folds them into Topic.total_messages/last_activity in the background.
+    """
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE, related_name='counter_deltas')
+    messages = models.IntegerField(default=1)
+    last_activity = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.topic_id}: {self.messages:+d}"
+
+
 class TopicRestriction(models.Model):
     """Permissions for users on specific topics"""
     topic = models.ForeignKey(Topic, on_delete=models.CASCADE)
@@ -0,0 +1,221 @@
+"""
+Per-user permission snapshots.
+
+A snapshot holds the category and topic IDs a user may view and reply in,
+built in one pass from the restriction tables and kept in Django's cache
+framework.  Snapshot keys embed two version counters:
+
+* a per-user version, bumped whenever one of the user's CategoryRestriction
+  or TopicRestriction rows is saved or deleted;
+* a global version, bumped when a Category or Topic is activated,
+  deactivated, archived or unarchived.
+
+Bumping a version makes every older snapshot unreachable, so there is never
+anything to delete explicitly.  Bumps happen once the current transaction
+commits; bumping earlier would let a concurrent request rebuild a snapshot
+from the uncommitted state and cache it under the new version.
+
+Within a request, each user's version pair is read from the cache once and
+memoised until the request ends, or until a bump in the same request.
+"""
+import time
+
+from asgiref.local import Local
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_finished, request_started
+from django.db import transaction
+from django.dispatch import receiver
+
+
+GLOBAL_VERSION_KEY = 'perm:version:global'
+SNAPSHOT_TIMEOUT = getattr(settings, 'PERMISSION_SNAPSHOT_TIMEOUT', 60 * 60)
+
+
+def _user_version_key(user_id):
+    return f'perm:version:user:{user_id}'
+
+
+def _new_version():
+    # Seed from the clock so a version evicted from the cache never restarts
+    # at a number an older snapshot was stored under.
+    return int(time.time() * 1000)
+
+
+def _changed_key(key):
+    return f'{key}:changed'
+
+
+# Version pairs read during the current request, by user id; only set
+# while a request is being handled (contextvar-backed, so ASGI-safe)
+_request = Local()
+
+
+@receiver(request_started)
+def _start_request_memo(**kwargs):
+    _request.versions = {}
+
+
+@receiver(request_finished)
+def _end_request_memo(**kwargs):
+    _request.versions = None
+
+
+def _bump(key):
+    def bump():
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_version(), None)
+        cache.set(_changed_key(key), time.time(), None)
+        if getattr(_request, 'versions', None):
+            _request.versions = {}
+
+    transaction.on_commit(bump)
+
+
+def bump_user_permission_version(user_id):
+    """Invalidate the permission snapshot of one user, once the current transaction commits"""
+    _bump(_user_version_key(user_id))
+
+
+def bump_global_permission_version():
+    """Invalidate the permission snapshots of every user, once the current transaction commits"""
+    _bump(GLOBAL_VERSION_KEY)
+
+
+def get_permission_version(user):
+    """Return the (global, user) version pair the user's snapshot is keyed on"""
+    memo = getattr(_request, 'versions', None)
+    if memo is not None and user.pk in memo:
+        return memo[user.pk]
+
+    user_key = _user_version_key(user.pk)
+    versions = cache.get_many([GLOBAL_VERSION_KEY, user_key])
+    missing = {key: _new_version() for key in (GLOBAL_VERSION_KEY, user_key) if key not in versions}
+    for key, value in missing.items():
+        # add() so a concurrent bump is not overwritten
+        if not cache.add(key, value, None):
+            value = cache.get(key, value)
+        versions[key] = value
+    pair = versions[GLOBAL_VERSION_KEY], versions[user_key]
+    if memo is not None:
+        memo[user.pk] = pair
+    return pair
+
+
+def get_permission_changed_at(user):
+    """
+    Wall-clock time (epoch seconds) of the last bump affecting `user`, or
+    None if nothing has changed since the cache was populated.  Used to fold
+    permission changes into Last-Modified validators.
+    """
+    stamps = cache.get_many([
+        _changed_key(GLOBAL_VERSION_KEY), _changed_key(_user_version_key(user.pk))
+    ])
+    return max(stamps.values(), default=None)
+
+
+class PermissionSnapshot:
+    """
+    Visible/replyable category and topic IDs for one user.
+
+    Only active categories and topics are covered.  The lookup methods return
+    None for IDs outside that set so callers can fall back to the database.
+    """
+
+    def __init__(self, version, categories, visible_categories, replyable_categories,
+                 topics, visible_topics, replyable_topics):
+        self.version = version
+        self.categories = categories
+        self.visible_categories = visible_categories
+        self.replyable_categories = replyable_categories
+        self.topics = topics
+        self.visible_topics = visible_topics
+        self.replyable_topics = replyable_topics
+
+    @classmethod
+    def build(cls, user, version):
+        from .models import Category, CategoryRestriction, Topic, TopicRestriction
+
+        categories = frozenset(
+            Category.objects.filter(is_active=True).order_by().values_list('id', flat=True)
+        )
+        category_restrictions = {
+            category_id: (can_view, can_reply)
+            for category_id, can_view, can_reply in CategoryRestriction.objects.filter(
+                user=user
+            ).values_list('category_id', 'can_view', 'can_reply')
+        }
+        topic_restrictions = {
+            topic_id: (can_view, can_reply)
+            for topic_id, can_view, can_reply in TopicRestriction.objects.filter(
+                user=user
+            ).values_list('topic_id', 'can_view', 'can_reply')
+        }
+
+        visible_categories = frozenset(
+            c for c in categories if category_restrictions.get(c, (True, True))[0]
+        )
+        replyable_categories = frozenset(
+            c for c in categories if category_restrictions.get(c, (True, True))[1]
+        )
+
+        topics, visible_topics, replyable_topics = set(), set(), set()
+        for topic_id, category_id, is_archived in Topic.objects.filter(
+            is_active=True
+        ).order_by().values_list('id', 'category_id', 'is_archived'):
+            topics.add(topic_id)
+            can_view, can_reply = topic_restrictions.get(topic_id, (True, True))
+            category_view, category_reply = category_restrictions.get(category_id, (True, True))
+            if can_view and category_view:
+                visible_topics.add(topic_id)
+            if can_reply and category_reply and not is_archived:
+                replyable_topics.add(topic_id)
+
+        return cls(
+            version, categories, visible_categories, replyable_categories,
+            frozenset(topics), frozenset(visible_topics), frozenset(replyable_topics),
+        )
+
+    def can_view_category(self, category_id):
+        if category_id not in self.categories:
+            return None
+        return category_id in self.visible_categories
+
+    def can_reply_category(self, category_id):
+        if category_id not in self.categories:
+            return None
+        return category_id in self.replyable_categories
+
+    def can_view_topic(self, topic_id):
+        if topic_id not in self.topics:
+            return None
+        return topic_id in self.visible_topics
+
+    def can_reply_topic(self, topic_id):
+        if topic_id not in self.topics:
+            return None
+        return topic_id in self.replyable_topics
+
+
+def get_permission_snapshot(user):
+    """
+    Return the current PermissionSnapshot for `user`.
+
+    The snapshot is memoised on the user instance for as long as its version
+    is current, so repeated checks within a request cost a single cache
+    round trip for the version pair and no unpickling.
+    """
+    version = get_permission_version(user)
+    snapshot = getattr(user, '_permission_snapshot', None)
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+
+    key = 'perm:snapshot:{}:{}:{}'.format(user.pk, *version)
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = PermissionSnapshot.build(user, version)
+        cache.set(key, snapshot, SNAPSHOT_TIMEOUT)
+    user._permission_snapshot = snapshot
+    return snapshot
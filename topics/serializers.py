@@ -28,14 +28,22 @@ class CategorySerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['created_by', 'created_at', 'updated_at']
     
+    # The get_* methods below prefer the annotations added by
+    # CategoryQuerySet.with_user_flags and only query when they are missing
+    # (e.g. when nested inside a topic or restriction).
+
     def get_topics_count(self, obj):
         """Get count of active topics in this category"""
+        if hasattr(obj, 'active_topics_count'):
+            return obj.active_topics_count
         return obj.topics.filter(is_active=True).count()
     
     def get_can_view(self, obj):
         """Check if current user can view this category"""
         request = self.context.get('request')
         if request and request.user.is_authenticated:
+            if hasattr(obj, 'user_can_view'):
+                return obj.user_can_view
             return obj.can_user_view(request.user)
         return False
     
@@ -43,6 +51,8 @@ class CategorySerializer(serializers.ModelSerializer):
         """Check if current user can reply in this category"""
         request = self.context.get('request')
         if request and request.user.is_authenticated:
+            if hasattr(obj, 'user_can_reply'):
+                return obj.user_can_reply
             return obj.can_user_reply(request.user)
         return False
 
@@ -72,6 +82,9 @@ class TopicSerializer(serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
     can_view = serializers.SerializerMethodField()
     can_reply = serializers.SerializerMethodField()
+    # Include unfolded counter deltas when the queryset has with_live_counters()
+    total_messages = serializers.IntegerField(source='current_total_messages', read_only=True)
+    last_activity = serializers.DateTimeField(source='current_last_activity', read_only=True)
     
     class Meta:
         model = Topic
@@ -140,6 +153,8 @@ class TopicListSerializer(serializers.ModelSerializer):
     """Simplified topic serializer for listing"""
     created_by = UserBasicSerializer(read_only=True)
     category_name = serializers.CharField(source='category.name', read_only=True)
+    total_messages = serializers.IntegerField(source='current_total_messages', read_only=True)
+    last_activity = serializers.DateTimeField(source='current_last_activity', read_only=True)
     
     class Meta:
         model = Topic
@@ -0,0 +1,51 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Category, CategoryRestriction, Topic, TopicRestriction
+from .permission_cache import bump_global_permission_version, bump_user_permission_version
+
+
+# Fields whose change alters which categories/topics a permission snapshot covers
+SNAPSHOT_FIELDS = {
+    Category: {'is_active'},
+    Topic: {'is_active', 'is_archived', 'category'},
+}
+
+
+@receiver(post_save, sender=CategoryRestriction)
+@receiver(post_delete, sender=CategoryRestriction)
+@receiver(post_save, sender=TopicRestriction)
+@receiver(post_delete, sender=TopicRestriction)
+def invalidate_user_permissions(sender, instance, **kwargs):
+    """A restriction only affects the snapshot of the restricted user"""
+    bump_user_permission_version(instance.user_id)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Topic)
+def invalidate_permissions_on_status_change(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Activation and archival change what every snapshot covers.  New rows are
+    not in any snapshot yet and fall back to the database, so they are skipped,
+    as are saves that leave the snapshot fields as they were loaded (e.g.
+    closing a topic or bumping the message counters).
+    """
+    fields = [sender._meta.get_field(name) for name in SNAPSHOT_FIELDS[sender]]
+    if update_fields is not None:
+        fields = [field for field in fields if {field.name, field.attname} & set(update_fields)]
+    attnames = [field.attname for field in fields]
+    loaded = getattr(instance, '_loaded_values', None)
+    changed = loaded is None or any(
+        name not in loaded or loaded[name] != getattr(instance, name) for name in attnames
+    )
+    # Later saves of the same instance compare against what is stored now
+    instance._loaded_values = {**(loaded or {}), **{name: getattr(instance, name) for name in attnames}}
+    if created or not changed:
+        return
+    bump_global_permission_version()
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Topic)
+def invalidate_permissions_on_delete(sender, instance, **kwargs):
+    bump_global_permission_version()
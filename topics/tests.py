@@ -1,3 +1,228 @@
+from unittest import mock
+
+from django.core.cache import cache
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from perf.testing import QueryBudgetMixin
+from users.models import CustomUser
+from .models import Category, CategoryRestriction, Topic, TopicRestriction
+from .permission_cache import _end_request_memo, _start_request_memo, get_permission_version
+from .views import CategoryViewSet, TopicViewSet
+
+
+class PermissionVersionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create(username='admin', role='admin')
+        cls.user = CustomUser.objects.create(username='member')
+        category = Category.objects.create(name='General', created_by=cls.admin)
+        cls.topic = Topic.objects.create(title='Hello', category=category, created_by=cls.admin)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_bumped_on_commit(self):
+        version = get_permission_version(self.user)
+        with self.captureOnCommitCallbacks() as callbacks:
+            TopicRestriction.objects.create(
+                topic=self.topic, user=self.user, can_view=False, created_by=self.admin
+            )
+            # Not before the restriction is visible to other connections
+            self.assertEqual(get_permission_version(self.user), version)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(get_permission_version(self.user), version)
+
+    def test_memoised_per_request(self):
+        _start_request_memo()  # as on request_started
+        try:
+            version = get_permission_version(self.user)
+            cache.clear()  # a memoised pair is not read from the cache again
+            self.assertEqual(get_permission_version(self.user), version)
+
+            # A bump in the same request is seen at once
+            self.topic.is_archived = True
+            with self.captureOnCommitCallbacks(execute=True):
+                self.topic.save()
+            self.assertNotEqual(get_permission_version(self.user), version)
+        finally:
+            _end_request_memo()
+
+    def test_bumped_only_when_visibility_changes(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        topic = Topic.objects.get(pk=self.topic.pk)
+        version = get_permission_version(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(client.post(f'/api/topics/topics/{topic.pk}/close/').status_code, 200)
+            self.assertEqual(client.post(f'/api/topics/topics/{topic.pk}/reopen/').status_code, 200)
+            topic.title = 'Renamed'
+            topic.save()
+            topic.category.description = 'Edited'
+            topic.category.save()
+        self.assertEqual(get_permission_version(self.user), version)
+
+        other = Category.objects.create(name='Other', created_by=self.admin)
+        for field, value in (('is_archived', True), ('is_active', False), ('category', other)):
+            setattr(topic, field, value)
+            with self.captureOnCommitCallbacks(execute=True):
+                topic.save()
+            self.assertNotEqual(get_permission_version(self.user), version, field)
+            version = get_permission_version(self.user)
+
+
+class TopicVisibilityTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create(username='admin', role='admin')
+        cls.user = CustomUser.objects.create(username='member')
+        general = Category.objects.create(name='General', created_by=cls.admin)
+        private = Category.objects.create(name='Private', created_by=cls.admin)
+        CategoryRestriction.objects.create(
+            category=private, user=cls.user, can_view=False, created_by=cls.admin
+        )
+
+        def topic(title, category=general, **flags):
+            return Topic.objects.create(title=title, category=category, created_by=cls.admin, **flags)
+
+        cls.open = topic('Open')
+        cls.allowed = topic('Allowed')  # an allowing restriction is no restriction
+        cls.restricted = topic('Restricted')
+        cls.archived = topic('Archived', is_archived=True)
+        cls.inactive = topic('Inactive', is_active=False)
+        cls.private = topic('Private', category=private)
+        for topic, can_view in ((cls.allowed, True), (cls.restricted, False)):
+            TopicRestriction.objects.create(topic=topic, user=cls.user, can_view=can_view, created_by=cls.admin)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def listed(self, user, url='/api/topics/topics/'):
+        self.client.force_authenticate(user)
+        return {topic['title'] for topic in self.client.get(url).data}
+
+    def test_topic_list(self):
+        self.assertEqual(self.listed(self.user), {'Open', 'Allowed'})
+        # Admins see past restrictions and archiving, but not inactive topics
+        self.assertEqual(self.listed(self.admin), {'Open', 'Allowed', 'Restricted', 'Archived', 'Private'})
+
+    def test_agrees_with_can_user_view(self):
+        listed = set(Topic.objects.accessible_to(self.user).values_list('pk', flat=True))
+        for topic in Topic.objects.filter(is_active=True, is_archived=False):
+            self.assertEqual(topic.pk in listed, topic.can_user_view(self.user), topic.title)
+
+    def test_category_topics_and_search(self):
+        category = self.open.category
+        # A category's own listing has always kept its archived topics
+        self.assertEqual(
+            self.listed(self.user, f'/api/topics/categories/{category.pk}/topics/'), {'Open', 'Allowed', 'Archived'}
+        )
+        response = self.client.get(f'/api/topics/categories/{self.private.category_id}/topics/')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.listed(self.user, '/api/topics/topics/search/?q=Restricted'), set())
+        self.assertEqual(self.listed(self.admin, '/api/topics/topics/search/?q=Restricted'), {'Restricted'})
+
+
+class CategoryListTests(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create(username='admin', role='admin')
+        cls.user = CustomUser.objects.create(username='member')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_categories(self, count, topics):
+        for n in range(count):
+            category = Category.objects.create(name=f'Category {Category.objects.count()}', created_by=self.admin)
+            CategoryRestriction.objects.create(
+                category=category, user=self.user, can_reply=bool(n % 2), created_by=self.admin
+            )
+            for m in range(topics):
+                Topic.objects.create(title=f'Topic {m}', category=category, created_by=self.admin)
+
+    def test_budget_is_flat(self):
+        self.add_categories(1, topics=1)
+        for count in (1, 11):
+            cache.clear()
+            response = self.assertEndpointBudget('/api/topics/categories/', queries=3, duplicates=0)
+            self.assertEqual(len(response.data), count)
+            self.add_categories(10, topics=5)
+
+        flags = {c['name']: (c['topics_count'], c['can_view'], c['can_reply']) for c in response.data}
+        self.assertEqual(flags['Category 0'], (1, True, False))
+        self.assertEqual(flags['Category 2'], (5, True, True))
+
+
+class ConditionalGetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create(username='admin', role='admin')
+        cls.user = CustomUser.objects.create(username='member')
+        cls.category = Category.objects.create(name='General', created_by=cls.admin)
+        cls.topic = Topic.objects.create(title='Hello', category=cls.category, created_by=cls.admin)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def etag(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_not_modified_before_serialization(self):
+        for url, viewset, queries in (
+            ('/api/topics/topics/', TopicViewSet, 1),  # the validator aggregate
+            (f'/api/topics/topics/{self.topic.pk}/', TopicViewSet, 2),  # the topic, then the aggregate
+            ('/api/topics/categories/', CategoryViewSet, 1),
+            (f'/api/topics/categories/{self.category.pk}/', CategoryViewSet, 2),
+        ):
+            response = self.client.get(url)
+            with mock.patch.object(viewset, 'get_serializer', side_effect=AssertionError), \
+                    self.assertNumQueries(queries):
+                not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(not_modified.status_code, 304, url)
+            self.assertEqual(not_modified['ETag'], response['ETag'])
+
+            not_modified = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(not_modified.status_code, 304, url)
+
+    def test_changes_change_the_etag(self):
+        urls = ['/api/topics/topics/', f'/api/topics/topics/{self.topic.pk}/']
+        etags = [self.etag(url) for url in urls]
+
+        def changed():
+            nonlocal etags
+            current = [self.etag(url) for url in urls]
+            unchanged = [url for url, old, new in zip(urls, etags, current) if old == new]
+            etags = current
+            return unchanged
+
+        # A new message is only a pending counter delta at first
+        response = self.client.post(
+            '/api/conversations/messages/', {'topic': self.topic.pk, 'content': 'hi'}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(changed(), [])
+
+        self.topic.title = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.topic.save()
+        self.assertEqual(changed(), [])
 
-# Create your tests here.
+        # A restriction on another topic changes what the user is shown
+        other = Topic.objects.create(title='Other', category=self.category, created_by=self.admin)
+        etags = [self.etag(url) for url in urls]
+        with self.captureOnCommitCallbacks(execute=True):
+            TopicRestriction.objects.create(topic=other, user=self.user, can_view=False, created_by=self.admin)
+        self.assertEqual(changed(), [])
@@ -5,8 +5,11 @@ from django.shortcuts import get_object_or_404
 from django.contrib.auth.models import User
 from users.models import CustomUser
 from django.utils import timezone
-from django.db.models import Q
+from django.db.models import Count, Max, Q
 
+from search.backends import get_search_backend
+
+from .conditional import ConditionalGetMixin, category_list_state, latest
 from .models import Category, Topic, CategoryRestriction, TopicRestriction
 from .serializers import (
     CategorySerializer, CategoryCreateSerializer,
@@ -32,26 +35,44 @@ class IsAdminUser(permissions.BasePermission):
         return request.user.is_authenticated and request.user.is_admin()
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """ViewSet for managing categories"""
     serializer_class = CategorySerializer
     permission_classes = [IsAdminOrReadOnly]
+
+    def get_visible_categories(self):
+        """Active categories, minus those the user can't view"""
+        user = self.request.user
+        queryset = Category.objects.filter(is_active=True)
+        if not user.is_admin():
+            queryset = queryset.visible_to(user)
+        return queryset
     
     def get_queryset(self):
         """Filter categories based on user permissions"""
-        user = self.request.user
-        if user.is_admin():
-            return Category.objects.filter(is_active=True)
-        
-        # For regular users, filter out categories they can't view
-        queryset = Category.objects.filter(is_active=True)
-        accessible_categories = []
-        
-        for category in queryset:
-            if category.can_user_view(user):
-                accessible_categories.append(category.id)
-        
-        return queryset.filter(id__in=accessible_categories)
+        # Topic counts and the user's flags come from annotations, so listing
+        # costs one query however many categories there are
+        return self.get_visible_categories().with_user_flags(
+            self.request.user
+        ).select_related('created_by__department')
+
+    def get_validator_queryset(self):
+        return self.get_visible_categories()
+
+    def get_list_validators(self, queryset):
+        state = category_list_state(queryset)
+        # not part of the category list
+        for key in ('topic_activity', 'pending_deltas', 'pending_activity'):
+            state.pop(key)
+        return sorted(state.items()), latest(state['category_updated'], state['topic_updated'])
+
+    def get_object_validators(self, category):
+        topics = category.topics.aggregate(topic_updated=Max('updated_at'))
+        parts = (
+            category.updated_at, category.active_topics_count,
+            category.user_can_view, category.user_can_reply,
+        )
+        return parts, latest(category.updated_at, topics['topic_updated'])
     
     def get_serializer_class(self):
         """Use different serializer for create/update"""
@@ -72,14 +93,10 @@ class CategoryViewSet(viewsets.ModelViewSet):
             )
         
         # Get topics user can view
-        topics = category.topics.filter(is_active=True)
-        accessible_topics = []
-        
-        for topic in topics:
-            if topic.can_user_view(request.user):
-                accessible_topics.append(topic.id)
+        filtered_topics = category.topics.filter(is_active=True).visible_to(
+            request.user
+        ).select_related('category', 'created_by__department').with_live_counters()
         
-        filtered_topics = topics.filter(id__in=accessible_topics)
         serializer = TopicListSerializer(filtered_topics, many=True)
         return Response(serializer.data)
     
@@ -122,7 +139,7 @@ class CategoryViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class TopicViewSet(viewsets.ModelViewSet):
+class TopicViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """ViewSet for managing topics"""
     serializer_class = TopicSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -134,24 +151,11 @@ class TopicViewSet(viewsets.ModelViewSet):
         """
         user = self.request.user
         
-        # Start with all active topics
-        queryset = Topic.objects.filter(is_active=True)
-        
-        # Apply user-specific filtering (admin vs. regular user permissions)
-        if user.is_admin():
-            # Admins can see all active topics
-            pass
-        else:
-            # Regular users: hide archived topics and apply user-specific view permissions
-            queryset = queryset.filter(is_archived=False)
-            
-            # This permission check can be inefficient for large datasets.
-            # For better performance, consider using Django's Q objects or
-            # optimizing the `can_user_view` method to use database queries.
-            accessible_topics_ids = [
-                topic.id for topic in queryset if topic.can_user_view(user)
-            ]
-            queryset = queryset.filter(id__in=accessible_topics_ids)
+        # Active topics; regular users additionally lose archived topics and
+        # anything their restrictions hide (see TopicQuerySet.accessible_to)
+        queryset = Topic.objects.accessible_to(user).select_related(
+            'category', 'created_by__department'
+        ).with_live_counters()
 
         # *** Crucial Fix: Filter by category if 'category' ID is provided in query parameters ***
         category_id = self.request.query_params.get('category')
@@ -174,18 +178,36 @@ class TopicViewSet(viewsets.ModelViewSet):
         
         return queryset
 
-        
-        # Regular users: hide archived topics
-        queryset = queryset.filter(is_archived=False)
-        
-        # For regular users, filter based on permissions
-        accessible_topics = [
-        topic.id for topic in queryset if topic.can_user_view(user)
-    ]
+    def get_list_validators(self, queryset):
+        # Pending counter deltas change the served counts before they are folded
+        state = queryset.order_by().aggregate(
+            topic_count=Count('id', distinct=True),
+            topic_updated=Max('updated_at'),
+            topic_activity=Max('last_activity'),
+            category_updated=Max('category__updated_at'),
+            pending_deltas=Max('counter_deltas__id'),
+            pending_activity=Max('counter_deltas__last_activity'),
+        )
+        return sorted(state.items()), latest(
+            state['topic_updated'], state['topic_activity'], state['category_updated'],
+            state['pending_activity'],
+        )
 
-        return queryset.filter(id__in=accessible_topics)
+    def get_object_validators(self, topic):
+        # The nested category reports its active topic count
+        siblings = Topic.objects.filter(category_id=topic.category_id).aggregate(
+            topic_count=Count('id', filter=Q(is_active=True)),
+            topic_updated=Max('updated_at'),
+        )
+        parts = (
+            topic.updated_at, topic.current_last_activity, topic.current_total_messages,
+            topic.category.updated_at, sorted(siblings.items()),
+        )
+        return parts, latest(
+            topic.updated_at, topic.current_last_activity, topic.category.updated_at,
+            siblings['topic_updated'],
+        )
 
-    
     def get_serializer_class(self):
         """Use different serializer for create"""
         if self.action == 'create':
@@ -213,7 +235,7 @@ class TopicViewSet(viewsets.ModelViewSet):
         topic.is_closed = True
         topic.closed_by = request.user
         topic.closed_at = timezone.now()
-        topic.save()
+        topic.save(update_fields=['is_closed', 'closed_by', 'closed_at', 'updated_at'])
         
         serializer = TopicSerializer(topic, context={'request': request})
         return Response(serializer.data)
@@ -232,7 +254,7 @@ class TopicViewSet(viewsets.ModelViewSet):
         topic.is_closed = False
         topic.closed_by = None
         topic.closed_at = None
-        topic.save()
+        topic.save(update_fields=['is_closed', 'closed_by', 'closed_at', 'updated_at'])
         
         serializer = TopicSerializer(topic, context={'request': request})
         return Response(serializer.data)
@@ -277,7 +299,7 @@ class TopicViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['get'])
     def search(self, request):
-        """Search topics by title or description"""
+        """Search topics by title or description, most relevant first"""
         query = request.query_params.get('q', '')
         category_id = request.query_params.get('category', '')
         
@@ -290,10 +312,8 @@ class TopicViewSet(viewsets.ModelViewSet):
         # Start with user's accessible topics
         queryset = self.get_queryset()
         
-        # Filter by search query
-        queryset = queryset.filter(
-            Q(title__icontains=query) | Q(description__icontains=query)
-        )
+        # Ranked full-text match on title and description (see search.backends)
+        queryset = get_search_backend().search_topics(queryset, query)
         
         # Filter by category if specified
         if category_id:
@@ -3,6 +3,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.utils.html import format_html # Import for potential formatting
 from .models import CustomUser, Department, UserRegistrationRequest
+from .user_cache import invalidate_users
 
 @admin.register(Department)
 class DepartmentAdmin(admin.ModelAdmin):
@@ -34,28 +35,35 @@ class CustomUserAdmin(UserAdmin):
     actions = ['approve_users', 'make_admin', 'make_user', 'deactivate_users', 'activate_users'] # Added new actions
     list_per_page = 20 # Add pagination limit
 
+    def _update_users(self, queryset, **changes):
+        # update() sends no post_save; drop the cached records explicitly
+        user_ids = list(queryset.values_list('id', flat=True))
+        updated = CustomUser.objects.filter(id__in=user_ids).update(**changes)
+        invalidate_users(user_ids)
+        return updated
+
     def approve_users(self, request, queryset):
-        updated = queryset.update(is_approved=True)
+        updated = self._update_users(queryset, is_approved=True)
         self.message_user(request, f'{updated} users approved successfully.')
     approve_users.short_description = "Approve selected users"
 
     def deactivate_users(self, request, queryset):
-        updated = queryset.update(is_active=False)
+        updated = self._update_users(queryset, is_active=False)
         self.message_user(request, f'{updated} users deactivated successfully.')
     deactivate_users.short_description = "Deactivate selected users"
 
     def activate_users(self, request, queryset):
-        updated = queryset.update(is_active=True)
+        updated = self._update_users(queryset, is_active=True)
         self.message_user(request, f'{updated} users activated successfully.')
     activate_users.short_description = "Activate selected users"
 
     def make_admin(self, request, queryset):
-        updated = queryset.update(role='admin', is_staff=True) # Make staff for admin role
+        updated = self._update_users(queryset, role='admin', is_staff=True) # Make staff for admin role
         self.message_user(request, f'{updated} users made admin.')
     make_admin.short_description = "Make selected users admin"
 
     def make_user(self, request, queryset):
-        updated = queryset.update(role='user', is_staff=False) # Remove staff for regular user
+        updated = self._update_users(queryset, role='user', is_staff=False) # Remove staff for regular user
         self.message_user(request, f'{updated} users made regular user.')
     make_user.short_description = "Make selected users regular user"
 
@@ -0,0 +1,21 @@
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from .user_cache import get_token_user_id, get_user
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication resolving the token and its user through users.user_cache"""
+
+    def authenticate_credentials(self, key):
+        model = self.get_model()
+        user_id = get_token_user_id(key)
+        user = get_user(user_id) if user_id is not None else None
+        if user is None:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        # Not fetched: only its key and owner are known
+        token = model(key=key, user=user)
+        token._state.adding = False
+        return user, token
@@ -1,28 +1,39 @@
 from django.contrib.auth.backends import ModelBackend
+from users.hashing import hash_password, verify_password
 from users.models import CustomUser
+from users.user_cache import get_user
 
-class ApprovedUserBackend(ModelBackend):
-    def authenticate(self, request, username=None, password=None, **kwargs):
-        print("AUTH BACKEND: authenticate called")
-        print(f"Username: {username}")
 
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend that resolves session users through users.user_cache and
+    checks passwords in the users.hashing pool.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(CustomUser.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
         try:
-            user = CustomUser.objects.get(username=username)
-            print(f"User found: {user.username} | is_superuser: {user.is_superuser} | is_approved: {user.is_approved}")
+            user = CustomUser._default_manager.get_by_natural_key(username)
+        except CustomUser.DoesNotExist:
+            # Hash anyway, so unknown usernames take as long as wrong passwords
+            hash_password(password)
+            return None
+        if verify_password(user, password) and self.user_can_authenticate(user):
+            return user
+        return None
 
-            if user.check_password(password):
-                print("Password is correct")
+    def get_user(self, user_id):
+        user = get_user(user_id)
+        return user if self.user_can_authenticate(user) else None
 
-                if user.is_superuser or user.is_approved:
-                    print("Authentication success")
-                    return user
-                else:
-                    print("User not approved")
-            else:
-                print("Invalid password")
 
-        except CustomUser.DoesNotExist:
-            print("User not found")
+class ApprovedUserBackend(CachedModelBackend):
+    """Also refuses users an admin has not approved yet"""
 
-        print("Authentication failed")
-        return None
+    def user_can_authenticate(self, user):
+        return super().user_can_authenticate(user) and (
+            user is None or user.is_superuser or user.is_approved
+        )
@@ -129,6 +129,8 @@ class CodeVerificationForm(forms.Form):
 
 class CustomLoginForm(forms.Form):
     """Custom login form"""
+
+    user_cache = None
     
     username = forms.CharField(
         max_length=150,
@@ -152,7 +154,7 @@ class CustomLoginForm(forms.Form):
         password = cleaned_data.get('password')
         
         if username and password:
-            user = authenticate(username=username, password=password)
+            self.user_cache = user = authenticate(username=username, password=password)
             if user is None:
                 raise forms.ValidationError("Invalid username or password.")
             
@@ -165,6 +167,10 @@ class CustomLoginForm(forms.Form):
         
         return cleaned_data
 
+    def get_user(self):
+        """The user authenticated by clean(), so the password is only hashed once"""
+        return self.user_cache
+
 
 class AdminApprovalForm(forms.ModelForm):
     """Form for admin to approve/reject registration requests"""
@@ -0,0 +1,85 @@
+"""
+Password hashing off the request threads, in a bounded pool.
+
+Checking or setting a password runs the full PBKDF2 work factor, tens of
+milliseconds of CPU.  Each process hashes in at most AUTH_HASH_WORKERS
+threads, so a login storm cannot take every CPU away from message traffic.
+At most AUTH_HASH_QUEUE more hashes wait for a thread.  Past that,
+AuthOverloaded is raised at once and the view answers 503, which is cheaper
+than queueing work the client will have given up on.
+
+Only the hashing runs in the pool.  Database access stays on the request
+thread, with its connection and transaction.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+
+
+class AuthOverloaded(Exception):
+    """Too many password hashes are queued already"""
+
+    retry_after = 5  # seconds
+
+
+class HashPool:
+
+    def __init__(self, workers, queue):
+        self.workers = workers
+        self.slots = threading.BoundedSemaphore(workers + queue)
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def _executor(self):
+        with self.lock:
+            # Threads do not survive a fork; start a fresh pool in each worker
+            if self.pid != os.getpid():
+                self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='auth-hash')
+                self.pid = os.getpid()
+            return self.executor
+
+    def run(self, fn, *args):
+        """fn(*args) on a pool thread; raises AuthOverloaded when the queue is full"""
+        if not self.slots.acquire(blocking=False):
+            raise AuthOverloaded
+        try:
+            future = self._executor().submit(fn, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future.result()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = HashPool(
+                getattr(settings, 'AUTH_HASH_WORKERS', 2),
+                getattr(settings, 'AUTH_HASH_QUEUE', 16),
+            )
+        return _pool
+
+
+def verify_password(user, raw_password):
+    """user.check_password(), with the hashing done in the pool"""
+    upgraded = []
+    is_correct = get_pool().run(check_password, raw_password, user.password, upgraded.append)
+    if upgraded:
+        # The stored hash uses an outdated hasher or work factor
+        user.password = hash_password(raw_password)
+        user.save(update_fields=['password'])
+    return is_correct
+
+
+def hash_password(raw_password):
+    """make_password(), in the pool"""
+    return get_pool().run(make_password, raw_password)
@@ -43,6 +43,15 @@ class CustomUser(AbstractUser):
     def get_department_name(self):
         return self.department.name if self.department else "No Department"
 
+    def get_session_auth_hash(self):
+        # Users rebuilt from users.user_cache carry the hash, not the password
+        cached = getattr(self, '_session_auth_hash', None)
+        return cached or super().get_session_auth_hash()
+
+    def set_password(self, raw_password):
+        self._session_auth_hash = None
+        super().set_password(raw_password)
+
 
 class UserRegistrationRequest(models.Model):
     """Model for handling user registration requests that need admin approval"""
@@ -0,0 +1,30 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .models import CustomUser, Department
+from .user_cache import forget_token, invalidate_users
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_user_record(sender, instance, **kwargs):
+    invalidate_users([instance.pk])
+
+
+@receiver(post_save, sender=Department)
+def invalidate_department_members(sender, instance, created, **kwargs):
+    """Records carry the department name"""
+    if not created:
+        invalidate_users(instance.customuser_set.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Department)
+def invalidate_department_members_on_delete(sender, instance, **kwargs):
+    # Collected before deletion nulls the members' department in bulk
+    invalidate_users(instance.customuser_set.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    forget_token(instance.key)
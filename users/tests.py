@@ -1,3 +1,212 @@
-from django.test import TestCase
+import threading
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from conversations.models import Message
+from topics.models import Category, Topic, TopicRestriction
+from topics.permission_cache import get_permission_version
+from .hashing import AuthOverloaded, HashPool
+from .models import CustomUser, Department
+from .user_cache import get_user
+
+
+def user_lookups(queries):
+    """Queries fetching a user row by primary key"""
+    return [q['sql'] for q in queries if 'FROM "users_customuser" WHERE "users_customuser"."id" =' in q['sql']]
+
+
+class UserCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.department = Department.objects.create(name='Support')
+        cls.user = CustomUser.objects.create_user(
+            username='member', password='secret', department=cls.department, is_approved=True
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_repeat_lookups_skip_the_database(self):
+        get_user(self.user.pk)
+        with self.assertNumQueries(0):
+            user = get_user(self.user.pk)
+            self.assertEqual(user.get_department_name(), 'Support')
+            self.assertFalse(user.is_admin())
+            self.assertEqual(user.get_session_auth_hash(), self.user.get_session_auth_hash())
+
+    def test_session_requests_skip_the_user_query(self):
+        client = APIClient()
+        client.force_login(self.user)
+        client.get('/api/topics/topics/')
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/api/topics/topics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(user_lookups(queries), [])
+
+    def test_token_requests_skip_the_token_query(self):
+        token = Token.objects.create(user=self.user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        client.get('/api/topics/topics/')
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/api/topics/topics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in queries if 'authtoken_token' in q['sql']])
+        self.assertEqual(user_lookups(queries), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            token.delete()
+        self.assertEqual(client.get('/api/topics/topics/').status_code, 403)
+
+    def test_admin_actions_invalidate(self):
+        admin = CustomUser.objects.create_superuser(username='root', password='secret')
+        client = APIClient()
+        client.force_login(admin)
+        get_user(self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            client.post('/admin/users/customuser/', {
+                'action': 'make_admin', '_selected_action': [self.user.pk],
+            })
+        self.assertTrue(get_user(self.user.pk).is_admin())
+
+    def test_department_rename_invalidates(self):
+        get_user(self.user.pk)
+        self.department.name = 'Operations'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.department.save()
+        self.assertEqual(get_user(self.user.pk).get_department_name(), 'Operations')
+
+
+class DashboardSnapshotTests(TestCase):
+    url = '/users/api/dashboard-snapshot/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='member', password='secret', is_approved=True)
+        category = Category.objects.create(name='General', created_by=cls.user)
+        cls.topic = Topic.objects.create(title='Hello', category=category, created_by=cls.user)
+        Message.objects.create(topic=cls.topic, sender=cls.user, content='old')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, etag=None, **params):
+        return self.client.get(self.url, params, **({'HTTP_IF_NONE_MATCH': etag} if etag else {}))
+
+    def recent(self, response):
+        return [m['content'] for m in response.data['recent_messages']]
+
+    def test_payload(self):
+        first = Message.objects.get()
+        for content in ('one', 'two'):
+            Message.objects.create(topic=self.topic, sender=self.user, content=content)
+
+        response = self.get()
+        self.assertEqual([c['name'] for c in response.data['categories']], ['General'])
+        self.assertIsNone(response.data['topic'])
+        self.assertIsNone(response.data['messages'])
+        self.assertEqual(self.recent(response), ['two', 'one', 'old'])
+
+        with mock.patch('users.views.SNAPSHOT_MESSAGE_LIMIT', 1):
+            response = self.get(topic=self.topic.pk, after_id=first.pk)
+        self.assertEqual(response.data['topic']['title'], 'Hello')
+        messages = response.data['messages']
+        self.assertEqual([m['content'] for m in messages['results']], ['one'])
+        self.assertEqual(messages['after_id'], messages['results'][0]['id'])
+        self.assertTrue(messages['has_more'])
+
+        response = self.get(topic=self.topic.pk, after_id=messages['after_id'])
+        self.assertEqual([m['content'] for m in response.data['messages']['results']], ['two'])
+        self.assertFalse(response.data['messages']['has_more'])
+
+        self.assertEqual(self.get(topic='abc').status_code, 400)
+
+    def test_not_modified(self):
+        first = self.get(topic=self.topic.pk)
+        self.assertNotIn('Last-Modified', first)
+        with self.assertNumQueries(2):
+            response = self.get(first['ETag'], topic=self.topic.pk)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], first['ETag'])
+
+        # Other parameters, or a topic the user can no longer see, answer in full
+        self.assertEqual(self.get(first['ETag']).status_code, 200)
+        admin = CustomUser.objects.create(username='admin', role='admin')
+        with self.captureOnCommitCallbacks(execute=True):
+            TopicRestriction.objects.create(topic=self.topic, user=self.user, can_view=False, created_by=admin)
+        response = self.get(first['ETag'], topic=self.topic.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data['topic'])
+
+    def test_stale_feed_is_not_pinned_by_the_etag(self):
+        first = self.get()
+        self.assertEqual(self.recent(first), ['old'])
+
+        # The cached feed still lags behind the post
+        self.client.post('/api/conversations/messages/', {'topic': self.topic.pk, 'content': 'new'}, format='json')
+        second = self.get(first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(self.recent(second), ['old'])
+
+        # Once it expires, the next refresh sees a different ETag
+        cache.delete('feed:recent:{}:5:{}:{}'.format(self.user.pk, *get_permission_version(self.user)))
+        third = self.get(second['ETag'])
+        self.assertEqual(third.status_code, 200)
+        self.assertEqual(self.recent(third), ['new', 'old'])
+
+
+@override_settings(AUTH_THROTTLE_RATES={'ip': (4, 60), 'username': (2, 60)})
+class LoginThrottleTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        CustomUser.objects.create_user(username='member', password='secret', is_approved=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_username_bucket(self):
+        for _ in range(2):
+            response = self.client.post('/users/login/', {'username': 'member', 'password': 'wrong'})
+            self.assertEqual(response.status_code, 200)
+        response = self.client.post('/users/login/', {'username': 'Member', 'password': 'secret'})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+
+        # Other usernames still go through, until the IP bucket runs dry too
+        response = self.client.post('/users/login/', {'username': 'other', 'password': 'x'})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post('/users/api/verify-code/', {'username': 'someone'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()['success'], False)
+
+    def test_login_hashes_once(self):
+        response = self.client.post('/users/login/', {'username': 'member', 'password': 'secret'})
+        self.assertRedirects(response, '/users/dashboard/', fetch_redirect_response=False)
+
+
+class HashPoolTests(TestCase):
+
+    def test_full_queue_is_refused(self):
+        pool = HashPool(workers=1, queue=1)
+        release = threading.Event()
+        waiters = [threading.Thread(target=pool.run, args=(release.wait,)) for _ in range(2)]
+        for waiter in waiters:
+            waiter.start()
+        while pool.slots._value:
+            pass
+        with self.assertRaises(AuthOverloaded):
+            pool.run(len, 'x')
+        release.set()
+        for waiter in waiters:
+            waiter.join()
+        self.assertEqual(pool.run(len, 'x'), 1)
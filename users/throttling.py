@@ -0,0 +1,102 @@
+"""
+Token-bucket throttling of the password endpoints, per client IP and per
+username, kept in Django's cache so every worker shares the buckets.
+
+Each bucket holds up to `burst` attempts and refills continuously, `burst`
+attempts every `period` seconds (AUTH_THROTTLE_RATES).  Every POST to a
+protected view takes one token from its IP's bucket and one from the
+bucket of the username it names, before any password is hashed.
+
+Buckets are read and written without a lock, so concurrent attempts can
+occasionally both take the last token.  That lets a handful of extra
+attempts through under contention, which is fine for CPU protection.
+"""
+import hashlib
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.shortcuts import render
+
+from .hashing import AuthOverloaded
+
+
+DEFAULT_RATES = {
+    'ip': (30, 60),  # (burst, seconds to refill it)
+    'username': (5, 60),
+}
+
+
+class TokenBucket:
+
+    def __init__(self, scope, burst, period):
+        self.scope = scope
+        self.burst = burst
+        self.rate = burst / period  # tokens per second
+
+    def _key(self, ident):
+        # Usernames are user input; hash them into safe cache keys
+        return f'auth-throttle:{self.scope}:' + hashlib.sha256(ident.encode()).hexdigest()[:32]
+
+    def take(self, ident):
+        """Take a token for `ident`: 0 if there was one, else seconds until there is"""
+        key = self._key(ident)
+        now = time.time()
+        tokens, updated = cache.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            return (1 - tokens) / self.rate
+        # Expire once the bucket would be full again
+        cache.set(key, (tokens - 1, now), math.ceil(self.burst / self.rate) + 1)
+        return 0
+
+
+def buckets():
+    rates = getattr(settings, 'AUTH_THROTTLE_RATES', DEFAULT_RATES)
+    return [TokenBucket(scope, *rates[scope]) for scope in ('ip', 'username')]
+
+
+def wait_time(request):
+    """Seconds the client must wait before this attempt may proceed; 0 if it may now"""
+    ip_bucket, username_bucket = buckets()
+    wait = ip_bucket.take(request.META.get('REMOTE_ADDR', ''))
+    username = request.POST.get('username', '').strip().lower()
+    if not wait and username:
+        wait = username_bucket.take(username)
+    return wait
+
+
+def auth_throttle(template=None, form_class=None):
+    """
+    Throttles POSTs to a password view and turns AuthOverloaded into a 503.
+
+    HTML views (`template` and `form_class` given) re-render their form
+    with an error message; the others answer JSON.
+    """
+    def rejected(request, status, retry_after, message):
+        if template:
+            messages.error(request, message)
+            response = render(request, template, {'form': form_class()}, status=status)
+        else:
+            response = JsonResponse({'success': False, 'message': message}, status=status)
+        response['Retry-After'] = str(math.ceil(retry_after))
+        return response
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'POST':
+                return view(request, *args, **kwargs)
+            wait = wait_time(request)
+            if wait:
+                return rejected(request, 429, wait, 'Too many attempts. Please try again later.')
+            try:
+                return view(request, *args, **kwargs)
+            except AuthOverloaded as e:
+                return rejected(request, 503, e.retry_after, 'The server is busy. Please try again shortly.')
+        return wrapper
+    return decorator
@@ -26,4 +26,5 @@ urlpatterns = [
     path('api/register/', views.api_register_request, name='api_register_request'),
     path('api/verify-code/', views.api_verify_code, name='api_verify_code'),
     path('api/dashboard-data/', views.dashboard_data_api_view, name='api_dashboard_data'),
+    path('api/dashboard-snapshot/', views.dashboard_snapshot_api_view, name='api_dashboard_snapshot'),
 ]
\ No newline at end of file
@@ -0,0 +1,127 @@
+"""
+Cached resolution of the authenticated user.
+
+Session and token authentication resolve the user on every request.  The
+fields requests actually need (role, flags, department name, the session
+auth hash) are kept as a compact record in Django's cache, and the user is
+rebuilt from it with `CustomUser.from_db`, without a query.  Fields left
+out of the record (password, email, ...) are deferred: reading one loads
+it from the database as usual.
+
+Record keys embed a per-user version, bumped after commit whenever the
+user is saved or deleted, their department renamed, or an admin action
+updates them in bulk (see users.signals and users.admin).  As in
+topics.permission_cache, a bumped version makes older records unreachable.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import CustomUser, Department
+
+
+RECORD_TIMEOUT = getattr(settings, 'USER_RECORD_CACHE_TIMEOUT', 15 * 60)
+
+# Fields kept in the record; every other field is deferred
+RECORD_FIELDS = (
+    'id', 'username', 'first_name', 'last_name', 'role', 'is_superuser',
+    'is_staff', 'is_active', 'is_approved', 'department_id',
+)
+
+
+def _version_key(user_id):
+    return f'user:version:{user_id}'
+
+
+def _record_key(user_id, version):
+    return f'user:record:{user_id}:{version}'
+
+
+def _token_key(key):
+    # Raw tokens are credentials; keep them out of cache keys
+    return 'user:token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def _new_version():
+    # Seeded from the clock, as in topics.permission_cache
+    return int(time.time() * 1000)
+
+
+def _get_version(user_id):
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = _new_version()
+        # add() so a concurrent bump is not overwritten
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def invalidate_users(user_ids):
+    """Drop the cached records of `user_ids` once the current transaction commits"""
+    user_ids = list(user_ids)
+
+    def bump():
+        for user_id in user_ids:
+            try:
+                cache.incr(_version_key(user_id))
+            except ValueError:
+                cache.set(_version_key(user_id), _new_version(), None)
+
+    if user_ids:
+        transaction.on_commit(bump)
+
+
+def _to_record(user):
+    record = {field: getattr(user, field) for field in RECORD_FIELDS}
+    record['department_name'] = user.department.name if user.department_id else None
+    record['session_auth_hash'] = user.get_session_auth_hash()
+    return record
+
+
+def _from_record(record):
+    # from_db() takes the values in model field order
+    fields = [f.attname for f in CustomUser._meta.concrete_fields if f.attname in RECORD_FIELDS]
+    user = CustomUser.from_db('default', fields, [record[field] for field in fields])
+    if record['department_id'] is not None:
+        user.department = Department.from_db(
+            'default', ['id', 'name'], [record['department_id'], record['department_name']]
+        )
+    user._session_auth_hash = record['session_auth_hash']
+    return user
+
+
+def get_user(user_id):
+    """The user with `user_id`, from the cache when possible; None if there is none"""
+    version = _get_version(user_id)
+    key = _record_key(user_id, version)
+    record = cache.get(key)
+    if record is not None:
+        return _from_record(record)
+
+    user = CustomUser.objects.select_related('department').filter(pk=user_id).first()
+    if user is not None:
+        cache.set(key, _to_record(user), RECORD_TIMEOUT)
+    return user
+
+
+def get_token_user_id(key):
+    """The id of the user owning the auth token `key`, or None if there is no such token"""
+    from rest_framework.authtoken.models import Token
+
+    cache_key = _token_key(key)
+    user_id = cache.get(cache_key)
+    if user_id is None:
+        user_id = Token.objects.filter(key=key).values_list('user_id', flat=True).first()
+        if user_id is not None:
+            cache.set(cache_key, user_id, RECORD_TIMEOUT)
+    return user_id
+
+
+def forget_token(key):
+    """Drop the cached owner of a deleted token once the current transaction commits"""
+    transaction.on_commit(lambda: cache.delete(_token_key(key)))
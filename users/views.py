@@ -1,5 +1,5 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth import login, authenticate
+from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
 from django.http import JsonResponse
@@ -15,6 +15,10 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
 from topics.models import CategoryRestriction, TopicRestriction
+from topics.conditional import (
+    category_list_state, conditional_response, make_etag,
+    permission_validators, set_validators
+)
 
 # Import models and serializers from current app
 from .models import CustomUser, Department, UserRegistrationRequest
@@ -25,23 +29,27 @@ from .forms import (
     AdminApprovalForm
 )
 from .serializers import UserSummarySerializer
+from .hashing import hash_password
+from .throttling import auth_throttle
 
 # Import models and serializers from other apps
 # Ensure 'conversations' app is correctly set up and its models/serializers exist
 try:
     from conversations.models import Message
     from conversations.serializers import MessageSerializer
+    from conversations.feed import recent_activity
     from topics.models import Topic, Category # Needed for related lookups if you query by topic/category
-    # No direct import of TopicSerializer or CategorySerializer from 'topics' here,
-    # as we're only using MessageSerializer to serialize 'recent_messages'.
-    # If you needed full Topic/Category objects in the dashboard data, you'd import their serializers.
+    from topics.serializers import CategorySerializer, TopicSerializer # Used by the dashboard snapshot
 except ImportError as e:
     print(f"Warning: Failed to import models/serializers from 'conversations' or 'topics': {e}")
     Message = None
     # If Message or Topic models aren't found, set their serializers to None as well
     MessageSerializer = None
+    recent_activity = None
     Topic = None
     Category = None
+    CategorySerializer = None
+    TopicSerializer = None
 
 
 def is_admin(user):
@@ -49,6 +57,26 @@ def is_admin(user):
     return user.is_authenticated and user.is_admin()
 
 
+def create_verified_user(reg_request, password):
+    """Create the account of a verified registration request"""
+    # Hash first, in the bounded pool, so an overload leaves nothing behind
+    encoded = hash_password(password)
+    user = CustomUser.objects.create_user(
+        username=reg_request.username,
+        email=reg_request.email,
+        first_name=reg_request.first_name,
+        last_name=reg_request.last_name,
+        password=None,
+        department=reg_request.department,
+        whatsapp_number=reg_request.whatsapp_number,
+        is_approved=True,
+        role='user'
+    )
+    user.password = encoded
+    user.save(update_fields=['password'])
+    return user
+
+
 def register_request(request):
     """Handle user registration requests"""
     if request.method == 'POST':
@@ -72,6 +100,7 @@ def registration_success(request):
     return render(request, 'users/registration_success.html')
 
 
+@auth_throttle('users/verify_code.html', CodeVerificationForm)
 def verify_code(request):
     """Handle code verification and password setup"""
     if request.method == 'POST':
@@ -95,31 +124,16 @@ def verify_code(request):
                     return render(request, 'users/verify_code.html', {'form': form})
                 
                 # Create the user account
-                user = CustomUser.objects.create_user(
-                    username=reg_request.username,
-                    email=reg_request.email,
-                    first_name=reg_request.first_name,
-                    last_name=reg_request.last_name,
-                    password=password,
-                    department=reg_request.department,
-                    whatsapp_number=reg_request.whatsapp_number,
-                    is_approved=True,
-                    role='user'
-                )
+                user = create_verified_user(reg_request, password)
                 
                 # Clear the one-time code
                 reg_request.one_time_code = ''
                 reg_request.save()
 
-                # Authenticate and login the user
-                user = authenticate(request, username=username, password=password)
-                if user is not None:
-                    login(request, user)
-                    messages.success(request, 'Account created successfully! Welcome to Pixel Flow Communications.')
-                    return redirect('dashboard')
-                else:
-                    messages.error(request,'Account created but login failed. Please try logging in manually')
-                    return redirect('login')
+                # The password was just set; no need to authenticate it again
+                login(request, user)
+                messages.success(request, 'Account created successfully! Welcome to Pixel Flow Communications.')
+                return redirect('dashboard')
             except UserRegistrationRequest.DoesNotExist:
                 messages.error(request, 'Invalid username or verification code.')
     else:
@@ -128,15 +142,13 @@ def verify_code(request):
     return render(request, 'users/verify_code.html', {'form': form})
 
 
+@auth_throttle('users/login.html', CustomLoginForm)
 def user_login(request):
     """Handle user login"""
     if request.method == 'POST':
         form = CustomLoginForm(request.POST)
         if form.is_valid():
-            username = form.cleaned_data['username']
-            password = form.cleaned_data['password']
-
-            user = authenticate(username=username, password=password)
+            user = form.get_user()
 
             if user:
 
@@ -311,20 +323,9 @@ def dashboard_data_api_view(request):
         # for recent activity, and your MessageSerializer provides these,
         # we can fetch messages and serialize them directly.
         
-        # This query fetches the 5 most recent messages overall.
-        # You might want to filter this further based on user's departments,
-        # topics they are members of, or messages they were tagged in.
-        # For example, to get messages from topics the user can view:
-        if Topic: # Ensure Topic model is available
-            user_viewable_topics_ids = [t.id for t in Topic.objects.all() if t.can_user_view(user)]
-            # Filter messages by topics the user can view
-            recent_messages = Message.objects.filter(topic_id__in=user_viewable_topics_ids).order_by('-created_at')[:5]
-        else: # Fallback if Topic model isn't available
-            recent_messages = Message.objects.order_by('-created_at')[:5] 
-
-        # Pass the request context to the serializer for methods like get_can_view/can_reply
-        # (Though MessageSerializer doesn't directly use this, it's good practice for others)
-        recent_messages_data = MessageSerializer(recent_messages, many=True, context={'request': request}).data
+        # The 5 newest messages from topics the user can view: one bounded
+        # query over the Message(created_at) index, cached briefly per user
+        recent_messages_data = recent_activity(user)
     else:
         print("Debug: Message model or MessageSerializer not available. Recent activity data will be empty.")
 
@@ -336,6 +337,90 @@ def dashboard_data_api_view(request):
     })
 
 
+# Cap on new messages per snapshot; clients reload the topic when exceeded
+SNAPSHOT_MESSAGE_LIMIT = 50
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def dashboard_snapshot_api_view(request):
+    """
+    Everything one dashboard refresh needs, in a single response:
+    categories, the current topic (?topic=<id>), its messages newer than
+    ?after_id=<id>, and recent activity.
+
+    The response carries an ETag built from the user's permission version,
+    the category/topic timestamps and the recent activity served, so an idle
+    refresh that sends If-None-Match costs two small queries and a 304.
+    """
+    if not (Message and Topic):
+        return Response({'error': 'Dashboard data is unavailable'}, status=503)
+
+    user = request.user
+    topic_id = request.query_params.get('topic')
+    after_id = request.query_params.get('after_id')
+    try:
+        topic_id = int(topic_id) if topic_id else None
+        after_id = int(after_id) if after_id else None
+    except ValueError:
+        return Response({'error': 'topic and after_id must be integers'}, status=400)
+
+    # One permission context for the whole payload: the SQL visibility rules
+    # below and the serializers' can_view/can_reply checks (which read the
+    # snapshot memoised on the user) agree on the same version.
+    categories = Category.objects.filter(is_active=True)
+    if not user.is_admin():
+        categories = categories.visible_to(user)
+    topic = None
+    if topic_id:
+        topic = Topic.objects.accessible_to(user).select_related(
+            'category__created_by__department', 'created_by__department', 'closed_by__department'
+        ).with_live_counters().filter(pk=topic_id).first()
+
+    # Validator: every new message bumps some topic's last_activity, and
+    # category/topic edits bump updated_at.  The recent activity feed is
+    # cached and can lag behind those, so the ETag also covers the feed
+    # served; otherwise a refresh racing a post would pin the stale feed
+    # under the new ETag.  There is no Last-Modified: a timestamp cannot
+    # tell a stale feed from a fresh one.
+    state = category_list_state(categories)
+    user_parts, _ = permission_validators(user)
+    recent = recent_activity(user)
+    etag = make_etag(
+        user_parts, sorted(state.items()), topic_id, after_id,
+        topic and (topic.updated_at, topic.current_last_activity, topic.current_total_messages),
+        recent,
+    )
+    not_modified = conditional_response(request, etag)
+    if not_modified is not None:
+        return not_modified
+
+    context = {'request': request}
+    data = {
+        'categories': CategorySerializer(
+            categories.with_user_flags(user).select_related('created_by__department'),
+            many=True, context=context
+        ).data,
+        'topic': TopicSerializer(topic, context=context).data if topic else None,
+        'messages': None,
+        'recent_messages': recent,
+    }
+
+    if topic and after_id:
+        limit = SNAPSHOT_MESSAGE_LIMIT
+        new_messages = list(
+            Message.objects.filter(topic=topic).after(after_id).select_related('topic', 'sender')
+            .prefetch_related('tagged_users').order_by('created_at', 'id')[:limit + 1]
+        )
+        data['messages'] = {
+            'results': MessageSerializer(new_messages[:limit], many=True, context=context).data,
+            'after_id': new_messages[:limit][-1].id if new_messages else after_id,
+            'has_more': len(new_messages) > limit,
+        }
+
+    return set_validators(Response(data), etag)
+
+
 @csrf_exempt
 def api_register_request(request):
     """API endpoint for registration requests"""
@@ -357,6 +442,7 @@ def api_register_request(request):
 
 
 @csrf_exempt
+@auth_throttle()
 def api_verify_code(request):
     """API endpoint for code verification"""
     if request.method == 'POST':
@@ -379,17 +465,7 @@ def api_verify_code(request):
                         'message': 'Verification code has expired.'
                     })
                 
-                user = CustomUser.objects.create_user(
-                    username=reg_request.username,
-                    email=reg_request.email,
-                    first_name=reg_request.first_name,
-                    last_name=reg_request.last_name,
-                    password=password,
-                    department=reg_request.department,
-                    whatsapp_number=reg_request.whatsapp_number,
-                    is_approved=True,
-                    role='user'
-                )
+                user = create_verified_user(reg_request, password)
                 
                 reg_request.one_time_code = ''
                 reg_request.save()